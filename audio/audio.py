@@ -1,3 +1,4 @@
+import functools
 import model
 import pygame
 import os
@@ -107,6 +108,26 @@ class AudioManager:
 
         return sound
 
+    # A job for each sound file that loads it into the sounds cache for every sound that uses it
+    def get_preload_jobs(self):
+
+        sound_names_by_file = {}
+
+        for theme in self.sound_themes.values():
+            for sound_name, sound_file_name in theme.items():
+                if sound_file_name is not None:
+                    sound_names_by_file.setdefault(sound_file_name, []).append(sound_name)
+
+        return {sound_file_name: functools.partial(self.preload_sound, sound_file_name, sound_names)
+                for sound_file_name, sound_names in sound_names_by_file.items()}
+
+    def preload_sound(self, sound_file_name: str, sound_names: list):
+
+        sound = pygame.mixer.Sound(AudioManager.RESOURCES_DIR + sound_file_name)
+
+        for sound_name in sound_names:
+            self.sounds_cache.setdefault(sound_name, sound)
+
     def load_sound_themes(self):
 
         new_theme_name = AudioManager.DEFAULT_THEME
@@ -5,6 +5,7 @@ from pygame.locals import *
 
 import audio
 import model
+import utils
 import view
 
 
@@ -21,12 +22,16 @@ class Controller:
     KEY_BATTLE = K_b
     KEY_ATTACK = K_SPACE
     KEY_END_TURN = K_ESCAPE
+    KEY_SAVE = K_F8
+    KEY_LOAD = K_F9
 
     def __init__(self):
 
         self.game = model.Game("SQUOIDS")
         self.view = view.MainFrame(self.game, 1250, 800)
         self.audio = audio.AudioManager()
+        self.asset_loader = utils.AssetLoader()
+        self.assets_loaded = None
 
         self.initialise()
 
@@ -39,6 +44,11 @@ class Controller:
         pygame.mixer.pre_init(44100, -16, 2, 2048)
         pygame.mixer.init()
 
+        # Load all of the images and sounds in the background while the READY screen is showing
+        assets = view.View.image_manager.get_preload_jobs()
+        assets.update(self.audio.get_preload_jobs())
+        self.assets_loaded = self.asset_loader.load(assets, progress=self.view.game_ready.asset_loaded)
+
     def run(self):
 
         os.environ["SDL_VIDEO_CENTERED"] = "1"
@@ -96,10 +106,14 @@ class Controller:
                 elif event.type == USEREVENT + 2:
                     if self.game.state == model.Game.BATTLE:
                         self.game.battle.do_auto()
+                        self.view.mark_dirty()
 
                 # Key pressed events
                 elif event.type == KEYUP:
 
+                    # Key presses change the model directly so the view needs to be redrawn
+                    self.view.mark_dirty()
+
                     if self.game.state == model.Game.PLAYING:
 
                         try:
@@ -165,11 +179,21 @@ class Controller:
                         #     print(str(err))
 
                     elif self.game.state == model.Game.PAUSED:
-                        if event.key == Controller.KEY_PAUSE:
-                            self.game.pause(False)
+                        try:
+                            if event.key == Controller.KEY_PAUSE:
+                                self.game.pause(False)
+                            elif event.key == Controller.KEY_SAVE:
+                                self.game.save()
+                            elif event.key == Controller.KEY_LOAD:
+                                self.game.load()
+
+                        except Exception as err:
+                            print(str(err))
 
                     elif self.game.state == model.Game.READY:
                         if event.key == Controller.KEY_START:
+                            # Don't start until everything has been loaded
+                            self.assets_loaded.result()
                             self.game.start()
 
                     elif self.game.state == model.Game.GAME_OVER:
@@ -181,6 +205,7 @@ class Controller:
 
             FPSCLOCK.tick(50)
 
+        self.asset_loader.end()
         self.view.end()
         self.audio.end()
         self.game.end()
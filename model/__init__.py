@@ -6,3 +6,4 @@ from .model import Objects
 from .model import Player
 from .model import FloorObject
 from .model import Attack
+from .model import BattleSimulator
@@ -4,13 +4,14 @@ from utils.trpg import RPGObject
 from utils.trpg import RPGCharacter
 from utils.trpg import CoreStat
 from utils.trpg import DerivedStat
+from utils.trpg import StatTable
 
 
 
 class RPGDerivedStat(DerivedStat):
 
-    def __init__(self, name: str, category: str, owner: RPGObject):
-        super(RPGDerivedStat, self).__init__(name, category)
+    def __init__(self, name: str, category: str, owner: RPGObject, lazy: bool = False):
+        super(RPGDerivedStat, self).__init__(name, category, lazy)
         self._owner = owner
 
     def add_dependency(self, dependent_stat, optional: bool = False, default_value: float = 0):
@@ -280,7 +281,7 @@ class XPToLevel(RPGDerivedStat):
 
 class LevelUP(RPGDerivedStat):
     def __init__(self, owner: RPGObject):
-        super(LevelUP, self).__init__("LevelUp", "Attributes", owner=owner)
+        super(LevelUP, self).__init__("LevelUp", "Attributes", owner=owner, lazy=True)
         self.add_dependency("XPToLevel")
         self.add_dependency("Level")
 
@@ -330,7 +331,7 @@ class HP(RPGDerivedStat):
 
 class XPReward(RPGDerivedStat):
     def __init__(self, owner: RPGObject):
-        super(XPReward, self).__init__("XPReward", "Attributes", owner=owner)
+        super(XPReward, self).__init__("XPReward", "Attributes", owner=owner, lazy=True)
         self.add_dependency("MaxHP")
         self.add_dependency("XPToLevel")
 
@@ -379,7 +380,7 @@ class LoadPct(RPGDerivedStat):
 
 class Score(RPGDerivedStat):
     def __init__(self, owner: RPGObject):
-        super(Score, self).__init__("Score", "Attributes", owner=owner)
+        super(Score, self).__init__("Score", "Attributes", owner=owner, lazy=True)
         self.add_dependency("Kills", optional=True, default_value=0)
         self.add_dependency("Treasure", optional=True, default_value=0)
         self.add_dependency("Trophies", optional=True, default_value=0)
@@ -464,3 +465,13 @@ def add_derived_stats(character: RPGCharacter):
 
 
     return
+
+
+def add_table_derived_stats(stat_table: StatTable):
+
+    # Whole column versions of the hit point and score stats so they can be queried for all characters at once
+    stat_table.add_derived_stat("MaxHP", lambda con, lvl, hp_per_lvl: con + ((lvl - 1) * hp_per_lvl),
+                                ("Constitution", "Level", "Class_HP_Per_Level"))
+    stat_table.add_derived_stat("HP", lambda max_HP, dmg: max_HP - dmg, ("MaxHP", "Damage"))
+    stat_table.add_derived_stat("Score", lambda kills, treasure, trophies: kills + treasure + (trophies * 50),
+                                ("Kills", "Treasure", "Trophies"))
@@ -1,10 +1,21 @@
+import array
 import collections
+import contextlib
 import copy
 import csv
+import hashlib
+import heapq
+import io
 import logging
 import math
+import mmap
+import multiprocessing
 import os
 import random
+import statistics
+import struct
+import sys
+import time
 from operator import attrgetter
 from operator import itemgetter
 
@@ -276,6 +287,9 @@ class FloorObject(object):
         self.d2x = 0
         self.d2y = 0
 
+        # Floors that index this object by position and need to hear when it moves
+        self._listeners = set()
+
     @property
     def name(self):
         return self._name
@@ -290,8 +304,10 @@ class FloorObject(object):
 
     @rect.setter
     def rect(self, new_rect):
+        old_xyz = self.xyz
         self._old_rect = self._rect.copy()
         self._rect = new_rect
+        self.notify_listeners(old_xyz)
 
     @property
     def xyz(self):
@@ -303,9 +319,21 @@ class FloorObject(object):
         else:
             self._origin = new_origin.copy()
 
+    def add_listener(self, new_listener):
+        self._listeners.add(new_listener)
+
+    def remove_listener(self, listener):
+        self._listeners.discard(listener)
+
+    def notify_listeners(self, old_xyz):
+        for listener in self._listeners:
+            listener.object_moved(self, old_xyz)
+
     def back(self):
         logging.info("Moving Player {0} back from {1} to {2}".format(self.name, self._rect, self._old_rect))
+        old_xyz = self.xyz
         self._rect = self._old_rect.copy()
+        self.notify_listeners(old_xyz)
 
     def is_colliding(self, other_object):
         return self.rect.colliderect(other_object.rect) and \
@@ -332,15 +360,19 @@ class FloorObject(object):
         return math.sqrt(math.pow(self.rect.x - point_x, 2) + pow(self.rect.y - point_y, 2))
 
     def move(self, dx: int, dy: int):
+        old_xyz = self.xyz
         self._old_rect = self._rect.copy()
         self.rect.x += dx
         self.rect.y += dy
+        self.notify_listeners(old_xyz)
 
     def set_pos(self, x: int, y: int, z: int):
+        old_xyz = self.xyz
         self._old_rect = self._rect.copy()
         self.rect.x = x
         self.rect.y = y
         self.layer = z
+        self.notify_listeners(old_xyz)
 
     def get_pos(self):
         return self._rect.x, self._rect.y, self.layer
@@ -349,6 +381,115 @@ class FloorObject(object):
         return "{0}:{1}, {2}".format(self.name, self.rect, self.is_occupiable())
 
 
+class TileType(object):
+    '''
+    Immutable prototype for a type of floor tile that is shared by every floor.
+    Positions live in the floor plans so only tiles that change need their own FloorObject.
+    '''
+
+    # Bits used in the floor plan masks
+    SOLID = 1
+    OCCUPIABLE = 2
+    HAZARD = 4
+    DANGEROUS_BASE = 8
+
+    __slots__ = ("_tile_id", "_name", "_width", "_depth", "_height", "_is_solid", "_is_visible",
+                 "_is_interactable", "_is_occupiable", "_is_shadow", "_mask")
+
+    def __init__(self, tile_id: int, name: str,
+                 width: int = 1,
+                 depth: int = 1,
+                 height: int = 1,
+                 solid: bool = True,
+                 visible: bool = True,
+                 interactable: bool = True,
+                 occupiable: bool = False,
+                 shadow: bool = False):
+
+        self._tile_id = tile_id
+        self._name = name
+        self._width = width
+        self._depth = depth
+        self._height = height
+        self._is_solid = solid
+        self._is_visible = visible
+        self._is_interactable = interactable
+        self._is_occupiable = occupiable
+        self._is_shadow = shadow
+
+        self._mask = 0
+        if solid is True:
+            self._mask |= TileType.SOLID
+        if occupiable is True:
+            self._mask |= TileType.OCCUPIABLE
+        if name in (Objects.SPIKE, Objects.POISON):
+            self._mask |= TileType.HAZARD
+        if name in (Objects.LAVA, Objects.ICE):
+            self._mask |= TileType.DANGEROUS_BASE
+
+    # Tile types are shared so copying a floor should never duplicate them
+    def __deepcopy__(self, memo):
+        return self
+
+    def __str__(self):
+        return "{0}:tile id {1}, {2}".format(self.name, self.tile_id, self.is_occupiable())
+
+    @property
+    def tile_id(self):
+        return self._tile_id
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @property
+    def height(self):
+        return self._height
+
+    @property
+    def is_solid(self):
+        return self._is_solid
+
+    @property
+    def is_visible(self):
+        return self._is_visible
+
+    @property
+    def is_interactable(self):
+        return self._is_interactable
+
+    @property
+    def is_shadow(self):
+        return self._is_shadow
+
+    def is_occupiable(self):
+        return self._is_occupiable
+
+    # Create a new object of this type at the specified position
+    def new_object(self, x: int = 0, y: int = 0, z: int = 1):
+        return FloorObject(self._name,
+                           rect=(x, y, self._width, self._depth),
+                           layer=z,
+                           height=self._height,
+                           solid=self._is_solid,
+                           visible=self._is_visible,
+                           interactable=self._is_interactable,
+                           occupiable=self._is_occupiable,
+                           shadow=self._is_shadow)
+
+
 class Player(FloorObject):
     # Effects
     EVERGREEN = -999
@@ -587,6 +728,190 @@ class Team:
             print(player)
 
 
+class SnapshotWriter:
+    '''
+    Streams the fields of a snapshot straight out to a binary file.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, format: str, *values):
+        self.file.write(struct.pack(format, *values))
+
+    def write_bytes(self, data: bytes):
+        self.file.write(data)
+
+    def write_string(self, text: str):
+        encoded = text.encode("utf-8")
+        self.write("<H", len(encoded))
+        self.file.write(encoded)
+
+    def write_array(self, values: array.array):
+
+        # Arrays are always written little endian
+        if sys.byteorder != "little":
+            values = array.array(values.typecode, values)
+            values.byteswap()
+
+        self.file.write(values.tobytes())
+
+    def write_number(self, value):
+        if isinstance(value, int):
+            self.write("<cq", b"i", value)
+        else:
+            self.write("<cd", b"d", value)
+
+
+class SnapshotReader:
+    '''
+    Reads the fields of a snapshot back out of a buffer such as a memory mapped file.
+    '''
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    @property
+    def remaining(self):
+        return len(self.data) - self.offset
+
+    def read(self, format: str):
+        values = struct.unpack_from(format, self.data, self.offset)
+        self.offset += struct.calcsize(format)
+        return values
+
+    def read_bytes(self, size: int):
+        if size > self.remaining:
+            raise struct.error("Snapshot ended {0} bytes early".format(size - self.remaining))
+        data = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return data
+
+    def read_string(self):
+        size, = self.read("<H")
+        return self.read_bytes(size).decode("utf-8")
+
+    def read_array(self, typecode: str, count: int):
+        values = array.array(typecode)
+        values.frombytes(self.read_bytes(count * values.itemsize))
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+    def read_number(self):
+        number_type, = self.read("<c")
+        if number_type == b"i":
+            value, = self.read("<q")
+        else:
+            value, = self.read("<d")
+        return value
+
+
+class FloorPlan:
+    '''
+    A single layer of a floor stored as a compact grid of tile ids.
+    Only cells holding an interactable or mutated object keep a full FloorObject.
+    '''
+
+    EMPTY_TILE_ID = 0
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self._tile_ids = array.array("H", [FloorPlan.EMPTY_TILE_ID]) * (width * height)
+        self._masks = bytearray(width * height)
+        self._objects = {}
+
+    def __str__(self):
+        return "FloorPlan {0}x{1}: materialised objects={2}".format(self.width, self.height, len(self._objects))
+
+    def _index(self, x: int, y: int):
+
+        # Negative positions wrap around the same way that the old nested lists did
+        if x < 0:
+            x += self.width
+        if y < 0:
+            y += self.height
+
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            raise IndexError("FloorPlan position ({0},{1}) out of range".format(x, y))
+
+        return x * self.height + y
+
+    def get_tile_id(self, x: int, y: int):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self._tile_ids[x * self.height + y]
+        return self._tile_ids[self._index(x, y)]
+
+    def get_object(self, x: int, y: int):
+        if len(self._objects) == 0:
+            return None
+        return self._objects.get(self._index(x, y))
+
+    def get_mask(self, x: int, y: int):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self._masks[x * self.height + y]
+        return self._masks[self._index(x, y)]
+
+    def set_mask(self, x: int, y: int, mask: int):
+        self._masks[self._index(x, y)] = mask
+
+    def build_masks(self, masks_by_tile_id: list):
+        self._masks = bytearray(masks_by_tile_id[tile_id] for tile_id in self._tile_ids)
+
+    def find_tile_id(self, tile_id: int):
+        return [(index // self.height, index % self.height) for index, cell_tile_id in enumerate(self._tile_ids)
+                if cell_tile_id == tile_id]
+
+    def set_tile_id(self, x: int, y: int, tile_id: int):
+        index = self._index(x, y)
+        self._tile_ids[index] = tile_id
+        if index in self._objects:
+            del self._objects[index]
+
+    def set_object(self, x: int, y: int, new_object: FloorObject = None):
+        index = self._index(x, y)
+        if new_object is None:
+            self._tile_ids[index] = FloorPlan.EMPTY_TILE_ID
+            if index in self._objects:
+                del self._objects[index]
+        else:
+            self._tile_ids[index] = FloorObjectLoader.get_tile_id(new_object.name)
+            self._objects[index] = new_object
+
+    @property
+    def materialised_count(self):
+        return len(self._objects)
+
+    def save(self, writer):
+
+        writer.write("<HH", self.width, self.height)
+        writer.write_array(self._tile_ids)
+
+        # Only the positions of the materialised cells are needed as their tile ids say what they are
+        writer.write("<H", len(self._objects))
+        for index in sorted(self._objects.keys()):
+            writer.write("<I", index)
+
+    @staticmethod
+    def load(reader, layer_id: int):
+
+        width, height = reader.read("<HH")
+        new_plan = FloorPlan(width, height)
+
+        tile_ids = reader.read_array("H", width * height)
+        new_plan._tile_ids = tile_ids
+
+        object_count, = reader.read("<H")
+        for i in range(0, object_count):
+            index, = reader.read("<I")
+            tile_type = FloorObjectLoader.tile_types[tile_ids[index]]
+            new_plan._objects[index] = tile_type.new_object(index // height, index % height, layer_id)
+
+        return new_plan
+
+
 class Floor:
     EXIT_NORTH = "NORTH"
     EXIT_SOUTH = "SOUTH"
@@ -597,6 +922,9 @@ class Floor:
 
     EVENTS = None
 
+    MAX_FLOW_FIELDS = 32
+    MAX_SIGHT_LINES = 4096
+
     OBJECT_TO_DIRECTION = {Objects.WEST: EXIT_WEST,
                            Objects.EAST: EXIT_EAST,
                            Objects.NORTH: EXIT_NORTH,
@@ -627,8 +955,11 @@ class Floor:
         self.players = []
         self.objects = []
         self.monsters = []
+        self.player_index = {}
+        self.monster_index = {}
         self.bots = []
         self.layers = {}
+        self.tile_placements = {}
         self.floor_plans = {}
         self.exits = {}
         self.teleports = {}
@@ -640,6 +971,13 @@ class Floor:
         self.chests = 0
         self.switch_on = False
         self.switch_tiles = None
+        self.switch_cells = set()
+        self.min_layer = None
+        self.max_layer = None
+        self.map_version = 0
+        self.flow_fields = {}
+        self.sight_lines = {}
+        self.route_cache = RouteCache()
         self.tick_count = 0
 
     def __str__(self):
@@ -656,6 +994,8 @@ class Floor:
         count = 0
         for layer in self.layers.values():
             count += len(layer)
+        for layer in self.tile_placements.values():
+            count += len(layer)
         return count
 
     def add_player_at_entrance(self, new_player: Player, direction: str):
@@ -674,6 +1014,8 @@ class Floor:
             new_player.set_pos(10, 10, z)
             self.players.append(new_player)
 
+        self.add_occupant(new_player, self.player_index)
+
         print("Adding player at {0},{1},{2}".format(new_player.rect.x, new_player.rect.y, new_player.layer))
 
     def add_player(self, new_player: Player, auto_position: bool = False, team: int = 0):
@@ -695,6 +1037,7 @@ class Floor:
                 print("Failed to auto position player {0}".format(new_player.character.name))
 
         self.players.append(new_player)
+        self.add_occupant(new_player, self.player_index)
 
         print("Adding player at {0},{1},{2}".format(new_player.rect.x, new_player.rect.y, new_player.layer))
 
@@ -718,6 +1061,7 @@ class Floor:
                 print("Failed to auto position enemy {0}".format(new_player.character.name))
 
         self.monsters.append(new_player)
+        self.add_occupant(new_player, self.monster_index)
 
         if is_bot is True:
             ai = AIBotExplore(player=new_player, floor=self)
@@ -732,7 +1076,8 @@ class Floor:
 
         # print("Adding {0} {1} items into rect {2}".format(item_count, item_type, self.rect))
 
-        new_object = FloorObjectLoader.get_object_copy_by_name(item_type)
+        item_tile_type = FloorObjectLoader.get_tile_type_by_name(item_type)
+        new_object = item_tile_type.new_object()
         if new_object is not None:
 
             for i in range(0, item_count):
@@ -746,7 +1091,7 @@ class Floor:
                         if base_tile is not None and base_tile.is_occupiable() is True:
                             new_object.set_pos(x, y, z)
                             self.add_object(new_object)
-                            new_object = FloorObjectLoader.get_object_copy_by_name(item_type)
+                            new_object = item_tile_type.new_object()
                             placed = True
                             # print("Added {0} item at {1},{2},{3}".format(item_type, x, y, z))
                             break
@@ -758,10 +1103,16 @@ class Floor:
         else:
             raise Exception("add_items: Could not find object {0}".format(item_type))
 
+    def add_layer(self, layer_id: int):
+
+        self.layers[layer_id] = []
+        self.min_layer = min(self.layers.keys())
+        self.max_layer = max(self.layers.keys())
+
     def add_object(self, new_object: FloorObject):
 
         if new_object.layer not in self.layers.keys():
-            self.layers[new_object.layer] = []
+            self.add_layer(new_object.layer)
 
         objects = self.layers[new_object.layer]
         objects.append(new_object)
@@ -773,44 +1124,121 @@ class Floor:
 
         logging.info("Added {0} at location ({1},{2})".format(new_object.name, new_object.rect.x, new_object.rect.y))
 
+    def add_tile(self, tile_type: TileType, x: int, y: int, layer_id: int):
+
+        if layer_id not in self.layers.keys():
+            self.add_layer(layer_id)
+
+        if layer_id not in self.tile_placements.keys():
+            self.tile_placements[layer_id] = []
+
+        self.tile_placements[layer_id].append((tile_type, x, y))
+        self.rect.width = max(x + 1, self.rect.width)
+        self.rect.height = max(y + 1, self.rect.height)
+
+        if tile_type.name in Objects.DIRECTIONS:
+            self.exits[Floor.OBJECT_TO_DIRECTION[tile_type.name]] = tile_type.new_object(x, y, layer_id)
+
+        logging.info("Added {0} at location ({1},{2})".format(tile_type.name, x, y))
+
     def build_floor_plan(self):
 
         for layer_id in sorted(self.layers.keys(), reverse=True):
             if layer_id not in self.floor_plans.keys():
-                new_plan = [[None for x in range(self.rect.height)] for x in range(self.rect.width)]
+                new_plan = FloorPlan(self.rect.width, self.rect.height)
                 self.floor_plans[layer_id] = new_plan
 
+            placements = list(self.tile_placements.get(layer_id, []))
             for floor_object in self.layers[layer_id]:
+                placements.append((FloorObjectLoader.get_tile_type_by_name(floor_object.name),
+                                   floor_object.rect.x,
+                                   floor_object.rect.y))
 
-                object_x, object_y, object_z = floor_object.xyz
-
-                width = floor_object.rect.width
-                depth = floor_object.rect.height
-                height = floor_object.height
+            for tile_type, object_x, object_y in placements:
 
-                for x in range(object_x, object_x + width):
-                    for y in range(object_y, object_y + depth):
-                        for z in range(layer_id, layer_id + height):
-                            new_object = FloorObjectLoader.get_object_copy_by_name(floor_object.name)
+                for x in range(object_x, object_x + tile_type.width):
+                    for y in range(object_y, object_y + tile_type.depth):
+                        for z in range(layer_id, layer_id + tile_type.height):
                             try:
-                                self.set_floor_tile(x, y, z, new_object)
+                                # Only keep a full object for tiles that the player can interact with
+                                if tile_type.is_interactable is True:
+                                    self.set_floor_tile(x, y, z, tile_type.new_object())
+                                else:
+                                    self.floor_plans[z].set_tile_id(x, y, tile_type.tile_id)
                             except Exception as e:
-                                print("Error:{0}".format(str(new_object)))
+                                print("Error:{0}".format(str(tile_type)))
+
+                if tile_type.name in (Objects.TELEPORT, Objects.TELEPORT2):
+                    if tile_type.name not in self.teleports.keys():
+                        self.teleports[tile_type.name] = []
+                    self.teleports[tile_type.name].append((object_x, object_y, layer_id))
+
+        self.build_tile_masks()
+
+    def build_tile_masks(self):
+
+        self.switch_cells = set()
+        self.map_changed()
+
+        masks_by_tile_id = [0]
+        for tile_type in FloorObjectLoader.tile_types[1:]:
+            masks_by_tile_id.append(tile_type.mask)
+
+        switch_tile_id = FloorObjectLoader.get_tile_id(Objects.SWITCH_TILE)
+
+        for layer_id, floor_plan in self.floor_plans.items():
+            floor_plan.build_masks(masks_by_tile_id)
+
+            # Switch tiles depend on the state of the switch so set them individually
+            for x, y in floor_plan.find_tile_id(switch_tile_id):
+                self.update_tile_mask(x, y, layer_id)
+
+    def map_changed(self):
+
+        # Anything worked out from the old map is no longer valid
+        self.map_version += 1
+        self.flow_fields = {}
+        self.sight_lines = {}
+        self.route_cache.clear()
 
-                if floor_object.name in (Objects.TELEPORT, Objects.TELEPORT2):
-                    if floor_object.name not in self.teleports.keys():
-                        self.teleports[floor_object.name] = []
-                    self.teleports[floor_object.name].append(
-                        (floor_object.rect.x, floor_object.rect.y, floor_object.layer))
+    def update_tile_mask(self, x: int, y: int, layer_id: int):
+
+        floor_plan = self.floor_plans[layer_id]
+
+        # Switch tiles change with the floor's switch so remember where they are
+        if floor_plan.get_tile_id(x, y) == FloorObjectLoader.get_tile_id(Objects.SWITCH_TILE):
+            self.switch_cells.add((x, y, layer_id))
+
+        tile_id = self.get_tile_id(x, y, layer_id)
+        if tile_id == FloorPlan.EMPTY_TILE_ID:
+            floor_plan.set_mask(x, y, 0)
+        else:
+            floor_plan.set_mask(x, y, FloorObjectLoader.tile_types[tile_id].mask)
 
     def reset(self):
         monsters = list(self.monsters)
         self.bots = []
         self.monsters = []
+        self.monster_index = {}
         for enemy in monsters:
             enemy.do_heal()
             self.add_enemy(enemy, auto_position=True, is_bot=True)
 
+    def restore(self, tick_count: int, switch_on: bool, floor_plans: dict, monsters: list):
+
+        self.tick_count = tick_count
+        self.switch_on = switch_on
+        self.floor_plans.update(floor_plans)
+        self.build_tile_masks()
+
+        self.bots = []
+        self.monsters = []
+        self.monster_index = {}
+        for enemy in monsters:
+            x, y, z = enemy.xyz
+            self.add_enemy(enemy, auto_position=True, is_bot=True)
+            enemy.set_pos(x, y, z)
+
     def get_camera_position(self):
         return (self.rect.width, self.rect.height, len(self.layers.keys()))
 
@@ -833,7 +1261,7 @@ class Floor:
     def swap_object(self, object: FloorObject, new_object_type: str):
 
         x, y, z = object.xyz
-        swap_object = FloorObjectLoader.get_object_copy_by_name(new_object_type)
+        swap_object = FloorObjectLoader.get_tile_type_by_name(new_object_type).new_object()
 
         self.set_floor_tile(x, y, z, swap_object)
 
@@ -844,6 +1272,11 @@ class Floor:
         else:
             self.switch_on = setting
 
+        for x, y, z in self.switch_cells:
+            self.update_tile_mask(x, y, z)
+
+        self.map_changed()
+
         return self.switch_on
 
     def get_layer(self, layer_id):
@@ -857,8 +1290,14 @@ class Floor:
 
     def get_floor_tile(self, x: int, y: int, layer_id: int, is_raw: bool = False):
 
-        layer = self.floor_plans[layer_id]
-        floor_object = layer[x][y]
+        floor_plan = self.floor_plans[layer_id]
+        floor_object = floor_plan.get_object(x, y)
+
+        # If the cell is not materialised then use the shared tile type
+        if floor_object is None:
+            tile_id = floor_plan.get_tile_id(x, y)
+            if tile_id != FloorPlan.EMPTY_TILE_ID:
+                floor_object = FloorObjectLoader.tile_types[tile_id]
 
         if floor_object is not None and floor_object.name == Objects.SWITCH_TILE and self.switch_tiles is not None:
             if self.switch_on is True:
@@ -866,31 +1305,81 @@ class Floor:
             else:
                 tile = self.switch_tiles[0]
 
-            x, y, z = floor_object.xyz
-            floor_object = FloorObjectLoader.get_object_copy_by_name(tile)
-            floor_object.set_pos(x, y, z)
+            floor_object = FloorObjectLoader.get_tile_type_by_name(tile)
 
         if is_raw is False:
 
-            for player in self.players:
-                if (x, y, layer_id) == player.xyz:
-                    floor_object = player
-                    break
-
-            for enemy in self.monsters:
-                if (x, y, layer_id) == enemy.xyz:
-                    floor_object = enemy
-                    break
+            occupant = self.get_occupant(x, y, layer_id)
+            if occupant is not None:
+                floor_object = occupant
 
         return floor_object
 
+    def add_occupant(self, new_occupant: FloorObject, index: dict):
+
+        occupants = index.setdefault(new_occupant.xyz, [])
+        if new_occupant not in occupants:
+            occupants.append(new_occupant)
+
+        new_occupant.add_listener(self)
+
+    def remove_occupant(self, occupant: FloorObject, index: dict):
+
+        occupants = index.get(occupant.xyz)
+        if occupants is not None and occupant in occupants:
+            occupants.remove(occupant)
+            if len(occupants) == 0:
+                del index[occupant.xyz]
+
+        occupant.remove_listener(self)
+
+    def object_moved(self, floor_object: FloorObject, old_xyz):
+
+        new_xyz = floor_object.xyz
+        if new_xyz == old_xyz:
+            return
+
+        for index in (self.player_index, self.monster_index):
+            occupants = index.get(old_xyz)
+            if occupants is not None and floor_object in occupants:
+                occupants.remove(floor_object)
+                if len(occupants) == 0:
+                    del index[old_xyz]
+                index.setdefault(new_xyz, []).append(floor_object)
+
+    def get_occupant(self, x: int, y: int, layer_id: int):
+
+        # Monsters take priority over players in the same position
+        occupants = self.monster_index.get((x, y, layer_id))
+        if occupants is None:
+            occupants = self.player_index.get((x, y, layer_id))
+            if occupants is None:
+                return None
+
+        return occupants[0]
+
+    def get_tile_id(self, x: int, y: int, layer_id: int):
+
+        tile_id = self.floor_plans[layer_id].get_tile_id(x, y)
+
+        if tile_id != FloorPlan.EMPTY_TILE_ID and self.switch_tiles is not None and \
+                        tile_id == FloorObjectLoader.get_tile_id(Objects.SWITCH_TILE):
+            if self.switch_on is True:
+                tile_id = FloorObjectLoader.get_tile_id(self.switch_tiles[1])
+            else:
+                tile_id = FloorObjectLoader.get_tile_id(self.switch_tiles[0])
+
+        return tile_id
+
     def set_floor_tile(self, x: int, y: int, layer_id: int, new_object: FloorObject = None):
 
         if new_object is not None:
             new_object.set_pos(x, y, layer_id)
 
-        layer = self.floor_plans[layer_id]
-        layer[x][y] = new_object
+        floor_plan = self.floor_plans[layer_id]
+        floor_plan.set_object(x, y, new_object)
+        self.update_tile_mask(x, y, layer_id)
+        self.map_changed()
 
     def get_matching_objects(self, types: list, layer_id: int = None):
         matches = []
@@ -911,6 +1400,9 @@ class Floor:
                     for y in range(0, self.rect.height):
                         tile = self.get_floor_tile(x, y, selected_layer_id, is_raw=True)
                         if tile is not None and tile.name in types:
+                            # Shared tile types have no position so return a positioned copy
+                            if isinstance(tile, TileType):
+                                tile = tile.new_object(x, y, selected_layer_id)
                             matches.append(tile)
 
         print("{0} matches for tile type {1}".format(len(matches), types))
@@ -926,38 +1418,106 @@ class Floor:
             result = False
         else:
 
-            tile = self.get_floor_tile(x, y, z - 1)
-
             # Is the base of the new position occupied?
-            if tile is None or tile.is_occupiable() is False:
+            if self.floor_plans[z - 1].get_mask(x, y) & TileType.OCCUPIABLE == 0 or \
+                            self.get_occupant(x, y, z - 1) is not None:
                 result = False
 
         return result
 
+    def is_solid(self, x, y, z):
+
+        # Players and monsters stand in front of whatever tile is there
+        occupant = self.get_occupant(x, y, z)
+        if occupant is not None:
+            return occupant.is_solid is True
+
+        return self.floor_plans[z].get_mask(x, y) & TileType.SOLID != 0
+
     def is_dangerous(self, x, y, z):
 
         result = False
 
-        tile = self.get_floor_tile(x, y, z)
-
         # Is the tile dangerous?
-        if tile is not None and tile.name in (Objects.SPIKE, Objects.POISON):
+        if self.floor_plans[z].get_mask(x, y) & TileType.HAZARD != 0 and \
+                        self.get_occupant(x, y, z) is None:
             result = True
-        else:
 
-            base_tile = self.get_floor_tile(x, y, z - 1)
+        # Is the base tile dangerous?
+        elif self.floor_plans[z - 1].get_mask(x, y) & TileType.DANGEROUS_BASE != 0 and \
+                        self.get_occupant(x, y, z - 1) is None:
+            result = True
+
+        return result
+
+    def is_passable(self, x: int, y: int, z: int, walkable: bool = False, safe: bool = False):
+
+        if self.is_in_bounds(x, y, z) is False:
+            return False
+
+        elif self.is_solid(x, y, z) is True:
+            return False
+
+        elif walkable is True and self.is_occupiable(x, y, z) is False:
+            return False
+
+        elif safe is True and self.is_dangerous(x, y, z) is True:
+            return False
+
+        return True
+
+    def get_flow_field(self, target, walkable: bool = False, safe: bool = False):
+
+        key = (target, walkable, safe)
+
+        # Players and monsters move about so fields are only good for the tick they were built in
+        flow_field = self.flow_fields.get(key)
+        if flow_field is None or flow_field.tick_count != self.tick_count:
+
+            # Targets move about so don't let old fields pile up
+            if len(self.flow_fields) >= Floor.MAX_FLOW_FIELDS:
+                self.flow_fields = {}
+
+            flow_field = FlowField(self, target, walkable=walkable, safe=safe)
+            self.flow_fields[key] = flow_field
+
+        return flow_field
+
+    def has_line_of_sight(self, a, b, max_distance: float = None):
+
+        # Don't bother casting a ray if the target is out of range anyway
+        if max_distance is not None and LineOfSight.distance(a, b) >= max_distance:
+            return False
+
+        key = (a, b)
+
+        result = self.sight_lines.get(key)
+        if result is None:
+
+            if len(self.sight_lines) >= Floor.MAX_SIGHT_LINES:
+                self.sight_lines = {}
 
-            # Is the base tile dangerous?
-            if base_tile is not None and base_tile.name in (Objects.LAVA, Objects.ICE):
-                result = True
+            result = LineOfSight.is_clear(self, a, b)
+            self.sight_lines[key] = result
 
         return result
 
+    def has_clear_shot(self, a, b, max_distance: float = None):
+
+        if self.has_line_of_sight(a, b, max_distance) is False:
+            return False
+
+        # Unlike line of sight anyone standing between the two positions gets in the way of an attack
+        for xyz in LineOfSight.get_cells(a, b)[:-1]:
+            if xyz in self.player_index or xyz in self.monster_index:
+                return False
+
+        return True
+
     def is_in_bounds(self, x: int, y: int, z: int):
 
         # Is the position out of bounds?
-        if x >= self.rect.width or x < 0 or y >= self.rect.height or y < 0 or z < min(self.layers.keys()) or z > max(
-                self.layers.keys()):
+        if x >= self.rect.width or x < 0 or y >= self.rect.height or y < 0 or z < self.min_layer or z > self.max_layer:
             return False
         else:
             return True
@@ -998,7 +1558,7 @@ class Floor:
 
                     if tile.name == Objects.CHEST:
                         reward = random.choice((Objects.KEY, Objects.POTION, Objects.SPHERE_GREEN))
-                        reward_object = FloorObjectLoader.get_object_copy_by_name(reward)
+                        reward_object = FloorObjectLoader.get_tile_type_by_name(reward).new_object()
                         self.set_floor_tile(new_x, new_y, z, reward_object)
                         Floor.EVENTS.add_event(
                             Event(type=Event.FLOOR, name=Event.TREASURE, description="You find a {0}".format(reward)))
@@ -1189,11 +1749,31 @@ class Floor:
 class FloorBuilder():
     FLOOR_LAYOUT_FILE_NAME = "_floor_layouts.csv"
     FLOOR_OBJECT_FILE_NAME = "_floor_objects.csv"
+    FLOOR_CACHE_FILE_NAME = "_floors.cache"
+
+    MAX_RESIDENT_FLOORS = 4
 
-    def __init__(self, data_file_directory: str):
+    def __init__(self, data_file_directory: str, max_resident_floors: int = MAX_RESIDENT_FLOORS):
         self.data_file_directory = data_file_directory
-        self.floors = {}
+        self.max_resident_floors = max_resident_floors
+
+        # The floors that are currently built ordered from least to most recently used
+        self.floors = collections.OrderedDict()
+        self.floor_templates = {}
         self.floor_details = {}
+        self._listeners = []
+
+    def add_listener(self, new_listener):
+        if new_listener not in self._listeners:
+            self._listeners.append(new_listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    @property
+    def floor_ids(self):
+        return list(self.floor_templates.keys())
 
     def initialise(self, file_prefix: str = "default"):
 
@@ -1201,23 +1781,98 @@ class FloorBuilder():
 
         self.floor_objects = FloorObjectLoader(
             self.data_file_directory + file_prefix + FloorBuilder.FLOOR_OBJECT_FILE_NAME)
-        self.floor_objects.load()
 
         self.floor_layouts = FloorLayoutLoader(
             self.data_file_directory + file_prefix + FloorBuilder.FLOOR_LAYOUT_FILE_NAME)
-        self.floor_layouts.load()
 
-    def load_floors(self):
+        self.floor_cache = FloorCache(self.data_file_directory + file_prefix + FloorBuilder.FLOOR_CACHE_FILE_NAME,
+                                      (self.floor_objects.file_name, self.floor_layouts.file_name))
+
+        self.floors = collections.OrderedDict()
 
+        # Only parse the CSV files and build the floor plans if there is no up to date compiled copy of them
+        self.floor_templates = self.floor_cache.load(self.floor_objects)
+        if self.floor_templates is None:
+            self.build_floor_templates()
+
+    def build_floor_templates(self):
+
+        # Start the list of loaded tile types again so that a damaged cache can't leave duplicates in it
+        self.floor_objects.loaded_tile_types = []
+
+        self.floor_objects.load()
+        self.floor_layouts.load()
+        self.floor_templates = {}
         for floor_id, new_floor in FloorLayoutLoader.floor_layouts.items():
             new_floor.build_floor_plan()
-            if floor_id in self.floor_details.keys():
-                new_floor.set_details(self.floor_details[floor_id])
-            self.floors[floor_id] = new_floor
+            self.floor_templates[floor_id] = FloorCache.compile_floor(new_floor)
+        self.floor_cache.save(self.floor_objects, self.floor_templates)
+
+    def load_floors(self, floor_ids: list = None):
+
+        if floor_ids is None:
+            floor_ids = self.floor_ids
+
+        for floor_id in floor_ids:
+            self.get_floor(floor_id)
+
+    def get_floor(self, floor_id: int):
+
+        floor = self.floors.get(floor_id)
+
+        # Floors are only built the first time that they are needed
+        if floor is None:
+            floor = self.load_floor(floor_id)
+        else:
+            self.floors.move_to_end(floor_id)
 
-            # for floor in self.floors.values():
-            #     floor.build_floor_plan()
-            #     print(str(floor))
+        return floor
+
+    def load_floor(self, floor_id: int):
+
+        if floor_id not in self.floor_templates.keys():
+            raise Exception("Floor {0} not found".format(floor_id))
+
+        # If a template from the cache can't be read then go back to the CSV files and write a new cache
+        try:
+            new_floor = FloorCache.new_floor(self.floor_templates[floor_id])
+        except Exception as err:
+            logging.warning("Floor {0} could not be read from {1} so rebuilding it: {2}".format(
+                floor_id, self.floor_cache.file_name, err))
+            self.build_floor_templates()
+            new_floor = FloorCache.new_floor(self.floor_templates[floor_id])
+
+        if floor_id in self.floor_details.keys():
+            new_floor.set_details(self.floor_details[floor_id])
+
+        self.floors[floor_id] = new_floor
+
+        for listener in self._listeners:
+            listener.floor_loaded(new_floor)
+
+        # Unload the least recently used floors to stay within the limit
+        while self.max_resident_floors is not None and len(self.floors) > self.max_resident_floors:
+            old_floor_id = next(iter(self.floors.keys()))
+            self.unload_floor(old_floor_id)
+
+        return new_floor
+
+    def unload_floor(self, floor_id: int, notify: bool = True):
+
+        old_floor = self.floors.pop(floor_id)
+
+        if notify is True:
+            for listener in self._listeners:
+                listener.floor_unloaded(old_floor)
+
+        # Stop anything that is still on the floor from telling it when it moves
+        for occupant in old_floor.players + old_floor.monsters:
+            occupant.remove_listener(old_floor)
+
+        # Give back the rows that the monsters had in a shared stat table as new ones are made if the floor comes back
+        for monster in old_floor.monsters:
+            if monster.character.stat_table is not None:
+                monster.character.stat_table.remove_row(monster.character)
 
     def load_floor_details(self):
 
@@ -1337,11 +1992,8 @@ class FloorLayoutLoader():
                 x = 0
                 for object_code in floor_layout:
                     if object_code != FloorLayoutLoader.EMPTY_OBJECT_CODE:
-                        new_floor_object = FloorObjectLoader.get_object_copy_by_code(object_code)
-                        new_floor_object.rect.x = x
-                        new_floor_object.rect.y = y
-                        new_floor_object.layer = floor_layer
-                        floor.add_object(new_floor_object)
+                        tile_type = FloorObjectLoader.get_tile_type_by_code(object_code)
+                        floor.add_tile(tile_type, x, y, floor_layer)
                     x += FloorLayoutLoader.DEFAULT_OBJECT_WIDTH
 
                 y += FloorLayoutLoader.DEFAULT_OBJECT_DEPTH
@@ -1350,11 +2002,14 @@ class FloorLayoutLoader():
 class FloorObjectLoader():
     floor_objects = {}
     map_object_name_to_code = {}
+    tile_types = [None]
+    map_object_name_to_tile_id = {}
 
     BOOL_MAP = {"TRUE": True, "FALSE": False}
 
     def __init__(self, file_name: str):
         self.file_name = file_name
+        self.loaded_tile_types = []
 
     def load(self):
 
@@ -1370,77 +2025,312 @@ class FloorObjectLoader():
             for row in reader:
                 # print("loading {0}".format(row))
 
-                object_code = row.get("Code")
+                self.add_tile_type(row.get("Code"), row.get("Name"),
+                                   width=int(row.get("width")),
+                                   depth=int(row.get("depth")),
+                                   height=int(row.get("height")),
+                                   solid=FloorObjectLoader.BOOL_MAP[row.get("solid").upper()],
+                                   visible=FloorObjectLoader.BOOL_MAP[row.get("visible").upper()],
+                                   interactable=FloorObjectLoader.BOOL_MAP[row.get("interactable").upper()],
+                                   occupiable=FloorObjectLoader.BOOL_MAP[row.get("occupiable").upper()],
+                                   shadow=FloorObjectLoader.BOOL_MAP[row.get("shadow").upper()])
+
+    def add_tile_type(self, object_code: str, object_name: str, width: int, depth: int, height: int,
+                      solid: bool, visible: bool, interactable: bool, occupiable: bool, shadow: bool):
+
+        # Reuse the tile id if this type of object has been loaded before so existing floor plans stay valid
+        if object_name in FloorObjectLoader.map_object_name_to_tile_id.keys():
+            tile_id = FloorObjectLoader.map_object_name_to_tile_id[object_name]
+        else:
+            tile_id = len(FloorObjectLoader.tile_types)
+            FloorObjectLoader.tile_types.append(None)
+
+        new_tile_type = TileType(tile_id, object_name,
+                                 width=width,
+                                 depth=depth,
+                                 height=height,
+                                 solid=solid,
+                                 visible=visible,
+                                 interactable=interactable,
+                                 occupiable=occupiable,
+                                 shadow=shadow)
 
-                new_object = FloorObject(row.get("Name"), \
-                                         rect=(0, 0, int(row.get("width")), int(row.get("depth"))), \
-                                         height=int(row.get("height")), \
-                                         solid=FloorObjectLoader.BOOL_MAP[row.get("solid").upper()], \
-                                         visible=FloorObjectLoader.BOOL_MAP[row.get("visible").upper()], \
-                                         interactable=FloorObjectLoader.BOOL_MAP[row.get("interactable").upper()], \
-                                         occupiable=FloorObjectLoader.BOOL_MAP[row.get("occupiable").upper()], \
-                                         shadow=FloorObjectLoader.BOOL_MAP[row.get("shadow").upper()] \
-                                         )
+        # Store the shared tile type in the code cache and against its tile id
+        FloorObjectLoader.floor_objects[object_code] = new_tile_type
+        FloorObjectLoader.tile_types[tile_id] = new_tile_type
 
-                # Store the floor object in the code cache
-                FloorObjectLoader.floor_objects[object_code] = new_object
+        # Store mapping of object name to code and tile id
+        FloorObjectLoader.map_object_name_to_code[object_name] = object_code
+        FloorObjectLoader.map_object_name_to_tile_id[object_name] = tile_id
 
-                # Store mapping of object name to code
-                FloorObjectLoader.map_object_name_to_code[new_object.name] = object_code
+        # Remember the order the tile types were loaded in so the floor cache can load them the same way
+        self.loaded_tile_types.append((object_code, new_tile_type))
 
-                logging.info("{0}.load(): Loaded Floor Object {1}".format(__class__, new_object.name))
+        logging.info("{0}.load(): Loaded Floor Object {1}".format(__class__, object_name))
 
     @staticmethod
-    def get_object_copy_by_code(object_code: str):
+    def get_tile_type_by_code(object_code: str):
 
         if object_code not in FloorObjectLoader.floor_objects.keys():
             raise Exception("Can't find object by code '{0}'".format(object_code))
 
-        return copy.deepcopy(FloorObjectLoader.floor_objects[object_code])
+        return FloorObjectLoader.floor_objects[object_code]
 
     @staticmethod
-    def get_object_copy_by_name(object_name: str):
+    def get_tile_type_by_name(object_name: str):
 
-        if object_name not in FloorObjectLoader.map_object_name_to_code.keys():
+        if object_name not in FloorObjectLoader.map_object_name_to_tile_id.keys():
             raise Exception("Can't find object by name '{0}'".format(object_name))
 
-        object_code = FloorObjectLoader.map_object_name_to_code[object_name]
+        return FloorObjectLoader.tile_types[FloorObjectLoader.map_object_name_to_tile_id[object_name]]
 
-        if object_code not in FloorObjectLoader.floor_objects.keys():
-            raise Exception("Can't find object by code '{0}'".format(object_name))
+    @staticmethod
+    def get_object_copy_by_code(object_code: str):
 
-        return FloorObjectLoader.get_object_copy_by_code(object_code)
+        return FloorObjectLoader.get_tile_type_by_code(object_code).new_object()
 
+    @staticmethod
+    def get_object_copy_by_name(object_name: str):
 
-class Battle:
-    EVENTS = None
-    READY = "ready"
-    PLAYING = "playing"
-    END = "end"
+        return FloorObjectLoader.get_tile_type_by_name(object_name).new_object()
 
-    TACTIC_NEXT = "next opponent"
+    @staticmethod
+    def get_tile_id(object_name: str):
 
-    def __init__(self, team1: Team, team2: Team, battle_floor: Floor = None):
-        self.teams = [team1, team2]
-        self.turns = 0
-        self.tick_count = 0
-        self._state = Battle.READY
-        self.next_team = None
-        self.battle_floor = battle_floor
-        self.order_of_play = []
-        self.current_target = None
-        self.bots = {}
+        if object_name not in FloorObjectLoader.map_object_name_to_tile_id.keys():
+            raise Exception("Can't find tile id for object '{0}'".format(object_name))
 
-    def __str__(self):
-        return "Battle between team {0} and team {1} ({5})\nRound {2}\n{3}\n{4}".format(self.teams[0].name,
-                                                                                        self.teams[1].name,
-                                                                                        self.turns,
-                                                                                        self.teams[0],
-                                                                                        self.teams[1],
-                                                                                        self._state)
+        return FloorObjectLoader.map_object_name_to_tile_id[object_name]
 
-    def print(self):
-        print("Team {0} vs. Team {1}: Round {2}".format(self.teams[0].name,
+    @staticmethod
+    def get_tile_type(tile_id: int):
+
+        if tile_id <= FloorPlan.EMPTY_TILE_ID or tile_id >= len(FloorObjectLoader.tile_types):
+            raise Exception("Can't find object by tile id {0}".format(tile_id))
+
+        return FloorObjectLoader.tile_types[tile_id]
+
+
+class FloorCache:
+    '''
+    A compiled copy of the floor objects and floor layouts with all of the floor plans already built.
+    The CSV files stay the source of truth so the cache is only used if it was compiled from exactly the same files.
+    Each floor is kept as a compiled template of bytes that a new copy of the floor can be read from when needed.
+    '''
+
+    MAGIC = b"NMFC"
+    VERSION = 2
+
+    def __init__(self, file_name: str, source_file_names: tuple):
+        self.file_name = file_name
+        self.source_file_names = source_file_names
+
+    def __str__(self):
+        return "FloorCache {0}: sources={1}".format(self.file_name, self.source_file_names)
+
+    def get_source_digest(self):
+
+        digest = hashlib.md5()
+        for source_file_name in self.source_file_names:
+            with open(source_file_name, "rb") as source_file:
+                source = source_file.read()
+            digest.update(struct.pack("<I", len(source)))
+            digest.update(source)
+
+        return digest.digest()
+
+    def load(self, floor_objects: FloorObjectLoader):
+
+        try:
+            with open(self.file_name, "rb") as cache_file:
+                reader = SnapshotReader(cache_file.read())
+
+            magic, version, digest, payload_digest = reader.read("<4sH16s16s")
+            if magic != FloorCache.MAGIC or version != FloorCache.VERSION or digest != self.get_source_digest():
+                logging.info("Floor cache {0} is out of date".format(self.file_name))
+                return None
+
+            # Check the whole payload before reading any of it so that a damaged cache adds no tile types
+            payload = reader.read_bytes(reader.remaining)
+            if hashlib.md5(payload).digest() != payload_digest:
+                logging.warning("Floor cache {0} is damaged".format(self.file_name))
+                return None
+
+            reader = SnapshotReader(payload)
+
+            tile_type_count, = reader.read("<H")
+            for i in range(0, tile_type_count):
+                object_code = reader.read_string()
+                object_name = reader.read_string()
+                floor_objects.add_tile_type(object_code, object_name, *reader.read("<HHH?????"))
+
+            floor_templates = {}
+            floor_count, = reader.read("<H")
+            for i in range(0, floor_count):
+                floor_id, size = reader.read("<iI")
+                floor_templates[floor_id] = reader.read_bytes(size)
+
+        except IOError as err:
+            logging.info("Floor cache {0} could not be loaded: {1}".format(self.file_name, err))
+            return None
+
+        except Exception as err:
+            logging.warning("Floor cache {0} could not be loaded: {1}".format(self.file_name, err))
+            return None
+
+        return floor_templates
+
+    def save(self, floor_objects: FloorObjectLoader, floor_templates: dict):
+
+        payload = io.BytesIO()
+        writer = SnapshotWriter(payload)
+
+        writer.write("<H", len(floor_objects.loaded_tile_types))
+        for object_code, tile_type in floor_objects.loaded_tile_types:
+            writer.write_string(object_code)
+            writer.write_string(tile_type.name)
+            writer.write("<HHH?????", tile_type.width, tile_type.depth, tile_type.height, tile_type.is_solid,
+                         tile_type.is_visible, tile_type.is_interactable, tile_type.is_occupiable(),
+                         tile_type.is_shadow)
+
+        writer.write("<H", len(floor_templates))
+        for floor_id, floor_template in floor_templates.items():
+            writer.write("<iI", floor_id, len(floor_template))
+            writer.write_bytes(floor_template)
+
+        payload = payload.getvalue()
+
+        # Write to a temporary file first so that a half written cache is never loaded
+        temporary_file_name = self.file_name + ".tmp"
+
+        try:
+            with open(temporary_file_name, "wb") as cache_file:
+                writer = SnapshotWriter(cache_file)
+                writer.write("<4sH16s16s", FloorCache.MAGIC, FloorCache.VERSION, self.get_source_digest(),
+                             hashlib.md5(payload).digest())
+                writer.write_bytes(payload)
+
+            os.replace(temporary_file_name, self.file_name)
+
+        except IOError as err:
+            logging.warning("Floor cache {0} could not be saved: {1}".format(self.file_name, err))
+
+    @staticmethod
+    def compile_floor(floor: Floor):
+        floor_template = io.BytesIO()
+        FloorCache.write_floor(SnapshotWriter(floor_template), floor)
+        return floor_template.getvalue()
+
+    @staticmethod
+    def new_floor(floor_template: bytes):
+        return FloorCache.read_floor(SnapshotReader(floor_template))
+
+    @staticmethod
+    def write_floor(writer: SnapshotWriter, floor: Floor):
+
+        writer.write("<iI", floor.id, floor.map_version)
+        writer.write_string(floor.name)
+        writer.write_string(floor.skin_name)
+        writer.write("<iiii", floor.rect.x, floor.rect.y, floor.rect.width, floor.rect.height)
+
+        # Tile placements are kept so that adding the floor details can rebuild the floor plans as normal
+        writer.write("<H", len(floor.layers))
+        for layer_id in floor.layers.keys():
+            placements = array.array("H")
+            for tile_type, x, y in floor.tile_placements.get(layer_id, []):
+                placements.extend((tile_type.tile_id, x, y))
+            writer.write("<iI", layer_id, len(placements) // 3)
+            writer.write_array(placements)
+
+        writer.write("<H", len(floor.floor_plans))
+        for layer_id, floor_plan in floor.floor_plans.items():
+            writer.write("<i", layer_id)
+            floor_plan.save(writer)
+
+        writer.write("<H", len(floor.teleports))
+        for teleport_name, positions in floor.teleports.items():
+            writer.write_string(teleport_name)
+            writer.write("<H", len(positions))
+            for x, y, z in positions:
+                writer.write("<iii", x, y, z)
+
+        writer.write("<H", len(floor.exits))
+        for exit_object in floor.exits.values():
+            writer.write("<H", FloorObjectLoader.get_tile_id(exit_object.name))
+            writer.write("<iii", *exit_object.xyz)
+
+    @staticmethod
+    def read_floor(reader: SnapshotReader):
+
+        floor_id, map_version = reader.read("<iI")
+        floor_name = reader.read_string()
+        skin_name = reader.read_string()
+        rect = reader.read("<iiii")
+
+        new_floor = Floor(floor_id, floor_name, rect, skin_name=skin_name)
+
+        layer_count, = reader.read("<H")
+        for i in range(0, layer_count):
+            layer_id, placement_count = reader.read("<iI")
+            new_floor.add_layer(layer_id)
+            if placement_count > 0:
+                placements = reader.read_array("H", placement_count * 3)
+                new_floor.tile_placements[layer_id] = [(FloorObjectLoader.tile_types[placements[j]],
+                                                        placements[j + 1], placements[j + 2])
+                                                       for j in range(0, len(placements), 3)]
+
+        floor_plan_count, = reader.read("<H")
+        for i in range(0, floor_plan_count):
+            layer_id, = reader.read("<i")
+            new_floor.floor_plans[layer_id] = FloorPlan.load(reader, layer_id)
+
+        teleport_count, = reader.read("<H")
+        for i in range(0, teleport_count):
+            teleport_name = reader.read_string()
+            position_count, = reader.read("<H")
+            new_floor.teleports[teleport_name] = [reader.read("<iii") for j in range(0, position_count)]
+
+        exit_count, = reader.read("<H")
+        for i in range(0, exit_count):
+            tile_id, x, y, z = reader.read("<Hiii")
+            tile_type = FloorObjectLoader.tile_types[tile_id]
+            new_floor.exits[Floor.OBJECT_TO_DIRECTION[tile_type.name]] = tile_type.new_object(x, y, z)
+
+        new_floor.build_tile_masks()
+        new_floor.map_version = map_version
+
+        return new_floor
+
+
+class Battle:
+    EVENTS = None
+    READY = "ready"
+    PLAYING = "playing"
+    END = "end"
+
+    TACTIC_NEXT = "next opponent"
+
+    def __init__(self, team1: Team, team2: Team, battle_floor: Floor = None):
+        self.teams = [team1, team2]
+        self.turns = 0
+        self.tick_count = 0
+        self._state = Battle.READY
+        self.next_team = None
+        self.battle_floor = battle_floor
+        self.order_of_play = []
+        self.current_target = None
+        self.bots = {}
+
+    def __str__(self):
+        return "Battle between team {0} and team {1} ({5})\nRound {2}\n{3}\n{4}".format(self.teams[0].name,
+                                                                                        self.teams[1].name,
+                                                                                        self.turns,
+                                                                                        self.teams[0],
+                                                                                        self.teams[1],
+                                                                                        self._state)
+
+    def print(self):
+        print("Team {0} vs. Team {1}: Round {2}".format(self.teams[0].name,
                                                         self.teams[1].name,
                                                         self.turns))
         for team in self.teams:
@@ -1599,10 +2489,8 @@ class Battle:
                 # OK we are good to attempt an attack
                 else:
 
-                    #  Is there a clear path to the target?
-                    attack_route = Navigator(self.battle_floor)
-                    result = attack_route.navigate((current_player.rect.x, current_player.rect.y, current_player.layer),
-                                                   (opponent.rect.x, opponent.rect.y, opponent.layer), direct=True)
+                    #  Is there a clear shot at the target?
+                    result = self.battle_floor.has_clear_shot(current_player.xyz, opponent.xyz)
 
                     # If path is not clear then we cannot proceed
                     if result is False:
@@ -1799,13 +2687,17 @@ class CharacterFactory:
         for character_name in character_names:
             character = self._npcs.get_character_by_name(character_name)
             # character.roll()
-            character.load_stats(rpg_classes.get_stats_by_name(character.rpg_class), overwrite=False)
-            character.load_stats(rpg_races.get_stats_by_name(character.race), overwrite=False)
-            character.load_attributes(rpg_races.get_attributes_by_name(character.race))
-            add_core_stats(character)
-            add_derived_stats(character)
+            # Batch up the stat changes so that each derived stat only gets calculated once
+            with character.batch():
+                character.load_stats(rpg_classes.get_stats_by_name(character.rpg_class), overwrite=False)
+                character.load_stats(rpg_races.get_stats_by_name(character.race), overwrite=False)
+                character.load_attributes(rpg_races.get_attributes_by_name(character.race))
+                add_core_stats(character)
+                add_derived_stats(character)
             # character.examine()
 
+        add_table_derived_stats(self._npcs.stat_table)
+
         print("Characters loaded")
 
         print("Loading Attacks...")
@@ -1859,7 +2751,9 @@ class Game:
     END = "END"
 
     SAVE_GAME_DIR = os.path.dirname(__file__) + "\\saves\\"
-    GAME_DATA_DIR = os.path.dirname(__file__) + "\\Squoids_data\\"
+    GAME_DATA_DIR = os.path.join(os.path.dirname(__file__), "Squoids_data", "")
+
+    BATTLE_FLOOR_IDS = (0, 2, 3, 4, 5)
 
     def __init__(self, name: str):
 
@@ -1879,16 +2773,18 @@ class Game:
         self.character_factory = None
         self.battle = None
         self._battle_floor_id = None
+        self._monster_stat_table = None
 
         self._stats = utils.StatEngine(self.name)
         self.hst = utils.HighScoreTable(self.name)
+        self.snapshot = GameSnapshot(self)
 
     def __str__(self):
         return "{0}. Events({1}).".format(self.name, self.events.size())
 
     @property
     def current_floor(self):
-        return self.floor_factory.floors[self.current_floor_id]
+        return self.floor_factory.get_floor(self.current_floor_id)
 
     def get_current_floor(self):
         return self.current_floor
@@ -1920,10 +2816,19 @@ class Game:
 
     def start_battle(self):
         self.state = Game.BATTLE
-        self._battle_floor_id = random.choice((0, 2, 3, 4, 5))
+        self._battle_floor_id = random.choice(Game.BATTLE_FLOOR_IDS)
 
         # self._battle_floor_id = 101
 
+        team1, team2 = self.create_battle_teams()
+
+        battle_floor = self.floor_factory.get_floor(self._battle_floor_id)
+
+        self.battle = Battle(team1, team2, battle_floor)
+        self.battle.start()
+
+    def create_battle_teams(self, team_size: int = 5):
+
         RED = (237, 28, 36)
         GREEN = (34, 177, 76)
         BLUE = (63, 72, 204)
@@ -1936,11 +2841,15 @@ class Game:
 
         characters = list(self._npcs.get_characters())
 
-        for i in range(0, 5):
+        # The characters in the battle share a stat table
+        stat_table = trpg.StatTable("Battle")
+        add_table_derived_stats(stat_table)
+
+        for i in range(0, team_size):
 
             try:
                 char = random.choice(characters)
-                new_char = copy.deepcopy(char)
+                new_char = char.clone(stat_table)
                 new_char_type = new_char.get_attribute("Image") + "_blue"
                 new_player = Player(name=new_char_type, rect=(0, 0, 32, 32), layer=3, character=new_char)
                 attack_name = new_char.get_attribute("Attack")
@@ -1950,7 +2859,7 @@ class Game:
                 characters.remove(char)
 
                 char = random.choice(characters)
-                new_char = copy.deepcopy(char)
+                new_char = char.clone(stat_table)
                 new_char_type = new_char.get_attribute("Image") + "_red"
                 new_player = Player(name=new_char_type, rect=(0, 0, 32, 32), layer=3, character=new_char)
                 attack_name = new_char.get_attribute("Attack")
@@ -1966,10 +2875,7 @@ class Game:
                 print("Arghhh")
                 print(str(err))
 
-        battle_floor = self.floor_factory.floors[self._battle_floor_id]
-
-        self.battle = Battle(team1, team2, battle_floor)
-        self.battle.start()
+        return team1, team2
 
     def tick(self):
 
@@ -1993,6 +2899,7 @@ class Game:
 
         self.state = Game.READY
         self.current_floor_id = 104
+        self.snapshot = GameSnapshot(self)
 
         self.character_factory = CharacterFactory()
         self.character_factory.initialise()
@@ -2003,10 +2910,11 @@ class Game:
         self.load_attacks("attacks.csv")
 
         # self._stats.print()
+        # Floors are built when they are first needed so only load their layouts for now
         print("Loading Floors")
         self.floor_factory = FloorBuilder(Game.GAME_DATA_DIR)
+        self.floor_factory.add_listener(self)
         self.floor_factory.initialise()
-        self.floor_factory.load_floors()
 
         print("Floors Loaded")
 
@@ -2015,9 +2923,13 @@ class Game:
 
         self.hst.load()
 
+        # All of the floor monsters share a stat table
+        self._monster_stat_table = trpg.StatTable("Monsters")
+        add_table_derived_stats(self._monster_stat_table)
+
         characters = list(self._npcs.get_characters())
         char = random.choice(characters)
-        new_char = copy.deepcopy(char)
+        new_char = char.clone()
         new_char_type = new_char.get_attribute("Image") + "_red"
         new_player = Player(name=new_char_type, rect=(0, 10, 32, 32), layer=1, character=new_char)
         attack_name = new_char.get_attribute("Attack")
@@ -2035,21 +2947,28 @@ class Game:
         #     self.add_enemy(new_player, auto_position=True)
         #     characters.remove(char)
 
-        for floor in self.floor_factory.floors.values():
-            if floor.id >= 100:
-                characters = list(self._npcs.get_characters())
-                for i in range(0, 4):
-                    char = random.choice(characters)
-                    new_char = copy.deepcopy(char)
-                    new_char_type = new_char.get_attribute("Image") + "_blue"
-                    new_player = Player(name=new_char_type, rect=(0, 10, 32, 32), layer=1, character=new_char)
-                    new_player.add_attack(self._attacks["Basic Attack"])
-                    floor.add_enemy(new_player, auto_position=True)
-                    characters.remove(char)
-
         self.current_map = self._maps.get_map(1)
         # self.current_map.print()
 
+    def floor_loaded(self, floor: Floor):
+
+        # Put a floor back how it was if it has been unloaded before otherwise give it some new monsters
+        if self.snapshot.floor_loaded(floor) is True or floor.id < 100:
+            return
+
+        characters = list(self._npcs.get_characters())
+        for i in range(0, 4):
+            char = random.choice(characters)
+            new_char = char.clone(self._monster_stat_table)
+            new_char_type = new_char.get_attribute("Image") + "_blue"
+            new_player = Player(name=new_char_type, rect=(0, 10, 32, 32), layer=1, character=new_char)
+            new_player.add_attack(self._attacks["Basic Attack"])
+            floor.add_enemy(new_player, auto_position=True)
+            characters.remove(char)
+
+    def floor_unloaded(self, floor: Floor):
+        self.snapshot.floor_unloaded(floor)
+
     def load_map(self, location_file_name: str, map_links_file_name: str):
 
         # Load in locations
@@ -2077,13 +2996,17 @@ class Game:
         for character_name in character_names:
             character = self._npcs.get_character_by_name(character_name)
             # character.roll()
-            character.load_stats(rpg_classes.get_stats_by_name(character.rpg_class), overwrite=False)
-            character.load_stats(rpg_races.get_stats_by_name(character.race), overwrite=False)
-            character.load_attributes(rpg_races.get_attributes_by_name(character.race))
-            add_core_stats(character)
-            add_derived_stats(character)
+            # Batch up the stat changes so that each derived stat only gets calculated once
+            with character.batch():
+                character.load_stats(rpg_classes.get_stats_by_name(character.rpg_class), overwrite=False)
+                character.load_stats(rpg_races.get_stats_by_name(character.race), overwrite=False)
+                character.load_attributes(rpg_races.get_attributes_by_name(character.race))
+                add_core_stats(character)
+                add_derived_stats(character)
             # character.examine()
 
+        add_table_derived_stats(self._npcs.stat_table)
+
         print("Characters loaded")
 
     def load_items(self, item_file_name: str):
@@ -2161,11 +3084,23 @@ class Game:
 
         self.hst.save()
 
-    def save(self):
-        pass
+    def save(self, file_name: str = None, full: bool = False):
 
-    def load(self):
-        pass
+        if file_name is None:
+            file_name = Game.SAVE_GAME_DIR + self.name + GameSnapshot.FILE_EXTENSION
+
+        self.snapshot.save(file_name, full=full)
+
+        logging.info("%s saved." % file_name)
+
+    def load(self, file_name: str = None):
+
+        if file_name is None:
+            file_name = Game.SAVE_GAME_DIR + self.name + GameSnapshot.FILE_EXTENSION
+
+        self.snapshot.load(file_name)
+
+        logging.info("%s loaded." % file_name)
 
     def add_player(self, new_player: Player, auto_position: bool = False):
 
@@ -2237,6 +3172,554 @@ class Game:
             raise (Exception("You can't go {0} from here!".format(direction)))
 
 
+class GameSnapshot:
+    '''
+    Saves a game to a compact versioned binary snapshot file and loads it back again.
+    Every save appends a record to the file. A full record holds all of the floors and a delta record only holds
+    the floors that have changed since the last save, so loading plays the records back in order.
+    Floors that are unloaded to save memory are kept here in the same compact form until they are needed again.
+    '''
+
+    MAGIC = b"NMRD"
+    VERSION = 2
+    FILE_EXTENSION = ".sav"
+
+    # Record types
+    FULL = 1
+    DELTA = 2
+    END_OF_RECORD = 0xFF
+
+    # Start a new file with a full record after this many delta records
+    MAX_DELTAS = 20
+
+    def __init__(self, game: Game):
+        self.game = game
+        self.file_name = None
+        self.deltas = 0
+        self.unloaded_floors = {}
+        self._saved_floor_versions = {}
+
+    def __str__(self):
+        return "GameSnapshot {0}: file={1}, deltas={2}".format(self.game.name, self.file_name, self.deltas)
+
+    @staticmethod
+    def get_floor_version(floor: Floor):
+        return floor.map_version, floor.tick_count
+
+    def is_floor_changed(self, floor: Floor):
+        return floor.id == self.game.current_floor_id or \
+               self._saved_floor_versions.get(floor.id) != GameSnapshot.get_floor_version(floor)
+
+    def save(self, file_name: str, full: bool = False):
+
+        game = self.game
+
+        if game.state == Game.BATTLE:
+            raise Exception("Can't save game {0} during a battle!".format(game.name))
+
+        # Deltas can only be added to the file that the last save went to
+        if file_name != self.file_name or self.deltas >= GameSnapshot.MAX_DELTAS or \
+                os.path.exists(file_name) is False:
+            full = True
+
+        floors = [floor for floor in game.floor_factory.floors.values()
+                  if full is True or self.is_floor_changed(floor)]
+
+        floor_records = [(floor.id, self.compile_floor(floor)) for floor in floors]
+        floor_records += [(floor_id, floor_record) for floor_id, (floor_record, is_changed) in
+                          self.unloaded_floors.items() if full is True or is_changed is True]
+
+        file_directory = os.path.dirname(file_name)
+        if file_directory != "":
+            os.makedirs(file_directory, exist_ok=True)
+
+        with open(file_name, "wb" if full is True else "ab") as snapshot_file:
+
+            writer = SnapshotWriter(snapshot_file)
+
+            if full is True:
+                writer.write("<4sH", GameSnapshot.MAGIC, GameSnapshot.VERSION)
+                writer.write("<B", GameSnapshot.FULL)
+            else:
+                writer.write("<B", GameSnapshot.DELTA)
+
+            writer.write("<Ii", game.tick_count, game.current_floor_id)
+            self.write_player(writer, game.player)
+            self.write_random_state(writer)
+
+            writer.write("<H", len(floor_records))
+            for floor_id, floor_record in floor_records:
+                writer.write("<iI", floor_id, len(floor_record))
+                writer.write_bytes(floor_record)
+
+            writer.write("<B", GameSnapshot.END_OF_RECORD)
+
+        self.file_name = file_name
+        self.deltas = 0 if full is True else self.deltas + 1
+        for floor in floors:
+            self._saved_floor_versions[floor.id] = GameSnapshot.get_floor_version(floor)
+        for floor_id, (floor_record, is_changed) in self.unloaded_floors.items():
+            self.unloaded_floors[floor_id] = (floor_record, False)
+
+        print("Saved {0} floors to {1}".format(len(floor_records), file_name))
+
+    def load(self, file_name: str):
+
+        game = self.game
+
+        if game.state == Game.BATTLE:
+            raise Exception("Can't load game {0} during a battle!".format(game.name))
+
+        with open(file_name, "rb") as snapshot_file, \
+                mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+            reader = SnapshotReader(data)
+
+            magic, version = reader.read("<4sH")
+            if magic != GameSnapshot.MAGIC or version != GameSnapshot.VERSION:
+                raise Exception("{0} is not a version {1} save game file".format(file_name, GameSnapshot.VERSION))
+
+            game_state = None
+            floor_records = {}
+            records = 0
+
+            # Later records replace the game state and any floors that they hold
+            while reader.remaining > 0:
+                try:
+                    record_game_state, record_floor_records = self.read_record(reader)
+                except struct.error as err:
+                    print("Ignoring incomplete record {0} in {1}: {2}".format(records + 1, file_name, err))
+                    break
+
+                game_state = record_game_state
+                floor_records.update(record_floor_records)
+                records += 1
+
+        if game_state is None:
+            raise Exception("{0} does not contain a saved game".format(file_name))
+
+        # Throw away all of the current floors. The saved ones get put back when they are next needed
+        # and any others are built from scratch
+        for floor_id in list(game.floor_factory.floors.keys()):
+            game.floor_factory.unload_floor(floor_id, notify=False)
+
+        self.unloaded_floors = {floor_id: (floor_record, False) for floor_id, floor_record in floor_records.items()}
+        self._saved_floor_versions = {}
+
+        tick_count, current_floor_id, player_state, random_state = game_state
+
+        game.tick_count = tick_count
+        game.current_floor_id = current_floor_id
+        game.player = self.new_player(player_state)
+        game.current_floor.add_player(game.player)
+
+        random.setstate(random_state)
+
+        self.file_name = file_name
+        self.deltas = records - 1
+
+        print("Loaded {0} records from {1}".format(records, file_name))
+
+    def floor_loaded(self, floor: Floor):
+
+        if floor.id not in self.unloaded_floors.keys():
+            return False
+
+        floor_record, is_changed = self.unloaded_floors.pop(floor.id)
+
+        floor_id, (tick_count, switch_on, floor_plans, monster_states) = self.read_floor(SnapshotReader(floor_record))
+        monsters = [self.new_player(monster_state, self.game._monster_stat_table) for monster_state in monster_states]
+        floor.restore(tick_count, switch_on, floor_plans, monsters)
+
+        if is_changed is False:
+            self._saved_floor_versions[floor.id] = GameSnapshot.get_floor_version(floor)
+
+        return True
+
+    def floor_unloaded(self, floor: Floor):
+        self.unloaded_floors[floor.id] = (self.compile_floor(floor), self.is_floor_changed(floor))
+        self._saved_floor_versions.pop(floor.id, None)
+
+    def read_record(self, reader: SnapshotReader):
+
+        record_type, = reader.read("<B")
+        if record_type not in (GameSnapshot.FULL, GameSnapshot.DELTA):
+            raise struct.error("Unknown record type {0}".format(record_type))
+
+        tick_count, current_floor_id = reader.read("<Ii")
+        player_state = self.read_player(reader)
+        random_state = self.read_random_state(reader)
+
+        floor_records = {}
+        floor_count, = reader.read("<H")
+        for i in range(0, floor_count):
+            floor_id, size = reader.read("<iI")
+            floor_records[floor_id] = reader.read_bytes(size)
+
+        end_of_record, = reader.read("<B")
+        if end_of_record != GameSnapshot.END_OF_RECORD:
+            raise struct.error("Record is missing its end marker")
+
+        return (tick_count, current_floor_id, player_state, random_state), floor_records
+
+    def compile_floor(self, floor: Floor):
+        floor_record = io.BytesIO()
+        self.write_floor(SnapshotWriter(floor_record), floor)
+        return floor_record.getvalue()
+
+    def write_floor(self, writer: SnapshotWriter, floor: Floor):
+
+        writer.write("<iIB", floor.id, floor.tick_count, floor.switch_on)
+
+        writer.write("<H", len(floor.floor_plans))
+        for layer_id, floor_plan in floor.floor_plans.items():
+            writer.write("<i", layer_id)
+            floor_plan.save(writer)
+
+        writer.write("<H", len(floor.monsters))
+        for monster in floor.monsters:
+            self.write_player(writer, monster)
+
+    def read_floor(self, reader: SnapshotReader):
+
+        floor_id, tick_count, switch_on = reader.read("<iIB")
+
+        floor_plans = {}
+        layer_count, = reader.read("<H")
+        for i in range(0, layer_count):
+            layer_id, = reader.read("<i")
+            floor_plans[layer_id] = FloorPlan.load(reader, layer_id)
+
+        monster_count, = reader.read("<H")
+        monster_states = [self.read_player(reader) for i in range(0, monster_count)]
+
+        return floor_id, (tick_count, switch_on == 1, floor_plans, monster_states)
+
+    @staticmethod
+    def get_saved_stats(character: trpg.RPGCharacter):
+
+        saved_stats = []
+
+        for stat in character.private_data.get_all_stats():
+            if type(stat) in (trpg.CoreStat, trpg.TableStat):
+                saved_stats.append((False, stat.name, stat.value))
+
+        # Public stats are saved without the character's prefix so that they can go back onto a new copy
+        if character.public_data is not None:
+            prefix = character.get_public_stat_name("")
+            for stat in character.public_data.get_all_stats():
+                if type(stat) in (trpg.CoreStat, trpg.TableStat) and stat.name.startswith(prefix):
+                    saved_stats.append((True, stat.name[len(prefix):], stat.value))
+
+        return [saved_stat for saved_stat in saved_stats if type(saved_stat[2]) in (int, float)]
+
+    def write_player(self, writer: SnapshotWriter, player: Player):
+
+        writer.write_string(player.character.name)
+        writer.write_string(player.name)
+        writer.write_string(player.get_attack().name)
+
+        x, y, z = player.xyz
+        writer.write("<iiiiiiB", x, y, z, player.treasure, player.keys, player.boss_keys, player.is_solid)
+        writer.write_number(player.AP)
+
+        writer.write("<H", len(player.effects))
+        for effect_name, count in player.effects.items():
+            writer.write_string(effect_name)
+            writer.write("<i", count)
+
+        saved_stats = GameSnapshot.get_saved_stats(player.character)
+        writer.write("<H", len(saved_stats))
+        for is_public, stat_name, value in saved_stats:
+            writer.write("<B", is_public)
+            writer.write_string(stat_name)
+            writer.write_number(value)
+
+    def read_player(self, reader: SnapshotReader):
+
+        character_name = reader.read_string()
+        player_name = reader.read_string()
+        attack_name = reader.read_string()
+        x, y, z, treasure, keys, boss_keys, is_solid = reader.read("<iiiiiiB")
+        AP = reader.read_number()
+
+        effects = {}
+        effect_count, = reader.read("<H")
+        for i in range(0, effect_count):
+            effect_name = reader.read_string()
+            effects[effect_name], = reader.read("<i")
+
+        saved_stats = []
+        stat_count, = reader.read("<H")
+        for i in range(0, stat_count):
+            is_public, = reader.read("<B")
+            stat_name = reader.read_string()
+            saved_stats.append((is_public == 1, stat_name, reader.read_number()))
+
+        return (character_name, player_name, attack_name, (x, y, z), (treasure, keys, boss_keys), is_solid == 1, AP,
+                effects, saved_stats)
+
+    def new_player(self, player_state: tuple, stat_table: trpg.StatTable = None):
+
+        character_name, player_name, attack_name, xyz, items, is_solid, AP, effects, saved_stats = player_state
+
+        new_char = self.game._npcs.spawn(character_name, stat_table)
+        with new_char.batch():
+            for is_public, stat_name, value in saved_stats:
+                if is_public is True:
+                    stat = new_char.public_data.get_stat(new_char.get_public_stat_name(stat_name))
+                else:
+                    stat = new_char.private_data.get_stat(stat_name)
+                if stat is not None:
+                    stat.value = value
+
+        x, y, z = xyz
+        new_player = Player(name=player_name, rect=(x, y, 32, 32), layer=z, character=new_char)
+        new_player.add_attack(self.game._attacks[attack_name])
+        new_player.treasure, new_player.keys, new_player.boss_keys = items
+        new_player.is_solid = is_solid
+        new_player.AP = AP
+        new_player.effects = effects
+
+        return new_player
+
+    @staticmethod
+    def write_random_state(writer: SnapshotWriter):
+
+        version, internal_state, gauss_next = random.getstate()
+        writer.write("<BH", version, len(internal_state))
+        writer.write("<{0}I".format(len(internal_state)), *internal_state)
+        writer.write("<Bd", gauss_next is not None, gauss_next or 0.0)
+
+    @staticmethod
+    def read_random_state(reader: SnapshotReader):
+
+        version, size = reader.read("<BH")
+        internal_state = reader.read("<{0}I".format(size))
+        has_gauss_next, gauss_next = reader.read("<Bd")
+
+        return version, internal_state, gauss_next if has_gauss_next == 1 else None
+
+
+class BattleSimulator:
+    '''
+    Runs seeded bot vs. bot battles without a display and collects statistics about the results.
+    Each worker process loads the game data once and then plays battles on fresh copies of the battle floors.
+    '''
+
+    MAX_TURNS = 200
+
+    def __init__(self, floor_id: int = None, processes: int = None, team_size: int = 5, max_turns: int = None,
+                 data_dir: str = None):
+
+        if max_turns is None:
+            max_turns = BattleSimulator.MAX_TURNS
+
+        if data_dir is None:
+            data_dir = Game.GAME_DATA_DIR
+
+        self.floor_id = floor_id
+        self.processes = processes
+        self.team_size = team_size
+        self.max_turns = max_turns
+        self.data_dir = data_dir
+        self.results = []
+        self.elapsed = 0
+
+    def __str__(self):
+        return "BattleSimulator: floor={0}, processes={1}, battles={2}".format(self.floor_id, self.processes,
+                                                                             len(self.results))
+
+    def run(self, battles: int, seed: int = 0):
+
+        jobs = [(seed + i, self.floor_id, self.team_size, self.max_turns) for i in range(0, battles)]
+
+        started = time.perf_counter()
+
+        # Set up here first so that a bad configuration fails straight away rather than in every worker
+        _init_battle_simulator(self.data_dir)
+        if _simulator_error is not None:
+            raise _simulator_error
+
+        if self.processes == 1:
+            self.results = [_simulate_battle(job) for job in jobs]
+
+        else:
+            with multiprocessing.Pool(processes=self.processes, initializer=_init_battle_simulator,
+                                      initargs=(self.data_dir,)) as pool:
+                self.results = pool.map(_simulate_battle, jobs, chunksize=max(1, battles // 64))
+
+        self.elapsed = time.perf_counter() - started
+
+        return self.get_summary()
+
+    @staticmethod
+    def play_battle(game: Game, seed: int, floor_id: int = None, team_size: int = 5, max_turns: int = None):
+
+        if max_turns is None:
+            max_turns = BattleSimulator.MAX_TURNS
+
+        random.seed(seed)
+
+        if floor_id is None:
+            floor_id = random.choice(Game.BATTLE_FLOOR_IDS)
+
+        # Throw away the events from the last battle
+        game.events = EventQueue()
+        Floor.EVENTS = game.events
+        Battle.EVENTS = game.events
+
+        team1, team2 = game.create_battle_teams(team_size=team_size)
+
+        # Battles change the floor so always fight on a copy of it
+        battle_floor = copy.deepcopy(game.floor_factory.get_floor(floor_id))
+        battle_floor.route_cache.reset()
+
+        battle = Battle(team1, team2, battle_floor)
+        battle.start()
+
+        # Guard against bots that never finish their turn
+        max_actions = max_turns * team_size * 2 * 50
+        actions = 0
+
+        while battle.state == Battle.PLAYING and battle.turns < max_turns and actions < max_actions:
+            battle.do_auto(override=True)
+            battle.tick()
+            actions += 1
+
+        winning_team = battle.get_winning_team()
+
+        result = {"seed": seed,
+                  "floor": floor_id,
+                  "turns": battle.turns,
+                  "winner": None if winning_team is None else winning_team.name,
+                  "players": []}
+
+        for team in battle.teams:
+            for player in team.players:
+                result["players"].append({"team": team.name,
+                                          "character": player.character.name,
+                                          "attack": player.get_attack().name,
+                                          "damage": player.character.get_stat("Damage").value,
+                                          "dead": player.is_dead(),
+                                          "won": team is winning_team})
+
+        return result
+
+    def get_summary(self):
+
+        battles = len(self.results)
+
+        summary = {"battles": battles,
+                   "elapsed": self.elapsed,
+                   "battles_per_second": battles / self.elapsed if self.elapsed > 0 else 0,
+                   "wins": collections.Counter(),
+                   "turns": {},
+                   "damage": {},
+                   "characters": {}}
+
+        if battles == 0:
+            return summary
+
+        turns = []
+        damage = []
+        characters = {}
+
+        for result in self.results:
+            summary["wins"][result["winner"]] += 1
+            turns.append(result["turns"])
+
+            for player in result["players"]:
+                damage.append(player["damage"])
+                character = characters.setdefault(player["character"], {"battles": 0, "wins": 0, "damage": []})
+                character["battles"] += 1
+                character["damage"].append(player["damage"])
+                if player["won"] is True:
+                    character["wins"] += 1
+
+        summary["turns"] = BattleSimulator.describe(turns)
+        summary["damage"] = BattleSimulator.describe(damage)
+
+        for name, character in characters.items():
+            summary["characters"][name] = {"battles": character["battles"],
+                                           "win_rate": character["wins"] / character["battles"],
+                                           "damage": BattleSimulator.describe(character["damage"])}
+
+        return summary
+
+    @staticmethod
+    def describe(values: list):
+        return {"min": min(values),
+                "max": max(values),
+                "mean": statistics.mean(values),
+                "stdev": statistics.pstdev(values)}
+
+    def print(self):
+
+        summary = self.get_summary()
+
+        print("{0} battles in {1:.1f}s ({2:.1f} battles/sec)".format(summary["battles"], summary["elapsed"],
+                                                                      summary["battles_per_second"]))
+        if summary["battles"] == 0:
+            return
+
+        for winner, count in summary["wins"].most_common():
+            if winner is not None:
+                print("\tTeam {0}: {1} wins ({2:.1%})".format(winner, count, count / summary["battles"]))
+
+        draws = summary["wins"][None]
+        print("Draws: {0} ({1:.1%})".format(draws, draws / summary["battles"]))
+
+        print("Turns: {mean:.1f} mean, {stdev:.1f} stdev, {min}-{max}".format(**summary["turns"]))
+        print("Damage taken: {mean:.1f} mean, {stdev:.1f} stdev, {min}-{max}".format(**summary["damage"]))
+
+        for name, character in sorted(summary["characters"].items(), key=lambda item: item[1]["win_rate"],
+                                      reverse=True):
+            print("\t{0}: win rate {1:.1%} over {2} battles, damage taken {3:.1f} mean".format(
+                name, character["win_rate"], character["battles"], character["damage"]["mean"]))
+
+
+# The game loaded by each battle simulator process
+_simulator_game = None
+_simulator_error = None
+
+
+def _init_battle_simulator(data_dir: str):
+    global _simulator_game, _simulator_error
+
+    Game.GAME_DATA_DIR = data_dir
+
+    # Items are scattered over the floors when they load so seed first to give every process the same floors
+    random.seed(0)
+
+    # An error here would make a worker pool keep replacing its workers forever so keep it to report later
+    _simulator_error = None
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            _simulator_game = Game("Simulator")
+            _simulator_game.initialise()
+
+            # Build all of the battle floors now while the seed is fixed and keep them for every battle
+            _simulator_game.floor_factory.max_resident_floors = None
+            _simulator_game.floor_factory.load_floors(Game.BATTLE_FLOOR_IDS)
+
+    except Exception as err:
+        _simulator_error = Exception("Unable to set up battle simulator with data directory {0}:{1}".format(
+            data_dir, str(err)))
+
+
+def _simulate_battle(job):
+    seed, floor_id, team_size, max_turns = job
+
+    if _simulator_error is not None:
+        raise _simulator_error
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return BattleSimulator.play_battle(_simulator_game, seed, floor_id=floor_id, team_size=team_size,
+                                           max_turns=max_turns)
+
+
 class Event():
     # Event Types
     QUIT = "quit"
@@ -2296,14 +3779,115 @@ class EventQueue():
             print(event)
 
 
+class RouteCache:
+    '''
+    Least recently used cache of a floor's Navigator routes keyed by start, finish and search options.
+    A route to the same finish that passes through the start is reused from that point on.
+    The floor clears its cache whenever its map changes.
+    '''
+
+    MAX_ROUTES = 512
+    MAX_ROUTES_PER_FINISH = 8
+
+    def __init__(self, max_routes: int = None):
+
+        if max_routes is None:
+            max_routes = RouteCache.MAX_ROUTES
+
+        self.max_routes = max_routes
+        self._routes = collections.OrderedDict()
+        self._starts_by_finish = {}
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def __str__(self):
+        return "RouteCache: routes={0}, hits={1} (suffix={2}), misses={3}, stale={4}, evictions={5}".format(
+            len(self._routes), self.hits, self.suffix_hits, self.misses, self.stale, self.evictions)
+
+    def clear(self):
+        self._routes = collections.OrderedDict()
+        self._starts_by_finish = {}
+
+    # Clear the cache and start counting again
+    def reset(self):
+        self.clear()
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, start, finish, options):
+
+        finish_key = (finish, options)
+        key = (start,) + finish_key
+
+        route = self._routes.get(key)
+        if route is not None:
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return list(route)
+
+        # Has someone already been given a route to here that goes through the start?
+        for cached_start in self._starts_by_finish.get(finish_key, ()):
+            route = self._routes.get((cached_start,) + finish_key)
+            if route is not None and start in route:
+                route = route[route.index(start):]
+                self.put(start, finish, options, route)
+                self.hits += 1
+                self.suffix_hits += 1
+                return list(route)
+
+        self.misses += 1
+
+        return None
+
+    def put(self, start, finish, options, route: list):
+
+        finish_key = (finish, options)
+        key = (start,) + finish_key
+
+        self._routes[key] = tuple(route)
+        self._routes.move_to_end(key)
+
+        starts = self._starts_by_finish.setdefault(finish_key, [])
+        if start not in starts:
+            starts.append(start)
+            if len(starts) > RouteCache.MAX_ROUTES_PER_FINISH:
+                del starts[0]
+
+        while len(self._routes) > self.max_routes:
+            old_key, old_route = self._routes.popitem(last=False)
+            self.evictions += 1
+
+            old_finish_key = old_key[1:]
+            old_starts = self._starts_by_finish.get(old_finish_key)
+            if old_starts is not None and old_key[0] in old_starts:
+                old_starts.remove(old_key[0])
+                if len(old_starts) == 0:
+                    del self._starts_by_finish[old_finish_key]
+
+    def discard(self, start, finish, options):
+
+        key = (start, finish, options)
+        if key in self._routes.keys():
+            del self._routes[key]
+            self.stale += 1
+
+
 class Navigator:
-    ALTERNATE_OPTION_DIFF = 4
-    MAX_RECURSION_LEVEL = 100
+    MAX_NODES_EXPANDED = 20000
 
     def __init__(self, floor: Floor):
         self.floor = floor
         self.route = []
         self.danger_count = 0
+        self.nodes_expanded = 0
+        self.elapsed = 0
+        self.from_cache = False
 
     def distance(self, a, b):
         ax, ay, az = a
@@ -2311,150 +3895,308 @@ class Navigator:
         d = math.sqrt(math.pow(ax - bx, 2) + math.pow(ay - by, 2) + math.pow(az - bz, 2))
         return d
 
-    def navigate(self, start, finish, direct=False, walkable=False, safe=False, level=0, visited=[]):
+    def is_passable(self, position, walkable=False, safe=False):
 
-        if level == 0:
-            self.route = []
-            visited = []
-            self.danger_count = 0
+        x, y, z = position
 
-        if start in visited:
-            # print("Already been here on this navigation!")
-            return False
+        return self.floor.is_passable(x, y, z, walkable=walkable, safe=safe)
 
-        visited.append(start)
+    def get_options(self, position, finish, direct=False):
 
-        if level >= Navigator.MAX_RECURSION_LEVEL:
-            return False
+        x, y, z = position
+        finishx, finishy, finishz = finish
 
-        d = self.distance(start, finish)
+        dx = x - finishx
+        dy = y - finishy
 
-        # print("{3}. navigating from {0} to {1} (direct={4}, walkable={5},safe={6}). {2:.2f} distance to travel".format(
-        #   start, finish, d, level, direct, walkable, safe))
-        finished = False
+        if direct is True:
+
+            # Only step towards the finish along the axes that close the distance the most
+            options = []
+            if dx != 0:
+                options.append((x - 1 if dx > 0 else x + 1, y, z))
+            if dy != 0:
+                options.append((x, y - 1 if dy > 0 else y + 1, z))
+            if z != finishz:
+                options.append((x, y, z - 1 if z > finishz else z + 1))
+
+            distances = [self.distance(option, finish) for option in options]
+            min_distance = min(distances)
+            options = [option for option, d in zip(options, distances) if d <= min_distance]
 
-        if start == finish:
-            # print("found the finish")
-            self.route.append((start))
-            finished = True
         else:
-            startx, starty, startz = start
+            options = [(x - 1, y, z), (x + 1, y, z), (x, y - 1, z), (x, y + 1, z)]
 
-            if level > 0:
+            # You can only change layers heading towards the finish
+            if z > finishz:
+                options.append((x, y, z - 1))
+            elif z < finishz:
+                options.append((x, y, z + 1))
 
-                # If we tried to go out of bounds then don't usae this route
-                if self.floor.is_in_bounds(startx, starty, startz) is False:
-                    return False
+        return options
 
-                tile = self.floor.get_floor_tile(startx, starty, startz)
+    def is_route_clear(self, route: list, walkable=False, safe=False):
 
-                if tile is not None and tile.is_solid is True:
-                    # print("Hit an obstacle at {0}".format(start))
-                    return False
+        # Players and monsters may have moved into the way since the route was cached
+        for position in route[1:-1]:
+            if self.is_passable(position, walkable=walkable, safe=safe) is False:
+                return False
 
-                elif walkable is True and self.floor.is_occupiable(startx, starty, startz) is False:
-                    # print("Hit an unoccupiable place")
-                    return False
+        return True
 
-                elif safe is True and self.floor.is_dangerous(startx, starty, startz) is True:
-                    # print("Hit an unsafe place!")
-                    return False
+    def navigate(self, start, finish, direct=False, walkable=False, safe=False):
 
-            finishx, finishy, finishz = finish
+        started = time.perf_counter()
 
-            options = []
+        self.route = []
+        self.danger_count = 0
+        self.nodes_expanded = 0
+        self.from_cache = False
+
+        options = (direct, walkable, safe)
+
+        route = self.floor.route_cache.get(start, finish, options)
+        if route is not None:
+            if self.is_route_clear(route, walkable=walkable, safe=safe) is True:
+                self.route = route
+                self.from_cache = True
+                self.elapsed = time.perf_counter() - started
+                return True
+
+            self.floor.route_cache.discard(start, finish, options)
+
+        finishx, finishy, finishz = finish
+
+        # Open list of (estimated total cost, estimate to finish, tie breaker, position)
+        counter = 0
+        h = abs(start[0] - finishx) + abs(start[1] - finishy) + abs(start[2] - finishz)
+        open_heap = [(h, h, counter, start)]
+        came_from = {start: None}
+        costs = {start: 0}
+        closed = set()
+        finished = False
+
+        while len(open_heap) > 0 and self.nodes_expanded < Navigator.MAX_NODES_EXPANDED:
+
+            f, h, tie, position = heapq.heappop(open_heap)
+
+            if position in closed:
+                continue
 
-            dx = startx - finishx
-            dy = starty - finishy
+            if position == finish:
+                finished = True
+                break
 
-            if dx > 0:
+            closed.add(position)
+            self.nodes_expanded += 1
+            cost = costs[position] + 1
 
-                option = (startx - 1, starty, startz)
-                options.append((option, self.distance(option, finish)))
+            for option in self.get_options(position, finish, direct=direct):
 
-                # If you are not far off track also look at other options
-                if direct is False and abs(dx) <= Navigator.ALTERNATE_OPTION_DIFF:
-                    # print("Adding extra X options")
-                    option = (startx + 1, starty, startz)
-                    options.append((option, self.distance(option, finish)))
+                if option in closed or cost >= costs.get(option, cost + 1):
+                    continue
 
-            elif dx < 0:
+                # The finish is always allowed as it is usually occupied by the target
+                if option != finish and self.is_passable(option, walkable=walkable, safe=safe) is False:
+                    closed.add(option)
+                    continue
 
-                option = (startx + 1, starty, startz)
-                options.append((option, self.distance(option, finish)))
+                costs[option] = cost
+                came_from[option] = position
+                counter += 1
+                h = abs(option[0] - finishx) + abs(option[1] - finishy) + abs(option[2] - finishz)
+                heapq.heappush(open_heap, (cost + h, h, counter, option))
 
-                # If you are not hurry and not far off track also look at other options
-                if direct is False and abs(dx) <= Navigator.ALTERNATE_OPTION_DIFF:
-                    # print("Adding extra X options")
-                    option = (startx - 1, starty, startz)
-                    options.append((option, self.distance(option, finish)))
+        if finished is True:
+            position = finish
+            while position is not None:
+                self.route.append(position)
+                position = came_from[position]
+            self.route.reverse()
+            self.floor.route_cache.put(start, finish, options, self.route)
 
-            # If you are not in a hurry and bang on track also look at other options
-            elif dx == 0 and direct is False:
-                # print("Adding extra X options")
-                option = (startx - 1, starty, startz)
-                options.append((option, self.distance(option, finish)))
-                option = (startx + 1, starty, startz)
-                options.append((option, self.distance(option, finish)))
+        self.elapsed = time.perf_counter() - started
 
-            if dy > 0:
+        logging.info("Navigated from {0} to {1}: found={2}, route={3}, expanded={4}, time={5:.4f}s".format(
+            start, finish, finished, len(self.route), self.nodes_expanded, self.elapsed))
 
-                option = (startx, starty - 1, startz)
-                options.append((option, self.distance(option, finish)))
+        return finished
 
-                # If you are not far off track also look at other options
-                if direct is False and abs(dy) <= Navigator.ALTERNATE_OPTION_DIFF:
-                    # print("Adding extra Y options")
-                    option = (startx, starty + 1, startz)
-                    options.append((option, self.distance(option, finish)))
 
-            elif dy < 0:
+class LineOfSight:
+    '''
+    Straight line visibility between two floor positions using a 3D Bresenham walk over the solid tile masks.
+    Players and monsters do not block the view.
+    '''
 
-                option = (startx, starty + 1, startz)
-                options.append((option, self.distance(option, finish)))
+    @staticmethod
+    def distance(a, b):
+        ax, ay, az = a
+        bx, by, bz = b
+        return math.sqrt((ax - bx) ** 2 + (ay - by) ** 2 + (az - bz) ** 2)
 
-                # If you are not far off track also look at other options
-                if direct is False and abs(dy) <= Navigator.ALTERNATE_OPTION_DIFF:
-                    # print("Adding extra Y options")
-                    option = (startx, starty - 1, startz)
-                    options.append((option, self.distance(option, finish)))
+    @staticmethod
+    def get_cells(a, b):
 
-            # If you are bang on track still look at other options
-            elif dy == 0 and direct is False:
-                # print("Adding extra Y options")
-                option = (startx, starty - 1, startz)
-                options.append((option, self.distance(option, finish)))
-                option = (startx, starty + 1, startz)
-                options.append((option, self.distance(option, finish)))
+        x, y, z = a
+        bx, by, bz = b
 
-            if startz > finishz:
+        dx, dy, dz = abs(bx - x), abs(by - y), abs(bz - z)
+        sx = 1 if bx > x else -1
+        sy = 1 if by > y else -1
+        sz = 1 if bz > z else -1
+
+        cells = []
+
+        # Step along the longest axis and use error terms to decide when to step along the others
+        if dx >= dy and dx >= dz:
+            err_y, err_z = 2 * dy - dx, 2 * dz - dx
+            for i in range(dx):
+                x += sx
+                if err_y > 0:
+                    y += sy
+                    err_y -= 2 * dx
+                if err_z > 0:
+                    z += sz
+                    err_z -= 2 * dx
+                err_y += 2 * dy
+                err_z += 2 * dz
+                cells.append((x, y, z))
+
+        elif dy >= dx and dy >= dz:
+            err_x, err_z = 2 * dx - dy, 2 * dz - dy
+            for i in range(dy):
+                y += sy
+                if err_x > 0:
+                    x += sx
+                    err_x -= 2 * dy
+                if err_z > 0:
+                    z += sz
+                    err_z -= 2 * dy
+                err_x += 2 * dx
+                err_z += 2 * dz
+                cells.append((x, y, z))
 
-                option = (startx, starty, startz - 1)
-                options.append((option, self.distance(option, finish)))
+        else:
+            err_x, err_y = 2 * dx - dz, 2 * dy - dz
+            for i in range(dz):
+                z += sz
+                if err_x > 0:
+                    x += sx
+                    err_x -= 2 * dz
+                if err_y > 0:
+                    y += sy
+                    err_y -= 2 * dz
+                err_x += 2 * dx
+                err_y += 2 * dy
+                cells.append((x, y, z))
+
+        return cells
 
-            elif startz < finishz:
+    @staticmethod
+    def is_clear(floor: Floor, a, b):
 
-                option = (startx, starty, startz + 1)
-                options.append((option, self.distance(option, finish)))
+        # The target's own cell does not block the view of it
+        for x, y, z in LineOfSight.get_cells(a, b)[:-1]:
+            if floor.is_in_bounds(x, y, z) is False or \
+                            floor.floor_plans[z].get_mask(x, y) & TileType.SOLID != 0:
+                return False
 
-            options.sort(key=itemgetter(1))
-            option, min_distance = options[0]
+        return True
 
-            # print(str(options))
 
-            for option in options:
-                direction, d = option
+class FlowField:
+    '''
+    Distances to a target from every cell on the target's layer.
+    Built once per floor tick so it can be shared by every bot heading for the same target.
+    '''
 
-                if direct is True and d > min_distance:
-                    continue
+    UNREACHABLE = -1
 
-                if self.navigate(direction, finish, direct=direct, walkable=walkable, safe=safe, level=level + 1,
-                                 visited=visited) is True:
-                    self.route.insert(0, start)
-                    finished = True
-                    break
+    def __init__(self, floor: Floor, target, walkable: bool = False, safe: bool = False):
+        self.floor = floor
+        self.target = target
+        self.walkable = walkable
+        self.safe = safe
+        self.width = floor.rect.width
+        self.height = floor.rect.height
+        self.tick_count = floor.tick_count
+        self._distances = array.array("l", [FlowField.UNREACHABLE]) * (self.width * self.height)
+        self.nodes_expanded = 0
 
-        return finished
+        self.build()
+
+    def __str__(self):
+        return "FlowField to {0} (walkable={1}, safe={2}): expanded={3}".format(self.target, self.walkable,
+                                                                                self.safe, self.nodes_expanded)
+
+    def build(self):
+
+        targetx, targety, targetz = self.target
+        if self.floor.is_in_bounds(targetx, targety, targetz) is False:
+            return
+
+        # Unit cost moves so a breadth first search gives the same distances as Dijkstra
+        self._distances[targetx * self.height + targety] = 0
+        queue = collections.deque([(targetx, targety)])
+
+        while len(queue) > 0:
+            x, y = queue.popleft()
+            self.nodes_expanded += 1
+            distance = self._distances[x * self.height + y] + 1
+
+            for option_x, option_y in ((x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)):
+                if 0 <= option_x < self.width and 0 <= option_y < self.height:
+                    index = option_x * self.height + option_y
+                    if self._distances[index] == FlowField.UNREACHABLE and \
+                            self.floor.is_passable(option_x, option_y, targetz, walkable=self.walkable,
+                                                   safe=self.safe) is True:
+                        self._distances[index] = distance
+                        queue.append((option_x, option_y))
+
+    def get_distance(self, x: int, y: int):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self._distances[x * self.height + y]
+        return FlowField.UNREACHABLE
+
+    def next_step(self, position):
+
+        x, y, z = position
+
+        if z != self.target[2]:
+            return None
+
+        if position == self.target:
+            return position
+
+        current_distance = self.get_distance(x, y)
+
+        best_step = None
+        best_distance = None
+
+        for option in ((x - 1, y, z), (x + 1, y, z), (x, y - 1, z), (x, y + 1, z)):
+            option_x, option_y, option_z = option
+            distance = self.get_distance(option_x, option_y)
+
+            if distance == FlowField.UNREACHABLE:
+                continue
+
+            if current_distance != FlowField.UNREACHABLE and distance >= current_distance:
+                continue
+
+            if best_distance is not None and distance >= best_distance:
+                continue
+
+            # Someone may have moved since the field was built so check the cell is still free
+            if option != self.target and \
+                            self.floor.is_passable(option_x, option_y, option_z, walkable=self.walkable,
+                                                   safe=self.safe) is False:
+                continue
+
+            best_step = option
+            best_distance = distance
+
+        return best_step
 
 
 class AIBotBattle:
@@ -2490,7 +4232,7 @@ class AIBotBattle:
 
     def next_path_target(self):
         self._path_target += 1
-        if self._path_target > len(self._path):
+        if self._path_target >= len(self._path):
             self._path_target = 0
 
         return self._path[self._path_target]
@@ -2516,16 +4258,24 @@ class AIBotBattle:
         for player in self.opposition_team.players:
 
             if player.is_dead() is False:
-                result = self.navigator.navigate(start=self.player.xyz,
-                                                 finish=player.xyz,
-                                                 direct=direct,
-                                                 walkable=False,
-                                                 safe=False)
 
                 distance = self.navigator.distance(a=self.player.xyz, b=player.xyz)
+
+                if direct is True:
+                    result = self.battle.battle_floor.has_clear_shot(self.player.xyz, player.xyz, max_distance=self.view_range)
+                    route_length = sum(abs(a - b) for a, b in zip(self.player.xyz, player.xyz)) + 1
+                else:
+                    result = distance < self.view_range and \
+                             self.navigator.navigate(start=self.player.xyz,
+                                                     finish=player.xyz,
+                                                     direct=direct,
+                                                     walkable=False,
+                                                     safe=False)
+                    route_length = len(self.navigator.route)
+
                 if result is True and distance < self.view_range:
                     opponents.append(
-                        (player, distance, len(self.navigator.route)))
+                        (player, distance, route_length))
                     is_visible = True
                 else:
                     print("Target at distance {0:.2f} beyond range {1}".format(distance, self.view_range))
@@ -2596,15 +4346,12 @@ class AIBotBattle:
 
             # Else navigate towards the target
             else:
-                # Try to go via a safe route
-                result = self.navigator.navigate(start=self.player.xyz,
-                                                 finish=target.xyz,
-                                                 direct=False,
-                                                 walkable=True,
-                                                 safe=True)
-                print("Safe route = {0}: route = {1}".format(result, self.navigator.route))
+                # Try to go via a safe route using the floor's shared flow field
+                flow_field = self.battle.battle_floor.get_flow_field(target.xyz, walkable=True, safe=True)
+                next_xyz = flow_field.next_step(self.player.xyz)
+                print("Safe step = {0}".format(next_xyz))
                 # If no safe route go direct!
-                if result is False:
+                if next_xyz is None:
                     result = self.navigator.navigate(start=self.player.xyz,
                                                      finish=target.xyz,
                                                      direct=True,
@@ -2613,11 +4360,14 @@ class AIBotBattle:
 
                     print("Direct route = {0}: route = {1}".format(result, self.navigator.route))
 
+                    if result is True:
+                        next_xyz = self.navigator.route[1]
+
                 # If there is a route to the target then move towards it
-                if result is True:
+                if next_xyz is not None:
                     x, y, z = self.player.xyz
-                    newx, newy, newz = self.navigator.route[1]
-                    print("from {0} to {1}".format(self.player.xyz, self.navigator.route[1]))
+                    newx, newy, newz = next_xyz
+                    print("from {0} to {1}".format(self.player.xyz, next_xyz))
                     self.battle.battle_floor.move_player(self.player, newx - x, newy - y)
                     action = True
 
@@ -2647,15 +4397,10 @@ class AIBotBattle:
         print(str(teleports))
 
         for teleport in teleports:
-            result = self.navigator.navigate(start=self.player.xyz, finish=teleport.xyz, direct=False, walkable=True,
-                                             safe=False)
-            print(str(self.navigator.route))
-            if result is True:
-
-                if len(self.navigator.route) == 1:
-                    next_xyz = self.navigator.route[0]
-                else:
-                    next_xyz = self.navigator.route[1]
+            flow_field = self.battle.battle_floor.get_flow_field(teleport.xyz, walkable=True)
+            next_xyz = flow_field.next_step(self.player.xyz)
+            print("Next step to teleport {0} = {1}".format(teleport.xyz, next_xyz))
+            if next_xyz is not None:
 
                 newx, newy, newz = next_xyz
 
@@ -2751,16 +4496,21 @@ class AIBotBattle:
         if target_position == self.player.xyz:
             target_position = self.next_path_target()
 
-        result = self.navigator.navigate(start=self.player.xyz,
-                                         finish=target_position,
-                                         direct=False,
-                                         walkable=True,
-                                         safe=True)
+        flow_field = self.battle.battle_floor.get_flow_field(target_position, walkable=True, safe=True)
+
+        next_xyz = flow_field.next_step(self.player.xyz)
 
-        print("Safe route = {0}: route = {1}".format(result, self.navigator.route))
+        print("Safe step = {0}".format(next_xyz))
 
         # If no safe route go unsafe route!
-        if result is False:
+        if next_xyz is None:
+            flow_field = self.battle.battle_floor.get_flow_field(target_position, walkable=True)
+            next_xyz = flow_field.next_step(self.player.xyz)
+
+            print("Unsafe step = {0}".format(next_xyz))
+
+        # If other players are in the way search for a route around them
+        if next_xyz is None:
             result = self.navigator.navigate(start=self.player.xyz,
                                              finish=target_position,
                                              direct=False,
@@ -2769,11 +4519,14 @@ class AIBotBattle:
 
             print("Direct route = {0}: route = {1}".format(result, self.navigator.route))
 
+            if result is True:
+                next_xyz = self.navigator.route[1]
+
         # If there is a route to the target then move towards it
-        if result is True:
+        if next_xyz is not None:
             x, y, z = self.player.xyz
-            newx, newy, newz = self.navigator.route[1]
-            print("from {0} to {1}".format(self.player.xyz, self.navigator.route[1]))
+            newx, newy, newz = next_xyz
+            print("from {0} to {1}".format(self.player.xyz, next_xyz))
             self.battle.battle_floor.move_player(self.player, newx - x, newy - y)
             action = True
 
@@ -2851,16 +4604,24 @@ class AIBotExplore:
         for player in self.floor.players:
 
             if player.is_dead() is False:
-                result = self.navigator.navigate(start=self.player.xyz,
-                                                 finish=player.xyz,
-                                                 direct=direct,
-                                                 walkable=False,
-                                                 safe=False)
 
                 distance = self.navigator.distance(a=self.player.xyz, b=player.xyz)
+
+                if direct is True:
+                    result = self.floor.has_line_of_sight(self.player.xyz, player.xyz, max_distance=self.view_range)
+                    route_length = sum(abs(a - b) for a, b in zip(self.player.xyz, player.xyz)) + 1
+                else:
+                    result = distance < self.view_range and \
+                             self.navigator.navigate(start=self.player.xyz,
+                                                     finish=player.xyz,
+                                                     direct=direct,
+                                                     walkable=False,
+                                                     safe=False)
+                    route_length = len(self.navigator.route)
+
                 if result is True and distance < self.view_range:
                     opponents.append(
-                        (player, distance, len(self.navigator.route)))
+                        (player, distance, route_length))
                     is_visible = True
                     # else:
                     #     print("Target at distance {0:.2f} beyond range {1}".format(distance, self.view_range))
@@ -2930,15 +4691,12 @@ class AIBotExplore:
 
             # Else navigate towards the target
             else:
-                # Try to go via a safe route
-                result = self.navigator.navigate(start=self.player.xyz,
-                                                 finish=target.xyz,
-                                                 direct=False,
-                                                 walkable=True,
-                                                 safe=True)
-                # print("Safe route = {0}: route = {1}".format(result, self.navigator.route))
+                # Try to go via a safe route using the floor's shared flow field
+                flow_field = self.floor.get_flow_field(target.xyz, walkable=True, safe=True)
+                next_xyz = flow_field.next_step(self.player.xyz)
+                # print("Safe step = {0}".format(next_xyz))
                 # If no safe route go direct!
-                if result is False:
+                if next_xyz is None:
                     result = self.navigator.navigate(start=self.player.xyz,
                                                      finish=target.xyz,
                                                      direct=True,
@@ -2947,11 +4705,14 @@ class AIBotExplore:
 
                     # print("Direct route = {0}: route = {1}".format(result, self.navigator.route))
 
+                    if result is True:
+                        next_xyz = self.navigator.route[1]
+
                 # If there is a route to the target then move towards it
-                if result is True:
+                if next_xyz is not None:
                     x, y, z = self.player.xyz
-                    newx, newy, newz = self.navigator.route[1]
-                    # print("from {0} to {1}".format(self.player.xyz, self.navigator.route[1]))
+                    newx, newy, newz = next_xyz
+                    # print("from {0} to {1}".format(self.player.xyz, next_xyz))
                     self.floor.move_player(self.player, newx - x, newy - y)
                     action = True
 
@@ -2980,15 +4741,10 @@ class AIBotExplore:
             return
 
         for teleport in teleports:
-            result = self.navigator.navigate(start=self.player.xyz, finish=teleport.xyz, direct=False, walkable=True,
-                                             safe=False)
-            print(str(self.navigator.route))
-            if result is True:
-
-                if len(self.navigator.route) == 1:
-                    next_xyz = self.navigator.route[0]
-                else:
-                    next_xyz = self.navigator.route[1]
+            flow_field = self.floor.get_flow_field(teleport.xyz, walkable=True)
+            next_xyz = flow_field.next_step(self.player.xyz)
+            print("Next step to teleport {0} = {1}".format(teleport.xyz, next_xyz))
+            if next_xyz is not None:
 
                 newx, newy, newz = next_xyz
 
@@ -3087,16 +4843,21 @@ class AIBotExplore:
         if target_position == self.player.xyz:
             target_position = self.next_path_target()
 
-        result = self.navigator.navigate(start=self.player.xyz,
-                                         finish=target_position,
-                                         direct=False,
-                                         walkable=True,
-                                         safe=True)
+        flow_field = self.floor.get_flow_field(target_position, walkable=True, safe=True)
 
-        # print("Safe route = {0}: route = {1}".format(result, self.navigator.route))
+        next_xyz = flow_field.next_step(self.player.xyz)
+
+        # print("Safe step = {0}".format(next_xyz))
 
         # If no safe route go unsafe route!
-        if result is False:
+        if next_xyz is None:
+            flow_field = self.floor.get_flow_field(target_position, walkable=True)
+            next_xyz = flow_field.next_step(self.player.xyz)
+
+            # print("Unsafe step = {0}".format(next_xyz))
+
+        # If other players are in the way search for a route around them
+        if next_xyz is None:
             result = self.navigator.navigate(start=self.player.xyz,
                                              finish=target_position,
                                              direct=False,
@@ -3105,11 +4866,14 @@ class AIBotExplore:
 
             # print("Direct route = {0}: route = {1}".format(result, self.navigator.route))
 
+            if result is True:
+                next_xyz = self.navigator.route[1]
+
         # If there is a route to the target then move towards it
-        if result is True:
+        if next_xyz is not None:
             x, y, z = self.player.xyz
-            newx, newy, newz = self.navigator.route[1]
-            # print("Moving from {0} to {1}".format(self.player.xyz, self.navigator.route[1]))
+            newx, newy, newz = next_xyz
+            # print("Moving from {0} to {1}".format(self.player.xyz, next_xyz))
             self.floor.move_player(self.player, newx - x, newy - y)
             action = True
 
@@ -0,0 +1,30 @@
+#Simulate
+import argparse
+import logging
+
+import model
+
+
+def main():
+
+    logging.basicConfig(level=logging.ERROR)
+
+    parser = argparse.ArgumentParser(description="Run bot vs. bot battles without a display")
+    parser.add_argument("--battles", type=int, default=100, help="number of battles to run")
+    parser.add_argument("--floor", type=int, default=None, help="id of the battle floor (default: random)")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the first battle")
+    parser.add_argument("--team-size", type=int, default=5, help="number of players in each team")
+    parser.add_argument("--max-turns", type=int, default=model.BattleSimulator.MAX_TURNS,
+                        help="battles still going after this many turns are a draw")
+    parser.add_argument("--data-dir", default=None, help="directory of the game data files (default: the game's own)")
+    args = parser.parse_args()
+
+    simulator = model.BattleSimulator(floor_id=args.floor, processes=args.processes, team_size=args.team_size,
+                                      max_turns=args.max_turns, data_dir=args.data_dir)
+    simulator.run(args.battles, seed=args.seed)
+    simulator.print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 __author__ = 'user'
 
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from operator import itemgetter
 import pickle
 import logging
+import threading
+import time
 
 
 class HighScoreTable():
@@ -87,7 +90,69 @@ class HighScoreTable():
                 print("%i. %s - %s%s" % (i + 1, name, self.prefix, format(score,",d")))
 
 
+class AssetLoader():
+    '''
+    Loads assets on a pool of background threads.
+    Each asset is a name and a function that loads it, and how long each one took to load is kept in load_times.
+    An optional progress function is called with the number of assets loaded so far, the total and the asset name
+    each time that one finishes. It is called on the loading thread so should only record the progress.
+    '''
 
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.load_times = {}
+        self.errors = {}
+        self._executor = None
+        self._lock = threading.Lock()
 
+    # Start loading the assets and return a future that completes when all of them have been loaded
+    def load(self, assets: dict, progress=None):
 
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="AssetLoader")
 
+        all_loaded = Future()
+        asset_count = len(assets)
+        remaining = [asset_count]
+
+        def asset_loaded(future):
+            with self._lock:
+                remaining[0] -= 1
+                loaded_count = asset_count - remaining[0]
+                is_finished = remaining[0] == 0
+            if progress is not None:
+                try:
+                    progress(loaded_count, asset_count, future.result())
+                except Exception as err:
+                    logging.warning("Unable to report asset loading progress:{0}".format(str(err)))
+            if is_finished is True:
+                all_loaded.set_result(self.load_times)
+
+        if len(assets) == 0:
+            all_loaded.set_result(self.load_times)
+
+        for name, load_function in assets.items():
+            future = self._executor.submit(self.load_asset, name, load_function)
+            future.add_done_callback(asset_loaded)
+
+        return all_loaded
+
+    def load_asset(self, name: str, load_function):
+
+        start_time = time.perf_counter()
+
+        try:
+            load_function()
+        except Exception as err:
+            self.errors[name] = err
+            logging.warning("Unable to load asset {0}:{1}".format(name, str(err)))
+
+        self.load_times[name] = time.perf_counter() - start_time
+        logging.info("Loaded asset {0} in {1:.1f}ms".format(name, self.load_times[name] * 1000))
+
+        return name
+
+    def end(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -16,9 +16,21 @@ class Colours:
     TRANSPARENT = (255, 1, 1)
 
 
+# Fonts are slow to create so keep one for each size that gets used
+_fonts = {}
+
+
+def get_font(size: int):
+    font = _fonts.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        _fonts[size] = font
+    return font
+
+
 def draw_text(surface, msg, x, y, size=32, fg_colour=Colours.WHITE, bg_colour=Colours.BLACK, alpha: int = 255,
               centre: bool = True):
-    font = pygame.font.Font(None, size)
+    font = get_font(size)
     if bg_colour is not None:
         text = font.render(msg, 1, fg_colour, bg_colour)
     else:
@@ -31,9 +43,10 @@ def draw_text(surface, msg, x, y, size=32, fg_colour=Colours.WHITE, bg_colour=Co
         textpos.x = x
 
     textpos.centery = y
-    surface.blit(text, textpos)
     #surface.set_alpha(alpha)
 
+    return surface.blit(text, textpos)
+
 
 # draw some text into an area of a surface
 # automatically wraps words
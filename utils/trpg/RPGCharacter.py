@@ -1,7 +1,7 @@
 __author__ = 'U394198'
 
 import csv
-from copy import deepcopy
+from copy import copy, deepcopy
 from operator import attrgetter
 
 from .RPGObject import *
@@ -44,6 +44,12 @@ class RPGCharacter(RPGObject):
         # Create an empty dictionary to store non-numeric attributes
         self._attributes = {}
 
+        # An optional shared table that stores the values of the character's core stats
+        self.stat_table = None
+
+        # The character's stats compiled into a template for cloning
+        self._stat_template = None
+
     @property
     def inventory_id(self):
         if self.is_player_character:
@@ -139,6 +145,95 @@ class RPGCharacter(RPGObject):
 
         return text
 
+    # Add a stat to the character, storing the value of numeric core stats in the stat table if there is one
+    def add_stat(self, new_stat: BaseStat, global_stat: bool = False):
+
+        if self.stat_table is not None and global_stat is False and type(new_stat) is CoreStat \
+                and new_stat._lifetime == BaseStat.EVERGREEN and type(new_stat.value) in (int, float):
+            new_stat = self.stat_table.new_stat(self, new_stat.name, new_stat.category, new_stat.value,
+                                                stat_owner=new_stat._owner)
+
+        super(RPGCharacter, self).add_stat(new_stat, global_stat)
+
+    # Get the private and public stats that belong to this character as a template for cloning
+    # The template is compiled again if stats have been added to or removed from the stat engines since
+    def get_stat_template(self):
+
+        versions = (self._private_data.version, None if self._public_data is None else self._public_data.version)
+
+        if self._stat_template is None or self._stat_template[0] != versions:
+
+            private_stats = self._private_data.get_all_stats()
+
+            public_stats = []
+            if self._public_data is not None:
+                prefix = self.get_public_stat_name("")
+                public_stats = [stat for stat in self._public_data.get_all_stats() if stat.name.startswith(prefix)]
+
+            self._stat_template = (versions, private_stats, public_stats)
+
+            logging.info("%s.get_stat_template(): Compiled template for %s with %i private and %i public stats.",
+                         __class__, self.name, len(private_stats), len(public_stats))
+
+        return self._stat_template[1], self._stat_template[2]
+
+    # Create a new character with a copy of this character's stats, built from the compiled stat template
+    # The clone gets its own stat engines and optionally stores its core stats in the specified stat table
+    def clone(self, stat_table: StatTable = None, public_data: StatEngine = None):
+
+        private_stats, public_stats = self.get_stat_template()
+
+        new_character = copy(self)
+        new_character._attributes = dict(self._attributes)
+        new_character._private_attributes = set(self._private_attributes)
+        new_character._public_stat_names = dict(self._public_stat_names)
+        new_character._stat_handles = {}
+        new_character._stat_template = None
+        new_character.stat_table = stat_table
+
+        new_character._private_data = StatEngine(self._private_data.name, self._private_data.timestamps)
+        new_character._private_data.add_copied_stats([self.copy_stat(stat, new_character) for stat in private_stats])
+
+        if public_data is None and self._public_data is not None:
+            public_data = StatEngine(self._public_data.name, self._public_data.timestamps)
+        new_character._public_data = public_data
+
+        if public_data is not None:
+            public_data.add_copied_stats([self.copy_stat(stat, new_character) for stat in public_stats])
+
+        return new_character
+
+    # Copy one of this character's stats for a clone without any of its listeners or dependencies
+    def copy_stat(self, stat: BaseStat, new_character):
+
+        owner = new_character if stat._owner is self else stat._owner
+        life_left = stat.life_left
+
+        # Core stats are created afresh so they can go into the clone's stat table
+        if type(stat) in (CoreStat, TableStat):
+            value = stat.value
+            if new_character.stat_table is not None and life_left == BaseStat.EVERGREEN \
+                    and type(value) in (int, float):
+                new_stat = new_character.stat_table.new_stat(new_character, stat.name.split(RPGObject.DELIMITER)[-1],
+                                                             stat.category, value, stat_owner=owner)
+                new_stat.name = stat.name
+            else:
+                new_stat = CoreStat(stat.name, stat.category, value, owner, life_left)
+            return new_stat
+
+        # Other stats such as derived stats are copied keeping their current values
+        new_stat = copy(stat)
+        new_stat._owner = owner
+        new_stat._lifetime = life_left
+        new_stat._listeners = set()
+        new_stat._engine = None
+        if isinstance(stat, DerivedStat):
+            new_stat._baseStatNames = set(stat._baseStatNames)
+            new_stat._baseStats = {}
+            new_stat._baseStatDefaults = dict(stat._baseStatDefaults)
+
+        return new_stat
+
     # Get a named non-numeric attribute
     def get_attribute(self, attribute_name: str):
         if attribute_name in self._attributes.keys():
@@ -359,6 +454,9 @@ class RPGCharacterFactory(object):
         self._characters = {}
         self.public_data = game_state
 
+        # All of the characters' core stats are stored in one table
+        self.stat_table = StatTable(file_name)
+
     @property
     def count(self):
         return len(self._characters)
@@ -382,6 +480,7 @@ class RPGCharacterFactory(object):
                                              row.get("Class"))
 
                 new_character.public_data = self.public_data
+                new_character.stat_table = self.stat_table
                 self._characters[new_character.name] = new_character
 
                 logging.info("%s.load(): Character %s the %s %s created.", __class__, \
@@ -419,6 +518,13 @@ class RPGCharacterFactory(object):
     def get_character_names(self):
         return self._characters.keys()
 
+    # Create a new copy of a named character from its compiled stat template
+    def spawn(self, character_name: str, stat_table: StatTable = None):
+        character = self.get_character_by_name(character_name)
+        if character is None:
+            raise Exception("Can't spawn character {0} as it is not in {1}".format(character_name, self.file_name))
+        return character.clone(stat_table)
+
     def get_characters(self):
         return self._characters.values()
 
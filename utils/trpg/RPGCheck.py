@@ -65,11 +65,10 @@ class RPGCheck(object):
         for stat in self._prerequisites:
 
             # If the stat has no scope defined then default is that the stat belongs to the Character
-            if hasattr(stat,"scope") is False:
-                stat.scope = False
+            scope = getattr(stat, "scope", False)
 
             # Get what the player's equivalent stat is
-            player_stat = character.get_stat(stat.name, global_stat=stat.scope)
+            player_stat = character.get_stat(stat.name, global_stat=scope)
 
             # If the player does not have this stat then use a special default value
             # This is because some pre-reqs might require the absence of a stat
@@ -108,7 +107,11 @@ class RPGCheck(object):
         if stat is None or stat.value != RPGCheck.SUCCEEDED:
             completed = False
         else:
-            logging.info("Check %s completed %s",stat.name, stat.update_time.strftime("%Y-%m-%d %H:%M"))
+            # The completion time is only a wall clock time if it was stamped when the check was attempted
+            completed_time = stat.update_time
+            if isinstance(completed_time, datetime.datetime):
+                completed_time = completed_time.strftime("%Y-%m-%d %H:%M")
+            logging.info("Check %s completed %s",stat.name, completed_time)
 
         return completed
 
@@ -162,8 +165,9 @@ class RPGCheck(object):
             # OK, we have been through the check stats, now see if we succeeded...
             if succeed == True:
 
-                # Set the flag to indicate we succeeded the challenge
+                # Set the flag to indicate we succeeded the challenge and when we did it
                 character.update_stat(self.name, RPGCheck.SUCCEEDED)
+                character.get_stat(self.name).update_time = datetime.datetime.now()
                 logging.info("%s.attempt(): Check %s completed", __class__, self.name)
 
                 #.. and that we are going to get rewarded...
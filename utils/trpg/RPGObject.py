@@ -1,5 +1,7 @@
 __author__ = 'KeithW'
 
+import contextlib
+
 from .StatEngine import *
 
 
@@ -25,6 +27,11 @@ class RPGObject(object):
         self._private_data = StatEngine(self.name + ":" + self.category)
         self._private_attributes = set()
 
+        # Caches of resolved public stat names and of stat handles keyed by (stat name, global stat)
+        # A handle is the stat engine, its version when the stat was looked up and the stat
+        self._public_stat_names = {}
+        self._stat_handles = {}
+
     @property
     def private_data(self):
         return self._private_data
@@ -36,35 +43,51 @@ class RPGObject(object):
     @public_data.setter
     def public_data(self, new_stat_engine: StatEngine):
         self._public_data = new_stat_engine
+        self._stat_handles = {}
 
     def get_public_stat_name(self, stat_name: str):
-        return self.category + RPGObject.DELIMITER + self.name + RPGObject.DELIMITER + stat_name
+        public_stat_name = self._public_stat_names.get(stat_name)
+        if public_stat_name is None:
+            public_stat_name = self.category + RPGObject.DELIMITER + self.name + RPGObject.DELIMITER + stat_name
+            self._public_stat_names[stat_name] = public_stat_name
+        return public_stat_name
 
     def get_stat(self, stat_name: str, global_stat: bool = False):
 
-        logging.info("%s.get_stat():%s global=%r", __class__, stat_name, global_stat)
+        # If we have already looked up this stat and no stats have been added to or removed from the stat engine
+        # since then the stat we found is still the right one
+        handle = self._stat_handles.get((stat_name, global_stat))
+        if handle is not None:
+            stat_engine, version, stat = handle
+            if stat_engine.version == version:
+                return stat
 
-        stat = None
+        logging.debug("%s.get_stat():%s global=%r", __class__, stat_name, global_stat)
 
         if global_stat is True:
             if self._public_data is None:
                 raise Exception("%s.get_stat(): Tried to get a global stat from %s which has no public data." % (
                 __class__, self.name))
-            stat = self._public_data.get_stat(stat_name)
-            logging.info("%s.get_stat():getting global data %s.", __class__, stat_name)
+            stat_engine = self._public_data
+            public_stat_name = stat_name
+            logging.debug("%s.get_stat():getting global data %s.", __class__, stat_name)
         elif stat_name in self._private_attributes or self._public_data is None:
-            stat = self._private_data.get_stat(stat_name)
-            logging.info("%s.get_stat():getting private data %s.", __class__, stat_name)
+            stat_engine = self._private_data
+            public_stat_name = stat_name
+            logging.debug("%s.get_stat():getting private data %s.", __class__, stat_name)
         else:
-            stat_name = self.category + RPGObject.DELIMITER + self.name + RPGObject.DELIMITER + stat_name
-            stat = self._public_data.get_stat(stat_name)
-            logging.info("%s.get_stat():getting public data %s.", __class__, stat_name)
+            stat_engine = self._public_data
+            public_stat_name = self.get_public_stat_name(stat_name)
+            logging.debug("%s.get_stat():getting public data %s.", __class__, public_stat_name)
+
+        stat = stat_engine.get_stat(public_stat_name)
+        self._stat_handles[(stat_name, global_stat)] = (stat_engine, stat_engine.version, stat)
 
         return stat
 
     def add_stat(self, new_stat: BaseStat, global_stat: bool = False):
 
-        logging.info("%s.add_stat():%s global=%r", __class__, new_stat.name, global_stat)
+        logging.debug("%s.add_stat():%s global=%r", __class__, new_stat.name, global_stat)
 
         if global_stat is True:
             if self._public_data is None:
@@ -74,12 +97,20 @@ class RPGObject(object):
         elif new_stat.name in self._private_attributes or self._public_data is None:
             self._private_data.add_stat(new_stat)
         else:
-            new_stat.name = self.category + RPGObject.DELIMITER + self.name + RPGObject.DELIMITER + new_stat.name
+            new_stat.name = self.get_public_stat_name(new_stat.name)
             self._public_data.add_stat(new_stat)
 
-    def update_stat(self, stat_name: str, new_value: float, global_stat: bool = False):
+    # Batch up changes to the private and public stats so derived stats are only recalculated once
+    @contextlib.contextmanager
+    def batch(self):
+        with self._private_data.batch():
+            if self._public_data is None:
+                yield self
+            else:
+                with self._public_data.batch():
+                    yield self
 
-        logging.info("%s.update_stat():%s global=%r", __class__, stat_name, global_stat)
+    def update_stat(self, stat_name: str, new_value: float, global_stat: bool = False):
 
         stat = self.get_stat(stat_name, global_stat)
 
@@ -90,8 +121,6 @@ class RPGObject(object):
 
     def increment_stat(self, stat_name: str, increment: float, global_stat: bool = False):
 
-        logging.info("%s.increment_stat():%s global=%r", __class__, stat_name, global_stat)
-
         stat = self.get_stat(stat_name, global_stat)
         if stat is not None:
             stat.value += increment
@@ -114,6 +143,7 @@ class RPGObject(object):
 
     def add_private_attributes(self, new_attributes: set):
         self._private_attributes |= new_attributes
+        self._stat_handles = {}
 
     def print(self):
         print("%s (%s)" % (self.name, self.category))
@@ -5,6 +5,23 @@ import random
 from .StatEngine import *
 
 
+class RPGCheckStat(BaseStat):
+    '''
+    A stat used by an RPGCheck as a pre-requisite, check or reward along with the details of how to use it
+    '''
+
+    __slots__ = ("description", "randomiser", "comparator", "operator", "scope", "failure_msg")
+
+    def __init__(self, name: str, category: str, value: float):
+        super(RPGCheckStat, self).__init__(name, category, value)
+        self.description = None
+        self.randomiser = 0
+        self.comparator = "gte"
+        self.operator = None
+        self.scope = False
+        self.failure_msg = None
+
+
 # From a specified node get the data value
 def xml_get_node_text(node, tag_name : str):
 
@@ -62,8 +79,8 @@ def xml_get_stat_list(node):
 
         check_failure_msg = xml_get_node_text(stat, "failure_msg")
 
-        # Create a BaseStat object and add it to the list
-        new_stat = BaseStat(stat_name,stat_category, stat_value)
+        # Create a check stat object and add it to the list
+        new_stat = RPGCheckStat(stat_name,stat_category, stat_value)
         new_stat.description = stat_description
         new_stat.randomiser = int(stat_randomiser)
         new_stat.comparator = stat_comparator
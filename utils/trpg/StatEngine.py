@@ -3,11 +3,17 @@
     - BaseStat - basic stat details
     - CoreStat - a core stat that auto updates listeners when its value changes
     - DerivedStat - a stat derived from other stats
-    - StatEngine - the container for all of the stats and manages stat listeners
+    - TableStat - a core stat whose value is stored in a StatTable
+    - StatEngine - the container for all of the stats and manages stat listeners and the order of updates
+    - StatTable - struct of arrays storage for the core stats of many objects with derived stat formulas
 '''
 
+import array
+import contextlib
 import datetime
+import heapq
 import logging
+import math
 
 '''
 The basic details of a stat
@@ -19,6 +25,8 @@ class BaseStat(object):
     EVERGREEN = -1
     DEAD = 0
 
+    __slots__ = ("name", "category", "_value", "_old_value", "_owner", "_lifetime", "create_time", "update_time")
+
     # Initiation of BaseStat, and parameters
     def __init__(self, name: str, category: str, value: float, owner=0, lifetime: int = EVERGREEN):
         self.name = name
@@ -27,12 +35,14 @@ class BaseStat(object):
         self._old_value = value
         self._owner = owner
         self._lifetime = lifetime
-        self.create_time = datetime.datetime.now()
-        self.update_time = datetime.datetime.now()
+
+        # Timestamps are set by the stat engine that the stat is added to depending on its timestamp policy
+        self.create_time = None
+        self.update_time = None
 
     # convert to string
     def __str__(self):
-        return self.name + "(" + self.category + ")" + "=" + str(self._value)
+        return self.name + "(" + self.category + ")" + "=" + str(self.value)
 
     # A property style getter
     @property
@@ -44,7 +54,6 @@ class BaseStat(object):
     def value(self, new_value: float):
         self._old_value = self._value
         self._value = (new_value)
-        self.update_time = datetime.datetime.now()
 
 
 class CoreStat(BaseStat):
@@ -52,6 +61,8 @@ class CoreStat(BaseStat):
     A core stat is one that is not derived from other stats but other stats can listen to it for updates
     """
 
+    __slots__ = ("_listeners", "_baseStatNames", "_engine")
+
     # Constructor
     def __init__(self, name: str, category: str, value: float, owner=0, lifetime=BaseStat.EVERGREEN):
 
@@ -64,6 +75,9 @@ class CoreStat(BaseStat):
         # There are no stats that a core stat is dependent on
         self._baseStatNames = None
 
+        # The stat engine that schedules updates to the listeners, if any
+        self._engine = None
+
     # Convert to a string
     def __str__(self):
         text = super(CoreStat, self).__str__()
@@ -75,7 +89,7 @@ class CoreStat(BaseStat):
             text += ", owner(" + str(self._owner) + ")"
 
         if self._lifetime != BaseStat.EVERGREEN:
-            text += ", lifetime(" + str(self._lifetime) + ")"
+            text += ", lifetime(" + str(self.life_left) + ")"
 
         return text
 
@@ -98,9 +112,15 @@ class CoreStat(BaseStat):
     # Change the value of this stat and let all listeners know the new state
     def set_value(self, new_value: float):
         self._value = new_value
+        self.notify_listeners()
 
-        for listener in self._listeners:
-            listener.update(self)
+    # Let all listeners know the new state, via the stat engine if there is one so that it can order the updates
+    def notify_listeners(self):
+        if self._engine is not None:
+            self._engine.stat_changed(self)
+        else:
+            for listener in self._listeners:
+                listener.update(self)
 
     # A property style getter
     @property
@@ -116,6 +136,13 @@ class CoreStat(BaseStat):
     def increment_value(self, increment):
         self.set_value(self.value + increment)
 
+    # How many ticks this stat has left to live - a stat engine keeps track of this for the stats that it contains
+    @property
+    def life_left(self):
+        if self._engine is not None:
+            return self._engine.get_life_left(self)
+        return self._lifetime
+
     # Do a tick on the stat to update its lifetime
     @property
     def tick(self):
@@ -142,12 +169,19 @@ This class is an abstract class so you need to inherit from it and:-
 
 
 class DerivedStat(CoreStat):
+
+    __slots__ = ("lazy", "_dirty", "_baseStats", "_baseStatDefaults")
+
     # Constructor
-    def __init__(self, name: str, category: str):
+    # A lazy derived stat only gets marked as dirty when a dependency changes and is recalculated when it is next read
+    def __init__(self, name: str, category: str, lazy: bool = False):
 
         # Initialise the parent class
         super(DerivedStat, self).__init__(name, category, None)
 
+        self.lazy = lazy
+        self._dirty = False
+
         # This set stores the names of the stats that the derived class ins interested in
         self._baseStatNames = set()
 
@@ -185,38 +219,72 @@ class DerivedStat(CoreStat):
     # The input parameter is the actual stat object that has changed which is optional
     def update(self, changed_stat=None):
 
-        # If we got an update because of a change to a specific stat then log this
+        # If we got an update because of a change to a specific stat then store the new stat in the local dictionary
+        # This is the hot path for stat changes so there is no logging
         if changed_stat is not None:
-
-            logging.debug("%s.update(): %s got an update to %s.", __class__, self.name, changed_stat.name)
-
-            # Store the new stat in the local dictionary
             self._baseStats[changed_stat.name] = changed_stat
 
         # Else log a generic update request
         else:
             logging.debug("%s.update(): %s got a general update request.", __class__, self.name)
 
+        # If this is a lazy stat then just flag that it needs recalculating when it is next read
+        if self.lazy is True:
+            self.mark_dirty()
+            return
+
+        # If the stat engine is in the middle of a batch then leave the recalculation until the batch ends
+        if self._engine is not None and self._engine.defer_update(self) is True:
+            return
+
+        # Recalculate the value and if it has changed make sure all derived stats are updated
+        if self.recalculate() is True:
+            self.notify_listeners()
+
+    # Flag that the value needs recalculating and let the listeners know the value is changing
+    # If we are already dirty then the listeners already know
+    def mark_dirty(self):
+        if self._dirty is False:
+            self._dirty = True
+            self.notify_listeners()
+
+    # Recalculate the value of the derived stat and return whether it changed
+    def recalculate(self):
+
+        self._dirty = False
+
         # If we have all of the dependent stats in the local dictionary then go ahead and recalculate the value
         # of the derived stat
-        if len(self.get_missing_dependencies()) == 0:
+        if len(self.get_missing_dependencies()) > 0:
+            logging.info("%s.recalculate(): Not got all of the dependencies yet for stat %s - missing %s.", \
+                         __class__, self.name, str(self.get_missing_dependencies()))
+            return False
 
-            try:
+        try:
 
-                logging.debug("%s.update(): Calculating %s from %s", __class__, self.name, str(self._baseStatNames))
+            new_value = self.calculate()
 
-                # calculate the new value and call the parent set_value to make sure all derived stats are updated
-                super(DerivedStat, self).set_value(self.calculate())
+        except Exception as err:
 
-                logging.debug("%s.update(): New calculated value=%s", __class__, str(self._value))
+            logging.warning("%s.recalculate(): Calculating %s exception (%s).", __class__, self.name, str(err))
+            return False
 
-            except Exception as err:
+        changed = new_value != self._value
+        self._value = new_value
 
-                logging.warning("%s.update(): Calculating %s exception (%s).", __class__, self.name, str(err))
+        return changed
 
-        else:
-            logging.info("%s.update(): Not got all of the dependencies yet for stat %s - missing %s.", \
-                         __class__, self.name, str(self.get_missing_dependencies()))
+    # A property style getter that recalculates a lazy stat if it is dirty
+    @property
+    def value(self):
+        if self._dirty is True:
+            self.recalculate()
+        return self._value
+
+    # a property style setter
+    @value.setter
+    def value(self, new_value: float):
+        self.set_value(new_value)
 
     # This method is called when a dependent stat is being destroyed
     def remove(self, removed_stat):
@@ -257,12 +325,9 @@ class DerivedStat(CoreStat):
         stat_value = None
 
         # Firstly see if we have the requested stat in our local dictionary
-        if dependency_stat_name in self._baseStats.keys():
+        if dependency_stat_name in self._baseStats:
             stat_value = self._baseStats[dependency_stat_name].value
 
-            logging.debug("%s.get_dependency_value(): Found local value %s=%s.", \
-                          __class__, dependency_stat_name, str(stat_value))
-
         # We have a non-None value
         if stat_value is not None:
             pass
@@ -295,26 +360,122 @@ class DerivedStat(CoreStat):
         logging.error("%s.set_value(): Can't call set_value on derived stat %s.", __class__, self.name)
 
 
+class TableStat(CoreStat):
+    """
+    A core stat that is a view of one row of a StatTable column rather than storing its own value
+    """
+
+    __slots__ = ("_table", "_row", "_column_name")
+
+    def __init__(self, name: str, category: str, table, row: int, column_name: str, owner=0):
+
+        # Initialise the parent class
+        super(TableStat, self).__init__(name, category, None, owner)
+
+        self._table = table
+        self._row = row
+        self._column_name = column_name
+
+    # A property style getter that reads the value from the table
+    @property
+    def value(self):
+        return self._table.get_value(self._column_name, self._row)
+
+    # a property style setter
+    @value.setter
+    def value(self, new_value: float):
+        self.set_value(new_value)
+
+    # Change the value in the table and let all listeners know the new state
+    def set_value(self, new_value: float):
+        self._table.set_value(self._column_name, self._row, new_value)
+        self.notify_listeners()
+
+
 '''
 The main container for stats.
 '''
 
 
 class StatEngine:
+    # Timestamp policies for the stats in the container
+    # Wall clock timestamps cost a system call on every stat update so callers have to ask for them
+    TIMESTAMPS_OFF = "off"
+    TIMESTAMPS_TICK = "tick"
+    TIMESTAMPS_WALL_CLOCK = "wall clock"
+
     # Initialises to create a name and empty dictionary
-    def __init__(self, name):
+    def __init__(self, name, timestamps: str = TIMESTAMPS_TICK):
         self.name = name
 
+        if timestamps not in (StatEngine.TIMESTAMPS_OFF, StatEngine.TIMESTAMPS_TICK, StatEngine.TIMESTAMPS_WALL_CLOCK):
+            raise Exception("Stat engine {0} has unknown timestamp policy {1}".format(name, timestamps))
+
+        self.timestamps = timestamps
+        self.tick_count = 0
+
+        # A heap of the time limited stats keyed by the tick that they expire on
+        self._expiry_heap = []
+        self._expiry_ticks = {}
+
         # Create an empty dictionary that will store all of the stats
+        # and a version number that changes whenever stats are added or removed
         self._stats = {}
+        self.version = 0
+
+        # Indexes of the stats by category and owner, and of the stats that depend on each stat name
+        self._stats_by_category = {}
+        self._stats_by_owner = {}
+        self._dependants_by_name = {}
+
+        # The topological order of the stats keyed by stat, compiled on demand
+        self._update_order = None
+        self._next_rank = 0
+
+        # Derived stats waiting to be recalculated and a heap of them in update order
+        self._pending = set()
+        self._pending_heap = []
+        self._batch_depth = 0
+        self._updating = False
 
     # Add a new stat to the container and sync up all listeners
     def add_stat(self, new_stat):
 
         logging.debug("%s.add_stat(): Adding new stat %s.", __class__, new_stat.name)
 
+        # Don't allow a stat to depend on itself, directly or via other stats
+        cycle = self.find_dependency_cycle(new_stat)
+        if cycle is not None:
+            raise Exception("Stat {0} has a dependency cycle: {1}".format(new_stat.name, " -> ".join(cycle)))
+
         # Adds a new stat to the dictionary using the stat name as the key
+        old_stat = self._stats.get(new_stat.name)
+        if old_stat is not None:
+            self.remove_from_indexes(old_stat)
         self._stats[new_stat.name] = new_stat
+        self.version += 1
+        self.add_to_indexes(new_stat)
+        new_stat._engine = self
+
+        # If the new stat is time limited then work out when it expires
+        if old_stat is not None:
+            self._expiry_ticks.pop(old_stat, None)
+        if new_stat._lifetime >= 0:
+            expiry_tick = self.tick_count + new_stat._lifetime
+            self._expiry_ticks[new_stat] = expiry_tick
+            heapq.heappush(self._expiry_heap, (expiry_tick, id(new_stat), new_stat))
+        if self.timestamps != StatEngine.TIMESTAMPS_OFF:
+            new_stat.create_time = new_stat.update_time = self.get_timestamp()
+
+        # If no existing stat depends on the new stat then it can go at the end of the update order
+        # else the update order needs to be compiled again
+        if self._update_order is not None:
+            self._update_order.pop(old_stat, None)
+            if self.has_dependants(new_stat.name) is True:
+                self._update_order = None
+            else:
+                self._update_order[new_stat] = self._next_rank
+                self._next_rank += 1
 
         # If there are some dependencies for the new stat....
         if new_stat._baseStatNames is not None:
@@ -333,12 +494,216 @@ class StatEngine:
                     logging.warning("%s.add_stat(): Couldn't find dependency %s for stat %s.", \
                                     __class__, base_stat_name, new_stat.name)
 
-        # Look through all stats in the container and see if any are dependent on the new stat
-        # If they are then add the existing stat as a listener to the new stat
+        # Look up the stats in the container that are dependent on the new stat
+        # and add each existing stat as a listener to the new stat
+        for stat in list(self._dependants_by_name.get(new_stat.name, ())):
+            logging.debug("%s.add_stat(): Adding listener %s to %s.", __class__, stat.name, new_stat.name)
+            new_stat.add_listener(stat)
+
+    # Add stats copied from another stat engine in one pass keeping their current values so that nothing needs
+    # recalculating. The copies must not have any listeners or dependencies set up yet.
+    def add_copied_stats(self, new_stats: list):
+
+        for new_stat in new_stats:
+            if new_stat.name in self._stats:
+                raise Exception("Stat {0} is already in stat engine {1}".format(new_stat.name, self.name))
+
+        logging.debug("%s.add_copied_stats(): Adding %i copied stats to %s.", __class__, len(new_stats), self.name)
+
+        timestamp = self.get_timestamp()
+        for new_stat in new_stats:
+            self._stats[new_stat.name] = new_stat
+            self.add_to_indexes(new_stat)
+            new_stat._engine = self
+            if new_stat._lifetime >= 0:
+                expiry_tick = self.tick_count + new_stat._lifetime
+                self._expiry_ticks[new_stat] = expiry_tick
+                heapq.heappush(self._expiry_heap, (expiry_tick, id(new_stat), new_stat))
+            if self.timestamps != StatEngine.TIMESTAMPS_OFF:
+                new_stat.create_time = new_stat.update_time = timestamp
+
+        self.version += 1
+        self._update_order = None
+
+        # Wire each new derived stat straight to its dependencies
+        copied_stats = set(new_stats)
+        for new_stat in new_stats:
+            if new_stat._baseStatNames is not None:
+                for base_stat_name in new_stat._baseStatNames:
+                    base_stat = self._stats.get(base_stat_name)
+                    if base_stat is not None:
+                        base_stat._listeners.add(new_stat)
+                        new_stat._baseStats[base_stat_name] = base_stat
+
+        # Make sure the dependency graph is still acyclic
+        self.compile_update_order()
+
+        # Any stats that were already in the container and depend on the new stats need updating the usual way
+        for new_stat in new_stats:
+            for stat in list(self._dependants_by_name.get(new_stat.name, ())):
+                if stat not in copied_stats:
+                    new_stat.add_listener(stat)
+
+    # Add a stat to the category, owner and dependant indexes
+    def add_to_indexes(self, stat):
+        self._stats_by_category.setdefault(stat.category, set()).add(stat)
+        self._stats_by_owner.setdefault(stat._owner, set()).add(stat)
+        if stat._baseStatNames is not None:
+            for base_stat_name in stat._baseStatNames:
+                self._dependants_by_name.setdefault(base_stat_name, set()).add(stat)
+
+    # Remove a stat from the category, owner and dependant indexes dropping any empty entries
+    def remove_from_indexes(self, stat):
+        StatEngine.remove_from_index(self._stats_by_category, stat.category, stat)
+        StatEngine.remove_from_index(self._stats_by_owner, stat._owner, stat)
+        if stat._baseStatNames is not None:
+            for base_stat_name in stat._baseStatNames:
+                StatEngine.remove_from_index(self._dependants_by_name, base_stat_name, stat)
+
+    @staticmethod
+    def remove_from_index(index: dict, key, stat):
+        stats = index.get(key)
+        if stats is not None:
+            stats.discard(stat)
+            if len(stats) == 0:
+                del index[key]
+
+    # Return the names of the stats in a dependency cycle that adding the new stat would create, or None
+    def find_dependency_cycle(self, new_stat):
+
+        if new_stat._baseStatNames is None:
+            return None
+
+        # Depth first search through the dependencies of the new stat looking for a way back to it
+        visited = set()
+        stack = [(base_stat_name, [new_stat.name, base_stat_name]) for base_stat_name in new_stat._baseStatNames]
+        while len(stack) > 0:
+            stat_name, path = stack.pop()
+            if stat_name == new_stat.name:
+                return path
+            if stat_name in visited:
+                continue
+            visited.add(stat_name)
+
+            stat = self._stats.get(stat_name)
+            if stat is not None and stat._baseStatNames is not None:
+                for base_stat_name in stat._baseStatNames:
+                    stack.append((base_stat_name, path + [base_stat_name]))
+
+        return None
+
+    # Is there a stat in the container that depends on the named stat?
+    def has_dependants(self, stat_name: str):
+        return stat_name in self._dependants_by_name
+
+    # Compile the dependency graph into a topological order so that each stat comes after all of its dependencies
+    def compile_update_order(self):
+
+        dependants = {}
+        dependency_counts = {}
         for stat in self._stats.values():
-            if stat._baseStatNames is not None and new_stat.name in stat._baseStatNames:
-                logging.debug("%s.add_stat(): Adding listener %s to %s.", __class__, stat.name, new_stat.name)
-                new_stat.add_listener(stat)
+            count = 0
+            if stat._baseStatNames is not None:
+                for base_stat_name in stat._baseStatNames:
+                    if base_stat_name in self._stats:
+                        dependants.setdefault(base_stat_name, []).append(stat)
+                        count += 1
+            dependency_counts[stat] = count
+
+        ready = [stat for stat, count in dependency_counts.items() if count == 0]
+        update_order = {}
+        while len(ready) > 0:
+            stat = ready.pop()
+            update_order[stat] = len(update_order)
+            for dependant in dependants.get(stat.name, ()):
+                dependency_counts[dependant] -= 1
+                if dependency_counts[dependant] == 0:
+                    ready.append(dependant)
+
+        if len(update_order) < len(self._stats):
+            raise Exception("Stat engine {0} has a dependency cycle".format(self.name))
+
+        self._update_order = update_order
+        self._next_rank = len(update_order)
+
+        # Re-sort any stats that are waiting to be recalculated
+        self._pending_heap = [(self._update_order.get(stat, -1), id(stat), stat) for stat in self._pending]
+        heapq.heapify(self._pending_heap)
+
+        logging.debug("%s.compile_update_order(): Compiled order of %i stats in %s.", __class__, len(update_order),
+                      self.name)
+
+    # Get the names of the stats in the order that they are updated
+    def get_update_order(self):
+        if self._update_order is None:
+            self.compile_update_order()
+        return [stat.name for stat in sorted(self._update_order, key=self._update_order.get)]
+
+    # Batch up stat changes so that each derived stat is recalculated at most once when the batch ends
+    # Derived stat values are not up to date until the outermost batch has finished
+    @contextlib.contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.update_pending_stats()
+
+    # Get the current time stamp for the timestamp policy
+    def get_timestamp(self):
+        if self.timestamps == StatEngine.TIMESTAMPS_TICK:
+            return self.tick_count
+        elif self.timestamps == StatEngine.TIMESTAMPS_WALL_CLOCK:
+            return datetime.datetime.now()
+        return None
+
+    # Called by a stat when its value changes to schedule updates to all of its listeners
+    def stat_changed(self, changed_stat):
+        if self.timestamps == StatEngine.TIMESTAMPS_TICK:
+            changed_stat.update_time = self.tick_count
+        elif self.timestamps == StatEngine.TIMESTAMPS_WALL_CLOCK:
+            changed_stat.update_time = datetime.datetime.now()
+
+        for listener in changed_stat._listeners:
+            self.schedule_update(listener)
+
+        if self._batch_depth == 0:
+            self.update_pending_stats()
+
+    # Called by a derived stat when it gets an update - if we are in a batch then schedule it for later
+    def defer_update(self, stat):
+        if self._batch_depth > 0:
+            self.schedule_update(stat)
+            return True
+        return False
+
+    # Add a stat to the set of stats waiting to be recalculated
+    def schedule_update(self, stat):
+        if stat in self._pending:
+            return
+        self._pending.add(stat)
+        if self._update_order is not None:
+            heapq.heappush(self._pending_heap, (self._update_order.get(stat, -1), id(stat), stat))
+
+    # Recalculate all of the waiting stats in topological order so each is only recalculated once
+    def update_pending_stats(self):
+
+        # If we are already recalculating then any new stats will get picked up by the loop below
+        if self._updating is True:
+            return
+
+        self._updating = True
+        try:
+            while len(self._pending) > 0:
+                if self._update_order is None:
+                    self.compile_update_order()
+                rank, stat_id, stat = heapq.heappop(self._pending_heap)
+                self._pending.discard(stat)
+                stat.update()
+        finally:
+            self._updating = False
 
     # Load in stats from a provided list
     # Default is to overwrite what is there already with option to increment
@@ -347,13 +712,14 @@ class StatEngine:
         if stat_list is None:
             return
 
-        for stat in stat_list:
-            # If we are overwriting or the stat does not exist then add the stat
-            if overwrite is True or self.get_stat(stat.name) is None:
-                self.add_stat(stat)
-            # Else increment the existing stat
-            else:
-                self.increment_stat(stat.name, stat.value)
+        with self.batch():
+            for stat in stat_list:
+                # If we are overwriting or the stat does not exist then add the stat
+                if overwrite is True or self.get_stat(stat.name) is None:
+                    self.add_stat(stat)
+                # Else increment the existing stat
+                else:
+                    self.increment_stat(stat.name, stat.value)
 
     # Get a named stat from the container
     def get_stat(self, stat_name: str):
@@ -385,21 +751,14 @@ class StatEngine:
 
     # Get all of the stats for a specified category
     def get_stats_by_category(self, category_name: str):
-        stats = set()
-        for stat in self._stats.values():
-            if stat.category == category_name:
-                stats.add(stat)
-        return stats
+        return set(self._stats_by_category.get(category_name, ()))
 
     def get_all_stats(self):
         return list(self._stats.values())
 
     # Get a list of all of the stat categories currently in the container
     def get_category_names(self):
-        categories = set()
-        for stat in self._stats.values():
-            categories.add(stat.category)
-        return categories
+        return set(self._stats_by_category.keys())
 
     # Get a list of all of the stat names currently in the container
     def get_stat_names(self):
@@ -408,65 +767,87 @@ class StatEngine:
     # Create a new dictionary
     def remove_all(self):
         self._stats = {}
+        self.version += 1
+        self._stats_by_category = {}
+        self._stats_by_owner = {}
+        self._dependants_by_name = {}
+        self._expiry_heap = []
+        self._expiry_ticks = {}
+        self._update_order = None
+        self._pending = set()
+        self._pending_heap = []
 
     # Remove all stats that are owned by a specified owner
     def remove_stats_by_owner(self, owner: int):
 
-        logging.debug("%s.remove_stats_by_owner(): Going to remove stats owned by %s.", __class__, str(owner))
+        logging.debug("%s.remove_stats_by_owner(): Going to remove stats owned by %s.", __class__, owner)
 
-        stat_names_to_delete = set()
-        for stat in self._stats.values():
-            if stat._owner == owner:
-                stat_names_to_delete.add(stat.name)
+        stat_names_to_delete = set(stat.name for stat in self._stats_by_owner.get(owner, ()))
 
-        logging.debug("%s.remove_stats_by_owner(): About to remove %s.", __class__, str(stat_names_to_delete))
+        logging.debug("%s.remove_stats_by_owner(): About to remove %s.", __class__, stat_names_to_delete)
 
-        for stat_name in stat_names_to_delete:
-            stat = self._stats[stat_name]
-            stat.remove_all_listeners()
-            del self._stats[stat_name]
+        with self.batch():
+            for stat_name in stat_names_to_delete:
+                self.remove_stat(stat_name)
+
+    # Remove a named stat from the container and tell its listeners
+    def remove_stat(self, stat_name: str):
+        stat = self._stats[stat_name]
+        stat.remove_all_listeners()
+        del self._stats[stat_name]
+        self.version += 1
+        self.remove_from_indexes(stat)
+        self._expiry_ticks.pop(stat, None)
+
+        # Removing a stat leaves the rest of the update order valid
+        if self._update_order is not None:
+            self._update_order.pop(stat, None)
 
     # Get a list of stats owned by a specified ID
     def get_stats_by_owner(self, owner):
 
-        logging.debug("%s.get_stats_by_owner(): Going to get stats owned by %s.", __class__, str(owner))
+        logging.debug("%s.get_stats_by_owner(): Going to get stats owned by %s.", __class__, owner)
 
-        stats = set()
-        for stat in self._stats.values():
-            if stat._owner == owner:
-                stats.add(stat)
+        stats = set(self._stats_by_owner.get(owner, ()))
 
-        logging.debug("%s.get_stats_by_owner(): %i stats found for owned by %s.", __class__, len(stats), str(owner))
+        logging.debug("%s.get_stats_by_owner(): %i stats found for owned by %s.", __class__, len(stats), owner)
 
         return stats
 
+    # Get how many ticks a stat in the container has left to live
+    def get_life_left(self, stat):
+        expiry_tick = self._expiry_ticks.get(stat)
+        if expiry_tick is None:
+            return stat._lifetime
+        return max(expiry_tick - self.tick_count, BaseStat.DEAD)
+
     #
-    # Do a tick on all stats in the container and remove any dead ones
+    # Do a tick on the container and remove any stats that have come to the end of their life
     #
     def tick(self):
 
         logging.debug("%s.tick(): Doing a tick on all stats in %s.", __class__, self.name)
 
+        self.tick_count += 1
+
         # Set to collect the names of dead stats
         dead_stat_names = set()
 
-        # Loop through all stats doing a tick and recording dead ones
-        for stat in self._stats.values():
-
-            life_left = stat.tick
-
-            # If a stat is dead then remove it
-            if life_left == BaseStat.DEAD:
+        # Pop the stats that expire on or before this tick off the heap
+        # ignoring any that have since been removed or replaced
+        while len(self._expiry_heap) > 0 and self._expiry_heap[0][0] <= self.tick_count:
+            expiry_tick, stat_id, stat = heapq.heappop(self._expiry_heap)
+            if self._expiry_ticks.get(stat) == expiry_tick:
+                stat._lifetime = BaseStat.DEAD
                 dead_stat_names.add(stat.name)
 
         if len(dead_stat_names) > 0:
-            logging.debug("%s.tick(): Removing dead stats %s", __class__, str(dead_stat_names))
+            logging.debug("%s.tick(): Removing dead stats %s", __class__, dead_stat_names)
 
         # Go through the collection of dead stats and remove them from the container
-        for stat_name in dead_stat_names:
-            stat = self._stats[stat_name]
-            stat.remove_all_listeners()
-            del self._stats[stat.name]
+        with self.batch():
+            for stat_name in dead_stat_names:
+                self.remove_stat(stat_name)
 
     #
     # Print out the contents of the container
@@ -502,3 +883,237 @@ class StatEngine:
                 stat = stats[stat_name]
                 # print("\t"+ stat.name + "=" + str(stat.value))
                 print("\t" + str(stat))
+
+
+class StatTable:
+    """
+    Struct of arrays storage for the core stats of many objects.
+    There is one column of values per stat name and one row per object, so a stat can be changed for many objects
+    with a single call. Derived stats are formulas applied to whole columns and are only recalculated when read.
+    Missing values are stored as NaN and read back as None, and each column keeps a flag per row that records
+    whether the value was an int so that it is read back as one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+        # The row number of each object and the objects in row order
+        self._rows = {}
+        self._owners = []
+
+        # The core stat columns and the TableStat views of them keyed by column name then row
+        self._columns = {}
+        self._int_flags = {}
+        self._views = {}
+
+        # The derived stat formulas and dependencies, their calculated columns and which ones need recalculating
+        self._formulas = {}
+        self._dependants = {}
+        self._derived_columns = {}
+        self._dirty_columns = set()
+
+    def __str__(self):
+        return "{0}: rows({1}), columns({2}), derived({3})".format(self.name, len(self._owners), len(self._columns),
+                                                                   len(self._formulas))
+
+    # Add a row for a new object and return the row number
+    def add_row(self, owner):
+
+        if owner in self._rows:
+            return self._rows[owner]
+
+        row = len(self._owners)
+        self._rows[owner] = row
+        self._owners.append(owner)
+
+        for stat_name, column in self._columns.items():
+            column.append(math.nan)
+            self._int_flags[stat_name].append(0)
+
+        self._dirty_columns.update(self._formulas)
+
+        return row
+
+    # Remove the row of an object by moving the last row into its place so that the columns stay packed.
+    # The stats of the removed object no longer have a row to read from so can't be used afterwards.
+    def remove_row(self, owner):
+
+        row = self._rows.pop(owner, None)
+        if row is None:
+            return
+
+        last_row = len(self._owners) - 1
+        last_owner = self._owners.pop()
+        if row != last_row:
+            self._owners[row] = last_owner
+            self._rows[last_owner] = row
+
+        for stat_name, column in self._columns.items():
+            int_flags = self._int_flags[stat_name]
+            views = self._views[stat_name]
+            views.pop(row, None)
+
+            if row != last_row:
+                column[row] = column[last_row]
+                int_flags[row] = int_flags[last_row]
+                moved_stat = views.pop(last_row, None)
+                if moved_stat is not None:
+                    moved_stat._row = row
+                    views[row] = moved_stat
+
+            column.pop()
+            int_flags.pop()
+
+        self._dirty_columns.update(self._formulas)
+
+    # Get the row number for an object or None if it does not have one
+    def get_row(self, owner):
+        return self._rows.get(owner)
+
+    def get_owners(self):
+        return list(self._owners)
+
+    # Create a new stat for an object that stores its value in this table
+    def new_stat(self, owner, stat_name: str, category: str, value: float, stat_owner=0):
+
+        if stat_name in self._formulas:
+            raise Exception("Stat {0} is a derived stat in table {1}".format(stat_name, self.name))
+
+        row = self.add_row(owner)
+
+        if stat_name not in self._columns:
+            self._columns[stat_name] = array.array("d", [math.nan]) * len(self._owners)
+            self._int_flags[stat_name] = array.array("b", [0]) * len(self._owners)
+            self._views[stat_name] = {}
+
+        new_stat = TableStat(stat_name, category, self, row, stat_name, stat_owner)
+        self._views[stat_name][row] = new_stat
+        self.set_value(stat_name, row, value)
+
+        return new_stat
+
+    # Add a derived stat calculated by calling formula with the values of the dependencies for each row
+    def add_derived_stat(self, stat_name: str, formula, dependencies: tuple):
+
+        if stat_name in self._columns:
+            raise Exception("Stat {0} is a core stat in table {1}".format(stat_name, self.name))
+
+        self._formulas[stat_name] = (formula, tuple(dependencies))
+        for dependency in dependencies:
+            self._dependants.setdefault(dependency, set()).add(stat_name)
+
+        self.column_changed(stat_name)
+
+    # Flag all of the derived stats that depend on a changed column as needing recalculating
+    def column_changed(self, stat_name: str):
+        for dependant in self._dependants.get(stat_name, ()):
+            if dependant not in self._dirty_columns:
+                self._dirty_columns.add(dependant)
+                self.column_changed(dependant)
+
+        if stat_name in self._formulas:
+            self._dirty_columns.add(stat_name)
+
+    # Get the whole column of values for a stat, recalculating it first if it is a dirty derived stat
+    def get_column(self, stat_name: str):
+
+        if stat_name in self._columns:
+            return self._columns[stat_name]
+
+        if stat_name not in self._formulas:
+            raise Exception("Stat {0} is not in table {1}".format(stat_name, self.name))
+
+        if stat_name in self._dirty_columns:
+            formula, dependencies = self._formulas[stat_name]
+            columns = [self.get_typed_column(dependency) for dependency in dependencies]
+            self.set_column(stat_name, list(map(formula, *columns)))
+            self._dirty_columns.discard(stat_name)
+
+        return self._derived_columns[stat_name]
+
+    # Get the whole column of values for a stat with the values that were ints turned back into ints
+    def get_typed_column(self, stat_name: str):
+        column = self.get_column(stat_name)
+        return [int(value) if is_int == 1 else value for value, is_int in zip(column, self._int_flags[stat_name])]
+
+    # Replace the whole column of values for a stat
+    def set_column(self, stat_name: str, values: list):
+        column = array.array("d", values)
+        if stat_name in self._columns:
+            self._columns[stat_name] = column
+        else:
+            self._derived_columns[stat_name] = column
+        self._int_flags[stat_name] = array.array("b", [1 if isinstance(value, int) else 0 for value in values])
+
+    def get_column_names(self):
+        return set(self._columns.keys()) | set(self._formulas.keys())
+
+    # Get the value of a stat in a specified row
+    def get_value(self, stat_name: str, row: int):
+        value = self.get_column(stat_name)[row]
+        if math.isnan(value):
+            return None
+        if self._int_flags[stat_name][row] == 1:
+            return int(value)
+        return value
+
+    # Set the value of a core stat in a specified row
+    def set_value(self, stat_name: str, row: int, new_value: float):
+        self._columns[stat_name][row] = math.nan if new_value is None else new_value
+        self._int_flags[stat_name][row] = 1 if isinstance(new_value, int) else 0
+        self.column_changed(stat_name)
+
+    # Get the value of a stat for a specified object
+    def get_stat_value(self, owner, stat_name: str):
+        row = self._rows.get(owner)
+        if row is None:
+            return None
+        return self.get_value(stat_name, row)
+
+    # Set a core stat to a new value for the specified objects, or all objects if none are specified
+    def update_stat(self, stat_name: str, new_value: float, owners=None):
+        self.apply(stat_name, lambda value: new_value, owners)
+
+    # Increment a core stat for the specified objects, or all objects if none are specified
+    def increment_stat(self, stat_name: str, increment: float, owners=None):
+        self.apply(stat_name, lambda value: value + increment, owners)
+
+    # Apply a function to the values of a core stat for the specified objects, or all objects if none are specified
+    # and then let the listeners of the changed stats know in one batch per stat engine
+    def apply(self, stat_name: str, function, owners=None):
+
+        if stat_name not in self._columns:
+            raise Exception("Stat {0} is not a core stat in table {1}".format(stat_name, self.name))
+
+        column = self._columns[stat_name]
+        int_flags = self._int_flags[stat_name]
+
+        if owners is None:
+            rows = range(len(column))
+            self.set_column(stat_name, list(map(function, self.get_typed_column(stat_name))))
+        else:
+            rows = [self._rows[owner] for owner in owners if owner in self._rows]
+            for row in rows:
+                value = column[row]
+                new_value = function(int(value) if int_flags[row] == 1 else value)
+                column[row] = new_value
+                int_flags[row] = 1 if isinstance(new_value, int) else 0
+
+        self.column_changed(stat_name)
+
+        views = self._views[stat_name]
+        changed_stats = [views[row] for row in rows if row in views]
+        engines = set(stat._engine for stat in changed_stats if stat._engine is not None)
+
+        with contextlib.ExitStack() as stack:
+            for engine in engines:
+                stack.enter_context(engine.batch())
+            for stat in changed_stats:
+                stat.notify_listeners()
+
+    def print(self):
+        print(str(self))
+        column_names = sorted(self.get_column_names())
+        for row, owner in enumerate(self._owners):
+            values = ["{0}={1}".format(stat_name, self.get_value(stat_name, row)) for stat_name in column_names]
+            print("\t{0}: {1}".format(getattr(owner, "name", owner), ", ".join(values)))
@@ -1,3 +1,5 @@
+import collections
+import functools
 import logging
 import math
 import os
@@ -10,14 +12,23 @@ import utils
 from utils import Colours
 from utils import drawText
 from utils import draw_text
+from utils import get_font
 
 
 class ImageManager:
     DEFAULT_SKIN = "default"
     RESOURCES_DIR = os.path.dirname(__file__) + "\\resources\\"
     TRANSPARENT = (1, 2, 3)
+    MAX_CACHE_BYTES = 32 * 1024 * 1024
+    ALPHA_STEP = 5
 
-    image_cache = {}
+    # Scaled images and their alpha variants in least recently used order
+    image_cache = collections.OrderedDict()
+    image_cache_bytes = 0
+
+    # Each sheet is decoded once and every image taken from it is a subsurface of the decoded sheet
+    sheets = {}
+    atlas = {}
     skins = {}
     sprite_sheets = {}
     initialised = False
@@ -29,36 +40,146 @@ class ImageManager:
         if ImageManager.initialised is False:
             self.load_skins()
             self.load_sprite_sheets()
+            ImageManager.initialised = True
+
+    # All of the image files that the skins use
+    def get_image_file_names(self):
+
+        image_file_names = set()
+
+        for name, tile_map in ImageManager.skins.values():
+            for tile_file_names in tile_map.values():
+                if isinstance(tile_file_names, tuple):
+                    image_file_names.update(tile_file_names)
+                else:
+                    image_file_names.add(tile_file_names)
+
+        image_file_names.discard(None)
 
-    def get_image(self, image_file_name: str, width: int = 32, height: int = 32):
+        return sorted(image_file_names)
 
-        if image_file_name not in ImageManager.image_cache.keys():
+    # A job for each sheet that decodes it and adds all of the images that the skins take from it to the atlas
+    def get_preload_jobs(self):
 
+        image_file_names_by_sheet = collections.OrderedDict()
+
+        for image_file_name in self.get_image_file_names():
             if image_file_name in self.sprite_sheets.keys():
-                file_name, rect = self.sprite_sheets[image_file_name]
-                filename = ImageManager.RESOURCES_DIR + file_name
-                logging.info("Loading image {0} from {1} at {2}...".format(image_file_name, filename, rect))
+                sheet_file_name, rect = self.sprite_sheets[image_file_name]
+            else:
+                sheet_file_name = image_file_name
+            image_file_names_by_sheet.setdefault(sheet_file_name, []).append(image_file_name)
 
-                image_sheet = utils.spritesheet(filename)
-                original_image = image_sheet.image_at(rect)
+        return collections.OrderedDict((sheet_file_name, functools.partial(self.preload_sheet, image_file_names))
+                                       for sheet_file_name, image_file_names in image_file_names_by_sheet.items())
+
+    def preload_sheet(self, image_file_names: list):
+        for image_file_name in image_file_names:
+            self.get_atlas_image(image_file_name)
+
+    def get_sheet(self, sheet_file_name: str):
+
+        if sheet_file_name not in ImageManager.sheets.keys():
+            filename = ImageManager.RESOURCES_DIR + sheet_file_name
+            logging.info("Loading sheet {0}...".format(filename))
+            image_sheet = utils.spritesheet(filename)
+            ImageManager.sheets[sheet_file_name] = (image_sheet, image_sheet.image_at())
+
+        return ImageManager.sheets[sheet_file_name]
+
+    def get_atlas_image(self, image_file_name: str):
+
+        if image_file_name not in ImageManager.atlas.keys():
+
+            if image_file_name in self.sprite_sheets.keys():
+                sheet_file_name, rect = self.sprite_sheets[image_file_name]
+                rect = pygame.Rect(rect)
             else:
-                filename = ImageManager.RESOURCES_DIR + image_file_name
-                logging.info("Loading image {0}...".format(filename))
-                image_sheet = utils.spritesheet(filename)
-                original_image = image_sheet.image_at()
+                sheet_file_name = image_file_name
+                rect = None
+
+            image_sheet, sheet_image = self.get_sheet(sheet_file_name)
+
+            if rect is None:
+                image = sheet_image
+            elif sheet_image.get_rect().contains(rect) == 1:
+                image = sheet_image.subsurface(rect)
+            else:
+                # Rectangles that hang off the edge of the sheet can't be subsurfaces
+                image = image_sheet.image_at(rect)
+
+            ImageManager.atlas[image_file_name] = image
+
+        return ImageManager.atlas[image_file_name]
+
+    # Round an alpha down to the nearest step so that a small number of alpha variants get cached
+    @staticmethod
+    def get_alpha_bucket(alpha):
+        if alpha is None or alpha >= 255:
+            return None
+
+        alpha = max(0, int(alpha))
+
+        return alpha - (alpha % ImageManager.ALPHA_STEP)
+
+    def get_image(self, image_file_name: str, width: int = 32, height: int = 32, alpha=None):
+
+        alpha = ImageManager.get_alpha_bucket(alpha)
+        key = (image_file_name, width, height, alpha)
+
+        image = ImageManager.image_cache.get(key)
+        if image is not None:
+            ImageManager.image_cache.move_to_end(key)
+            return image
+
+        if alpha is None:
+            image = self.load_image(image_file_name, width, height)
+        else:
+            # Alpha variants are copies so the shared opaque image never gets changed
+            image = self.get_image(image_file_name, width, height)
+            if image is not None:
+                image = image.copy()
+                image.set_alpha(alpha)
+
+        if image is not None:
+            self.add_to_cache(key, image)
+
+        return image
+
+    def load_image(self, image_file_name: str, width: int, height: int):
+
+        original_image = self.get_atlas_image(image_file_name)
+
+        image = None
+
+        try:
+
+            image = pygame.transform.scale(original_image, (width, height))
 
-            try:
+            # Match the display's pixel format so that blits don't need converting every frame
+            if pygame.display.get_surface() is not None:
+                if image.get_flags() & pygame.SRCALPHA:
+                    image = image.convert_alpha()
+                else:
+                    image = image.convert()
+
+            logging.info("Image {0} loaded and scaled to {1}x{2} and cached.".format(image_file_name, width, height))
+            print("Image {0} loaded and scaled to {1}x{2} and cached.".format(image_file_name, width, height))
+
+        except Exception as err:
+            print(str(err))
 
-                image = pygame.transform.scale(original_image, (width, height))
+        return image
 
-                ImageManager.image_cache[image_file_name] = image
-                logging.info("Image {0} loaded and scaled to {1}x{2} and cached.".format(filename, width, height))
-                print("Image {0} loaded and scaled to {1}x{2} and cached.".format(filename, width, height))
+    def add_to_cache(self, key, image):
 
-            except Exception as err:
-                print(str(err))
+        ImageManager.image_cache[key] = image
+        ImageManager.image_cache_bytes += image.get_width() * image.get_height() * image.get_bytesize()
 
-        return self.image_cache[image_file_name]
+        # Throw away the least recently used images until the cache is back under budget
+        while ImageManager.image_cache_bytes > ImageManager.MAX_CACHE_BYTES and len(ImageManager.image_cache) > 1:
+            old_key, old_image = ImageManager.image_cache.popitem(last=False)
+            ImageManager.image_cache_bytes -= old_image.get_width() * old_image.get_height() * old_image.get_bytesize()
 
     def load_skins(self):
 
@@ -280,7 +401,7 @@ class ImageManager:
 
         ImageManager.skins[new_skin_name] = new_skin
 
-    def get_skin_image(self, tile_name: str, skin_name: str = DEFAULT_SKIN, tick=0, width: int = 32, height: int = 32):
+    def get_tile_file_names(self, tile_name: str, skin_name: str = DEFAULT_SKIN):
 
         if skin_name not in ImageManager.skins.keys():
             raise Exception("Can't find specified skin {0}".format(skin_name))
@@ -292,7 +413,27 @@ class ImageManager:
             if tile_name not in tile_map.keys():
                 raise Exception("Can't find tile name '{0}' in skin '{1}'!".format(tile_name, skin_name))
 
-        tile_file_names = tile_map[tile_name]
+        return tile_map[tile_name]
+
+    def is_animated(self, tile_name: str, skin_name: str = DEFAULT_SKIN):
+        tile_file_names = self.get_tile_file_names(tile_name, skin_name)
+        return isinstance(tile_file_names, tuple) and len(tile_file_names) > 1
+
+    # Get every frame of a tile's animation that has an image
+    def get_skin_images(self, tile_name: str, skin_name: str = DEFAULT_SKIN, width: int = 32, height: int = 32):
+
+        tile_file_names = self.get_tile_file_names(tile_name, skin_name)
+        frame_count = len(tile_file_names) if isinstance(tile_file_names, tuple) else 1
+
+        images = [self.get_skin_image(tile_name, skin_name=skin_name, tick=tick, width=width, height=height)
+                  for tick in range(0, frame_count)]
+
+        return [image for image in images if image is not None]
+
+    def get_skin_image(self, tile_name: str, skin_name: str = DEFAULT_SKIN, tick=0, width: int = 32, height: int = 32,
+                       alpha=None):
+
+        tile_file_names = self.get_tile_file_names(tile_name, skin_name)
 
         image = None
 
@@ -305,11 +446,11 @@ class ImageManager:
                 tile_file_name = tile_file_names[tick % len(tile_file_names)]
 
             if tile_file_name is not None:
-                image = self.get_image(image_file_name=tile_file_name, width=width, height=height)
+                image = self.get_image(image_file_name=tile_file_name, width=width, height=height, alpha=alpha)
 
         else:
 
-            image = self.get_image(tile_file_names, width=width, height=height)
+            image = self.get_image(tile_file_names, width=width, height=height, alpha=alpha)
 
         return image
 
@@ -454,6 +595,14 @@ class View():
     def process_event(self, new_event: model.Event):
         print("Default View Class event process:{0}".format(new_event))
 
+    # Force the whole view to be redrawn the next time that it is drawn
+    def invalidate(self):
+        pass
+
+    # The areas of the view's surface that changed the last time that it was drawn
+    def get_dirty_rects(self):
+        return [self.surface.get_rect()]
+
     def draw(self):
         pass
 
@@ -480,6 +629,12 @@ class MainFrame(View):
         self.game_ready = GameReadyView(width, play_area_height)
         self.game_over = GameOverView(width, play_area_height)
 
+        self._is_dirty = True
+        self._is_pane_dirty = True
+        self._is_full_update = True
+        self._last_state = None
+        self._dirty_rects = []
+
     def initialise(self):
 
         super(MainFrame, self).initialise()
@@ -507,14 +662,44 @@ class MainFrame(View):
 
         self.game_over.initialise(self.game)
 
+    # Something has changed in the model so the next frame needs to be drawn
+    def mark_dirty(self):
+        self._is_dirty = True
+        self._is_pane_dirty = True
+
+    def invalidate(self):
+        self.mark_dirty()
+        self._is_full_update = True
+
     def draw(self):
 
-        self.surface.fill(Colours.DARK_GREY)
+        # If the game has moved to a different state then redraw everything
+        if self.game.state != self._last_state:
+            self._last_state = self.game.state
+            self.invalidate()
+
+        # If nothing has happened since the last frame then there is nothing to draw
+        if self._is_dirty is False:
+            return
 
         pane_rect = self.surface.get_rect()
 
-        #self.title_bar.draw()
-        self.status_bar.draw()
+        if self.game.state == model.Game.READY:
+            pane_view = self.game_ready
+        elif self.game.state in (model.Game.PLAYING, model.Game.PAUSED):
+            pane_view = self.game_view
+        elif self.game.state == model.Game.BATTLE:
+            pane_view = self.battle_view
+        elif self.game.state == model.Game.GAME_OVER:
+            pane_view = self.game_over
+        else:
+            pane_view = None
+
+        if self._is_full_update is True:
+            self.surface.fill(Colours.DARK_GREY)
+            self.status_bar.invalidate()
+            if pane_view is not None:
+                pane_view.invalidate()
 
         x = 0
         y = 0
@@ -523,23 +708,25 @@ class MainFrame(View):
         #
         # y += MainFrame.TITLE_HEIGHT
 
-        if self.game.state == model.Game.READY:
-            self.game_ready.draw()
-            self.surface.blit(self.game_ready.surface, (x, y))
-        elif self.game.state in (model.Game.PLAYING, model.Game.PAUSED):
-            self.game_view.draw()
-            self.surface.blit(self.game_view.surface, (x, y))
-        elif self.game.state == model.Game.BATTLE:
-            self.battle_view.draw()
-            self.surface.blit(self.battle_view.surface, (x, y))
-        elif self.game.state == model.Game.GAME_OVER:
-            self.game_over.draw()
-            self.surface.blit(self.game_over.surface, (x, y))
+        if pane_view is not None and self._is_pane_dirty is True:
+            self.draw_view(pane_view, x, y)
 
         x = 0
         y = pane_rect.bottom - MainFrame.STATUS_HEIGHT
 
-        self.surface.blit(self.status_bar.surface, (x, y))
+        self.draw_view(self.status_bar, x, y)
+
+        self._is_dirty = False
+        self._is_pane_dirty = False
+
+    # Draw a view and copy the areas of it that changed onto the main surface
+    def draw_view(self, view: View, x: int, y: int):
+
+        view.draw()
+
+        for rect in view.get_dirty_rects():
+            self.surface.blit(view.surface, (x + rect.x, y + rect.y), rect)
+            self._dirty_rects.append(pygame.Rect(rect).move(x, y))
 
     def process_event(self, new_event: model.Event):
 
@@ -556,21 +743,38 @@ class MainFrame(View):
 
         self.status_bar.process_event(new_event)
 
+        self.mark_dirty()
+
     def tick(self):
 
+        # The animation clock only moves on for the view that is being shown
         if self.game.state == model.Game.READY:
             self.game_ready.tick()
+            self._is_pane_dirty = True
         elif self.game.state == model.Game.PLAYING:
             self.game_view.tick()
+            self._is_pane_dirty = True
         elif self.game.state == model.Game.BATTLE:
             self.battle_view.tick()
+            self._is_pane_dirty = True
         elif self.game.state == model.Game.GAME_OVER:
             self.game_over.tick()
+            self._is_pane_dirty = True
 
         self.status_bar.tick()
 
+        self._is_dirty = True
+
     def update(self):
-        pygame.display.update()
+
+        # Only push the areas of the screen that changed to the display
+        if self._is_full_update is True:
+            pygame.display.update()
+        elif len(self._dirty_rects) > 0:
+            pygame.display.update(self._dirty_rects)
+
+        self._is_full_update = False
+        self._dirty_rects = []
 
     def end(self):
         pygame.quit()
@@ -652,6 +856,9 @@ class StatusBar(View):
         self.status_messages = []
         self.game = None
 
+        self._last_key = None
+        self._dirty_rects = []
+
     def initialise(self, game: model.Game):
 
         super(StatusBar, self).initialise()
@@ -681,15 +888,40 @@ class StatusBar(View):
                 else:
                     del self.status_messages[self.current_message_number]
 
-    def draw(self):
+    def invalidate(self):
+        self._last_key = None
 
-        self.surface.fill(StatusBar.BG_COLOUR)
+    def get_dirty_rects(self):
+        return self._dirty_rects
+
+    def draw(self):
 
         if len(self.status_messages) == 0 or self.current_message_number >= len(self.status_messages):
             msg = "{0}".format(self.game.state)
         else:
             msg, count = self.status_messages[self.current_message_number]
 
+        # Only redraw the status bar if something that it shows has changed
+        if self.game.state == model.Game.PLAYING:
+            hp = self.game.player.HP
+            if View.image_manager.is_animated(model.Objects.HEART, "default") is True:
+                icon_tick = self.tick_count
+            else:
+                icon_tick = 0
+        else:
+            hp = None
+            icon_tick = 0
+
+        key = (msg, self.game.state, hp, icon_tick)
+        if key == self._last_key:
+            self._dirty_rects = []
+            return
+
+        self._last_key = key
+        self._dirty_rects = [self.surface.get_rect()]
+
+        self.surface.fill(StatusBar.BG_COLOUR)
+
         pane_rect = self.surface.get_rect()
 
         text_rect = pygame.Rect(0, 0, pane_rect.width / 2 - 4, pane_rect.height - 4)
@@ -815,12 +1047,20 @@ class GameReadyView(View):
         self.game = None
         self.hst = HighScoreTableView(width=width, height=300)
 
+        # How many of the images and sounds have been loaded in the background so far
+        self.assets_loaded = 0
+        self.asset_count = 0
+
         self.surface = pygame.Surface((width, height))
 
     def initialise(self, game: model.Game):
         self.game = game
         self.hst.initialise(self.game.hst)
 
+    def asset_loaded(self, loaded_count: int, asset_count: int, asset_name: str):
+        self.assets_loaded = loaded_count
+        self.asset_count = asset_count
+
     def draw(self):
         if self.game is None:
             raise ("No Game to view!")
@@ -853,6 +1093,15 @@ class GameReadyView(View):
         image = pygame.transform.scale(image, (image_width, image_height))
         self.surface.blit(image, (x, y + y_offset))
 
+        if self.assets_loaded < self.asset_count:
+            draw_text(self.surface,
+                      msg="Loading {0}/{1}".format(self.assets_loaded, self.asset_count),
+                      x=pane_rect.centerx,
+                      y=y + image_height + 40,
+                      size=20,
+                      fg_colour=GameReadyView.FG_COLOUR,
+                      bg_colour=GameReadyView.BG_COLOUR)
+
         x = 0
         y = pane_rect.bottom - self.hst.surface.get_height()
         self.hst.draw()
@@ -943,19 +1192,235 @@ class GameOverView(View):
         self.surface.blit(self.hst.surface, (x, y))
 
 
-class GameView(View):
+class FloorView(View):
+    '''
+    Base class for views that draw a floor. Everything on the floor that does not change from frame to frame is
+    pre-rendered onto a static surface that is rebuilt only when the floor, its map version or its skin change.
+    The view's surface is kept between frames and only the areas under players, animated tiles and overlays from
+    this frame and the last one are redrawn.
+    '''
     BG_COLOUR = Colours.BLACK
-    FG_COLOUR = Colours.WHITE
     TILE_WIDTH = 64
     TILE_HEIGHT = 64
-    TRANSPARENT = Colours.TRANSPARENT
+    PLAYER_WIDTH = 64
+    PLAYER_HEIGHT = 64
+    NAME_TEXT_SIZE = 12
 
     def __init__(self, width: int, height: int):
-        super(GameView, self).__init__()
+        super(FloorView, self).__init__()
 
         self.surface = pygame.Surface((width, height))
 
+        self._static_surface = None
+        self._static_key = None
+        self._static_cells = []
+        self._static_cell_rects = []
+        self._static_cell_index = {}
+        self._animated_cells = []
+
+        self._dirty_rects = []
+        self._last_rects = []
+        self._overlay_rects = []
+
+    # The floor that is being viewed
+    def get_floor(self):
+        return None
+
+    # Anything that the static layers depend on
+    def get_static_key(self, floor):
+        return floor, floor.map_version, floor.skin_name, self.surface.get_size()
+
+    # Anything drawn underneath the floor that needs redrawing every frame
+    def draw_background(self, surface):
+        pass
+
+    def get_background_rects(self):
+        return []
+
+    def get_player_offsets(self, x: int, player):
+        return 0, 0
+
+    def get_player_name_rect(self, view_x: int, view_y: int, player):
+        return None
+
+    def invalidate(self):
+        self._static_key = None
+
+    def get_dirty_rects(self):
+        return self._dirty_rects
+
+    # Record anything drawn over the floor so that the floor under it gets put back next frame
+    def add_overlay_rect(self, rect):
+        self._overlay_rects.append(pygame.Rect(rect))
+        self._dirty_rects.append(pygame.Rect(rect))
+
+    # Draw what is at a position on the floor and return the area of the surface that was drawn on
+    def draw_cell(self, surface, x: int, y: int, layer_id: int, view_object):
+        pass
+
+    def draw_floor(self, surface):
+
+        floor = self.get_floor()
+
+        if floor is None:
+            raise Exception("No Floor to view!")
+
+        static_key = self.get_static_key(floor)
+        is_rebuilt = static_key != self._static_key
+        if is_rebuilt is True:
+            self.build_static_layers(floor)
+            self._static_key = static_key
+            surface.blit(self._static_surface, (0, 0))
+
+        # Find the areas that can change from one frame to the next...
+        dynamic_cells = list(self._animated_cells)
+        layer_ids = floor.layers.keys()
+        for index in (floor.monster_index, floor.player_index):
+            for xyz in index.keys():
+                x, y, layer_id = xyz
+                if 0 <= x < floor.rect.width and 0 <= y < floor.rect.height and layer_id in layer_ids:
+                    rect = self.get_cell_rect(floor, x, y, layer_id, floor.get_occupant(x, y, layer_id))
+
+                    # Any static tile at this position is hidden by the occupant
+                    if xyz in self._static_cell_index:
+                        rect.union_ip(self._static_cell_rects[self._static_cell_index[xyz]])
+
+                    dynamic_cells.append((xyz, rect))
+
+        background_rects = self.get_background_rects()
+        current_rects = [pygame.Rect(rect) for rect in background_rects]
+        current_rects.extend(rect for xyz, rect in dynamic_cells)
+
+        # ...plus anything that was drawn last frame that now needs to be put back and redraw just those areas
+        areas = FloorView.merge_rects(current_rects + self._last_rects + self._overlay_rects)
+        for rect in areas:
+            self.draw_area(surface, floor, rect, dynamic_cells, rect.collidelist(background_rects) != -1)
+
+        self._last_rects = current_rects
+        self._overlay_rects = []
+
+        surface_rect = surface.get_rect()
+        if is_rebuilt is True:
+            self._dirty_rects = [surface_rect]
+        else:
+            self._dirty_rects = [rect.clip(surface_rect) for rect in areas if rect.colliderect(surface_rect)]
+
+        return surface
+
+    def build_static_layers(self, floor):
+
+        self._static_surface = pygame.Surface(self.surface.get_size())
+        self._static_surface.fill(self.BG_COLOUR)
+        self._static_cells = []
+        self._static_cell_rects = []
+        self._static_cell_index = {}
+        self._animated_cells = []
+
+        layer_ids = sorted(floor.layers.keys())
+
+        for x in range(0, floor.rect.width):
+            for y in range(0, floor.rect.height):
+                for layer_id in layer_ids:
+                    view_object = floor.get_floor_tile(x, y, layer_id, is_raw=True)
+                    if view_object is None:
+                        continue
+
+                    if View.image_manager.is_animated(view_object.name, floor.skin_name) is True:
+                        self._animated_cells.append(((x, y, layer_id),
+                                                     self.get_cell_rect(floor, x, y, layer_id, view_object)))
+                    else:
+                        rect = self.draw_cell(self._static_surface, x, y, layer_id, view_object)
+                        self._static_cell_index[(x, y, layer_id)] = len(self._static_cells)
+                        self._static_cells.append((x, y, layer_id))
+                        self._static_cell_rects.append(rect)
+
+    def draw_area(self, surface, floor, rect, dynamic_cells, is_background: bool = False):
+
+        surface.set_clip(rect)
+        surface.fill(self.BG_COLOUR)
+        if is_background is True:
+            self.draw_background(surface)
+
+        # Redraw everything that overlaps the area in the same order as the static layers were drawn
+        cells = set(self._static_cells[i] for i in rect.collidelistall(self._static_cell_rects))
+        cells.update(xyz for xyz, cell_rect in dynamic_cells if rect.colliderect(cell_rect))
+
+        for x, y, layer_id in sorted(cells):
+            view_object = floor.get_floor_tile(x, y, layer_id)
+            if view_object is not None:
+                self.draw_cell(surface, x, y, layer_id, view_object)
+
+        surface.set_clip(None)
+
+    # The area that anything drawn at a position on the floor could cover
+    def get_cell_rect(self, floor, x: int, y: int, layer_id: int, view_object):
+
+        view_x, view_y = self.model_to_view(x, y, layer_id)
+        rect = pygame.Rect(view_x, view_y, self.TILE_WIDTH, self.TILE_HEIGHT)
+
+        if isinstance(view_object, model.Player) is True:
+            tile_names = [model.Objects.BASE_GREEN, model.Objects.BASE_YELLOW]
+        else:
+            tile_names = [view_object.name]
+
+        if view_object.is_shadow is True:
+            tile_names.append(model.Objects.BASE_SHADOW)
+
+        for tile_name in tile_names:
+            for image in View.image_manager.get_skin_images(tile_name,
+                                                            skin_name=floor.skin_name,
+                                                            width=self.TILE_WIDTH,
+                                                            height=self.TILE_HEIGHT):
+                rect.union_ip(image.get_rect(topleft=(view_x, view_y)))
+
+        if isinstance(view_object, model.Player) is True:
+            x_offset, y_offset = self.get_player_offsets(x, view_object)
+            rect.union_ip((view_x - x_offset, view_y - y_offset, self.PLAYER_WIDTH, self.PLAYER_HEIGHT))
+            name_rect = self.get_player_name_rect(view_x - x_offset, view_y - y_offset, view_object)
+            if name_rect is not None:
+                rect.union_ip(name_rect)
+
+        return rect
+
+    def get_name_rect(self, name: str, x, y):
+        rect = pygame.Rect((0, 0), get_font(FloorView.NAME_TEXT_SIZE).size(name))
+        rect.centerx = x
+        rect.centery = y
+
+        return rect
+
+    @staticmethod
+    def merge_rects(rects: list):
+
+        merged = []
+
+        # Keep combining overlapping areas until none of them overlap
+        for rect in rects:
+            rect = pygame.Rect(rect)
+            i = rect.collidelist(merged)
+            while i != -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+
+        return merged
+
+    def model_to_view(self, x, y, layer_id):
+        return 0, 0
+
+
+class GameView(FloorView):
+    BG_COLOUR = Colours.BLACK
+    FG_COLOUR = Colours.WHITE
+    TILE_WIDTH = 64
+    TILE_HEIGHT = 64
+    TRANSPARENT = Colours.TRANSPARENT
+
+    def __init__(self, width: int, height: int):
+        super(GameView, self).__init__(width, height)
+
         self.game = None
+        self.floor = None
         self.player_view = PlayerView(GameView.TILE_WIDTH, GameView.TILE_HEIGHT)
 
     def initialise(self, game: model.Game):
@@ -967,76 +1432,75 @@ class GameView(View):
         super(GameView, self).tick()
         self.player_view.tick()
 
-    def draw_floor(self, surface):
-
+    def get_floor(self):
         self.floor = self.game.current_floor
+        return self.floor
 
-        if self.floor is None:
-            raise ("No Floor to view!")
+    def get_player_offsets(self, x: int, player):
 
-        skin_name = self.floor.skin_name
-
-        for x in range(0, self.floor.rect.width):
-            for y in range(0, self.floor.rect.height):
-                for layer_id in sorted(self.floor.layers.keys()):
-                    view_object = self.floor.get_floor_tile(x, y, layer_id)
-                    if view_object is not None:
+        x_offset = 0
+        y_offset = 0
 
-                        image_x, image_y = self.model_to_view(view_object.rect.x, view_object.rect.y, layer_id)
+        if player.is_dead() is False:
+            y_offset = 5 * (1 + math.cos((self.tick_count * math.pi / 8) + (x * math.pi / 7)))
 
-                        if view_object.is_shadow is True:
-                            # If this object needs a shadow
-                            image = View.image_manager.get_skin_image(model.Objects.BASE_SHADOW,
-                                                                      tick=self.tick_count,
-                                                                      width=BattleView.TILE_WIDTH,
-                                                                      height=BattleView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
+        return x_offset, y_offset
 
-                            image.set_alpha(100)
+    def draw_cell(self, surface, x: int, y: int, layer_id: int, view_object):
 
-                            surface.blit(image, (image_x, image_y))
+        skin_name = self.floor.skin_name
 
+        image_x, image_y = self.model_to_view(x, y, layer_id)
+        drawn_rect = pygame.Rect(image_x, image_y, 0, 0)
 
-                        if isinstance(view_object, model.Player):
+        if view_object.is_shadow is True:
+            # If this object needs a shadow
+            image = View.image_manager.get_skin_image(model.Objects.BASE_SHADOW,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=100)
 
-                            self.player_view.initialise(view_object)
-                            image = self.player_view.draw_player(GameView.TILE_WIDTH, GameView.TILE_HEIGHT)
+            drawn_rect.union_ip(surface.blit(image, (image_x, image_y)))
 
-                            if view_object.is_dead() is False:
+        if layer_id > 1:
+            d = self.floor.distance_to_camera((x, y, layer_id))
+            alpha = 100 + (d * 7)
+        else:
+            alpha = None
 
-                                y_offset = 5 * (
-                                1 + math.cos((self.tick_count * math.pi / 8) + (view_object.rect.x * math.pi / 7)))
+        if isinstance(view_object, model.Player):
 
-                            else:
-                                y_offset = 0
+            self.player_view.initialise(view_object)
+            image = self.player_view.draw_player(GameView.TILE_WIDTH, GameView.TILE_HEIGHT)
+            x_offset, y_offset = self.get_player_offsets(x, view_object)
 
-                        else:
+            # The player's image is drawn fresh each time so it is safe to fade it directly
+            if alpha is not None:
+                image.set_alpha(alpha)
 
-                            image = View.image_manager.get_skin_image(view_object.name,
-                                                                      tick=self.tick_count,
-                                                                      width=GameView.TILE_WIDTH,
-                                                                      height=GameView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
+        else:
 
-                            y_offset = 0
+            image = View.image_manager.get_skin_image(view_object.name,
+                                                      tick=self.tick_count,
+                                                      width=GameView.TILE_WIDTH,
+                                                      height=GameView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=alpha)
 
-                        if image is not None:
+            y_offset = 0
 
-                            if layer_id > 1:
-                                d = self.floor.distance_to_camera(view_object.xyz)
-                                image.set_alpha(100 + (d * 7))
-                            else:
-                                image.set_alpha(255)
+        if image is not None:
 
-                            surface.blit(image, (image_x, image_y - y_offset))
+            drawn_rect.union_ip(surface.blit(image, (image_x, image_y - y_offset)))
 
-        return surface
+        return drawn_rect
 
     def draw(self):
-        self.surface.fill(GameView.BG_COLOUR)
 
         if self.game is None:
-            raise ("No Game to view!")
+            raise Exception("No Game to view!")
 
         self.draw_floor(self.surface)
 
@@ -1053,7 +1517,7 @@ class GameView(View):
         return view_x, view_y
 
 
-class BattleView(View):
+class BattleView(FloorView):
     BG_COLOUR = Colours.DARK_GREY
     FG_COLOUR = Colours.WHITE
     TILE_WIDTH = 64
@@ -1066,9 +1530,7 @@ class BattleView(View):
     TRANSPARENT = Colours.TRANSPARENT
 
     def __init__(self, width: int, height: int):
-        super(BattleView, self).__init__()
-
-        self.surface = pygame.Surface((width, height))
+        super(BattleView, self).__init__(width, height)
 
         self.game = None
 
@@ -1079,6 +1541,8 @@ class BattleView(View):
         self.next_event = None
 
         self._show_names = True
+        self._current_player = None
+        self._current_target = None
 
     def initialise(self, game: model.Game):
         super(BattleView, self).initialise()
@@ -1100,212 +1564,242 @@ class BattleView(View):
         else:
             self._show_names = True
 
+    def get_floor(self):
+        return self.game.battle.battle_floor
+
+    def get_static_key(self, floor):
+        # Tiles above the current player's layer are drawn partly transparent
+        return super(BattleView, self).get_static_key(floor) + (self._current_player.layer,)
+
+    def get_player_offsets(self, x: int, player):
+
+        x_offset = 0
+        y_offset = 0
+
+        # Add y offset if object is an awake player to provide floating animation
+        if player.is_effect(model.Player.ASLEEP) is False and \
+                        player.is_effect(model.Player.FROZEN) is False and \
+                        player.is_effect(model.Player.SHOCKED) is False and \
+                        player.is_dead() is False:
+
+            y_offset = 5 * (1 + math.cos((self.tick_count * math.pi / 8) + (x * math.pi / 7)))
+
+        # Add x offset if object is a player who is attacking to provide animation
+        if player.is_effect(model.Player.ATTACKING) is True:
+            x_offset = 5 * ((self.tick_count % 3) - 1)
+
+        return x_offset, y_offset
+
+    def get_player_name_rect(self, view_x: int, view_y: int, player):
+        if self._show_names is False:
+            return None
+
+        return self.get_name_rect(player.character.name, view_x + BattleView.TILE_WIDTH/2, view_y)
+
+    def get_background_rects(self):
+        return [self.get_line_up_rect()]
+
+    def get_line_up_rect(self):
+        pane_rect = self.surface.get_rect()
+        line_up = self.game.battle.order_of_play
+        x = pane_rect.centerx - int(len(line_up) * (BattleView.LINE_UP_WIDTH + 3) / 2)
+        width = len(line_up) * (BattleView.LINE_UP_WIDTH + 6)
+
+        return pygame.Rect(x, 0, width, 8 + BattleView.LINE_UP_HEIGHT)
+
     def draw_floor(self, surface):
 
         if self.game.battle.battle_floor is None:
             raise Exception("No Floor to view!")
 
+        self._current_player = self.game.battle.get_current_player()
+        self._current_target = self.game.battle.get_current_target()
+
+        return super(BattleView, self).draw_floor(surface)
+
+    def draw_cell(self, surface, x: int, y: int, layer_id: int, view_object):
+
         floor = self.game.battle.battle_floor
 
         skin_name = floor.skin_name
 
-        current_player = self.game.battle.get_current_player()
-        current_target = self.game.battle.get_current_target()
+        current_player = self._current_player
+        current_target = self._current_target
 
-        for x in range(0, floor.rect.width):
-            for y in range(0, floor.rect.height):
-                for layer_id in sorted(floor.layers.keys()):
-
-                    view_object = floor.get_floor_tile(x, y, layer_id)
-
-                    if view_object is not None:
-
-                        # Calculate where on the view's surface to draw the object
-                        view_x, view_y = self.model_to_view(view_object.rect.x, view_object.rect.y, layer_id)
-
-
-                        if isinstance(view_object, model.Player):
-
-                            # Add y offset if object is an awake player to provide floating animation
-                            if view_object.is_effect(model.Player.ASLEEP) is False and \
-                                            view_object.is_effect(model.Player.FROZEN) is False and \
-                                            view_object.is_effect(model.Player.SHOCKED) is False and \
-                                            view_object.is_dead() is False:
-
-                                y_offset = 5 * (1 + math.cos((self.tick_count * math.pi / 8) + (view_object.rect.x * math.pi / 7)))
-
-                            # Add x offset if object is a player who is attacking to provide animation
-                            if view_object.is_effect(model.Player.ATTACKING) is True:
-                                x_offset = 5 * ((self.tick_count % 3) - 1)
-                        else:
-                            y_offset = 0
-                            x_offset = 0
-
-                        # Draw any base graphics before we draw the actual object
-                        # If this is the current player then highlight base in green
-                        if view_object == current_player:
-
-                            image = View.image_manager.get_skin_image(model.Objects.BASE_GREEN,
-                                                                      tick=self.tick_count,
-                                                                      width=BattleView.TILE_WIDTH,
-                                                                      height=BattleView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
-                            image.set_alpha(160)
-
-                            surface.blit(image, (view_x, view_y))
-
-                        # If this is the current target then highlight base in yellow
-                        elif view_object == current_target:
-
-                            image = View.image_manager.get_skin_image(model.Objects.BASE_YELLOW,
-                                                                      tick=self.tick_count,
-                                                                      width=BattleView.TILE_WIDTH,
-                                                                      height=BattleView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
-                            image.set_alpha(200)
-
-                            surface.blit(image, (view_x, view_y))
-
-                        if view_object.is_shadow is True:
-                            # If this object needs a shadow
-                            image = View.image_manager.get_skin_image(model.Objects.BASE_SHADOW,
-                                                                      tick=self.tick_count,
-                                                                      width=BattleView.TILE_WIDTH,
-                                                                      height=BattleView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
-
-                            image.set_alpha(100)
-
-                            surface.blit(image, (view_x, view_y))
-
-
-                        # If the object is a player draw the player plus any status effects
-                        if isinstance(view_object, model.Player) is True:
-
-                            self.player_view.initialise(view_object)
-                            image = self.player_view.draw_player()
-                            surface.blit(image, (view_x - x_offset, view_y - y_offset))
-
-                            if self._show_names is True:
-
-                                if view_object == current_player:
-                                    bg_colour = Colours.GREEN
-                                    fg_colour = Colours.BLACK
-                                elif view_object == current_target:
-                                    bg_colour = Colours.YELLOW
-                                    fg_colour = Colours.BLACK
-                                else:
-                                    team = self.game.battle.get_player_team(view_object)
-                                    fg_colour = Colours.WHITE
-                                    if team is not None:
-                                        bg_colour = team.colour
-                                    else:
-                                        bg_colour = Colours.GOLD
-
-                                draw_text(self.surface,
-                                          view_object.character.name,
-                                          x=view_x - x_offset + BattleView.TILE_WIDTH/2,
-                                          y=view_y - y_offset,
-                                          bg_colour=bg_colour,
-                                          fg_colour=fg_colour,
-                                          size=12,
-                                          centre=True,
-                                          alpha=100)
-
-                        else:
-                            # Get the image for the actual object to draw at this position
-                            image = View.image_manager.get_skin_image(view_object.name,
-                                                                      tick=self.tick_count,
-                                                                      width=BattleView.TILE_WIDTH,
-                                                                      height=BattleView.TILE_HEIGHT,
-                                                                      skin_name=skin_name)
-                            # If the image can be loaded...
-                            if image is not None:
-
-                                # Set the image alpha based on the layer so that higher layers are more transparent
-                                # if layer_id > current_player.layer:
-                                #     image.set_alpha(255 - (layer_id * BattleView.LAYER_ALPHA_MULTIPLIER))
-                                # else:
-                                #     image.set_alpha(255)
-
-                                # # Trying different transparency based on distance to view camera
-                                # surface.blit(image, (view_x - x_offset, view_y - y_offset))
-
-                                if layer_id > current_player.layer:
-                                    d = self.game.battle.battle_floor.distance_to_camera(view_object.xyz)
-                                    image.set_alpha(100 + (d * 7))
-                                else:
-                                    image.set_alpha(255)
-
-                                surface.blit(image, (view_x - x_offset, view_y - y_offset))
+        # Calculate where on the view's surface to draw the object
+        view_x, view_y = self.model_to_view(x, y, layer_id)
+        drawn_rect = pygame.Rect(view_x, view_y, 0, 0)
 
+        if isinstance(view_object, model.Player):
+            x_offset, y_offset = self.get_player_offsets(x, view_object)
+        else:
+            y_offset = 0
+            x_offset = 0
 
-        return surface
+        # Draw any base graphics before we draw the actual object
+        # If this is the current player then highlight base in green
+        if view_object == current_player:
 
-    def draw(self):
+            image = View.image_manager.get_skin_image(model.Objects.BASE_GREEN,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=160)
 
-        self.surface.fill(BattleView.BG_COLOUR)
+            drawn_rect.union_ip(surface.blit(image, (view_x, view_y)))
 
-        if self.game.battle is None:
-            raise Exception("No Battle to view!")
+        # If this is the current target then highlight base in yellow
+        elif view_object == current_target:
 
-        pane_rect = self.surface.get_rect()
+            image = View.image_manager.get_skin_image(model.Objects.BASE_YELLOW,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=200)
+
+            drawn_rect.union_ip(surface.blit(image, (view_x, view_y)))
+
+        if view_object.is_shadow is True:
+            # If this object needs a shadow
+            image = View.image_manager.get_skin_image(model.Objects.BASE_SHADOW,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=100)
+
+            drawn_rect.union_ip(surface.blit(image, (view_x, view_y)))
+
+
+        # If the object is a player draw the player plus any status effects
+        if isinstance(view_object, model.Player) is True:
+
+            self.player_view.initialise(view_object)
+            image = self.player_view.draw_player()
+            drawn_rect.union_ip(surface.blit(image, (view_x - x_offset, view_y - y_offset)))
+
+            if self._show_names is True:
+
+                if view_object == current_player:
+                    bg_colour = Colours.GREEN
+                    fg_colour = Colours.BLACK
+                elif view_object == current_target:
+                    bg_colour = Colours.YELLOW
+                    fg_colour = Colours.BLACK
+                else:
+                    team = self.game.battle.get_player_team(view_object)
+                    fg_colour = Colours.WHITE
+                    if team is not None:
+                        bg_colour = team.colour
+                    else:
+                        bg_colour = Colours.GOLD
+
+                draw_text(surface,
+                          view_object.character.name,
+                          x=view_x - x_offset + BattleView.TILE_WIDTH/2,
+                          y=view_y - y_offset,
+                          bg_colour=bg_colour,
+                          fg_colour=fg_colour,
+                          size=12,
+                          centre=True,
+                          alpha=100)
+
+        else:
+
+            # Set the image alpha based on the distance to the view camera so that higher layers are more transparent
+            if layer_id > current_player.layer:
+                d = floor.distance_to_camera((x, y, layer_id))
+                alpha = 100 + (d * 7)
+            else:
+                alpha = None
+
+            # Get the image for the actual object to draw at this position
+            image = View.image_manager.get_skin_image(view_object.name,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      skin_name=skin_name,
+                                                      alpha=alpha)
+            # If the image can be loaded...
+            if image is not None:
+
+                drawn_rect.union_ip(surface.blit(image, (view_x - x_offset, view_y - y_offset)))
+
+        return drawn_rect
+
+    # Draw the order of play
+    def draw_background(self, surface):
+
+        pane_rect = surface.get_rect()
         current_player = self.game.battle.get_current_player()
         current_player_team = self.game.battle.get_player_team(current_player)
         current_target = self.game.battle.get_current_target()
         current_target_team = self.game.battle.get_player_team(current_target)
 
-        # Draw the order of play
         line_up = self.game.battle.order_of_play
         x = pane_rect.centerx - int(len(line_up) * (BattleView.LINE_UP_WIDTH + 3) / 2)
         y = 8
         for player in line_up:
-            image = View.image_manager.get_skin_image(player.name,
-                                                      tick=self.tick_count,
-                                                      width=BattleView.TILE_WIDTH,
-                                                      height=BattleView.TILE_HEIGHT)
+            alpha = None
             if player != current_player:
 
                 if player == current_target:
-                    pygame.draw.rect(self.surface, current_target_team.colour,
+                    pygame.draw.rect(surface, current_target_team.colour,
                                      ((x, y - 2, BattleView.LINE_UP_WIDTH, BattleView.LINE_UP_HEIGHT)), 0)
-                    pygame.draw.rect(self.surface, Colours.YELLOW,
+                    pygame.draw.rect(surface, Colours.YELLOW,
                                      (x, y - 2, BattleView.LINE_UP_WIDTH, BattleView.LINE_UP_HEIGHT), 6)
-                    image.set_alpha(255)
                 else:
                     team = self.game.battle.get_player_team(player)
                     r, g, b = team.colour
 
                     s = pygame.Surface((BattleView.LINE_UP_WIDTH, BattleView.LINE_UP_HEIGHT), pygame.SRCALPHA)
                     s.fill((r, g, b, BattleView.NON_ACTIVE_PLAYER_ALPHA))
-                    self.surface.blit(s, (x, y - 2))
+                    surface.blit(s, (x, y - 2))
 
-                    image.set_alpha(BattleView.NON_ACTIVE_PLAYER_ALPHA)
+                    alpha = BattleView.NON_ACTIVE_PLAYER_ALPHA
             else:
-                pygame.draw.rect(self.surface, current_player_team.colour,
+                pygame.draw.rect(surface, current_player_team.colour,
                                  ((x, y - 2, BattleView.LINE_UP_WIDTH, BattleView.LINE_UP_HEIGHT)), 0)
-                pygame.draw.rect(self.surface, Colours.GREEN,
+                pygame.draw.rect(surface, Colours.GREEN,
                                  (x, y - 2, BattleView.LINE_UP_WIDTH, BattleView.LINE_UP_HEIGHT), 6)
-                image.set_alpha(255)
 
-            self.surface.blit(image, (x, y))
+            image = View.image_manager.get_skin_image(player.name,
+                                                      tick=self.tick_count,
+                                                      width=BattleView.TILE_WIDTH,
+                                                      height=BattleView.TILE_HEIGHT,
+                                                      alpha=alpha)
+
+            surface.blit(image, (x, y))
 
             x += BattleView.LINE_UP_WIDTH + 6
 
-        # Draw the whole battle floor
+    def draw(self):
+
+        if self.game.battle is None:
+            raise Exception("No Battle to view!")
+
+        pane_rect = self.surface.get_rect()
+        current_player = self.game.battle.get_current_player()
+        current_player_team = self.game.battle.get_player_team(current_player)
+        current_target = self.game.battle.get_current_target()
+        current_target_team = self.game.battle.get_player_team(current_target)
+
+        # Draw the whole battle floor with the order of play underneath it
         self.draw_floor(self.surface)
 
         # Draw the view of the current attacker
         if current_player is not None:
             self.attacker_view.initialise(current_player, current_player_team.colour, Colours.GREEN)
             surface = self.attacker_view.draw()
-            self.surface.blit(surface, (2, 2))
+            self.add_overlay_rect(self.surface.blit(surface, (2, 2)))
 
         # Draw the view of the current target
         if current_target is not None:
             self.opponent_view.initialise(current_target, current_target_team.colour, Colours.YELLOW)
             surface = self.opponent_view.draw()
-            self.surface.blit(surface, (pane_rect.width - surface.get_rect().width - 2, 2))
+            self.add_overlay_rect(self.surface.blit(surface, (pane_rect.width - surface.get_rect().width - 2, 2)))
 
         # Draw event text
         if self.next_event is not None:
@@ -1314,13 +1808,13 @@ class BattleView(View):
 
             msg = self.next_event.description
 
-            draw_text(self.surface,
-                      msg=msg,
-                      x=x,
-                      y=y,
-                      size=30,
-                      fg_colour=BattleView.FG_COLOUR,
-                      bg_colour=BattleView.BG_COLOUR)
+            self.add_overlay_rect(draw_text(self.surface,
+                                            msg=msg,
+                                            x=x,
+                                            y=y,
+                                            size=30,
+                                            fg_colour=BattleView.FG_COLOUR,
+                                            bg_colour=BattleView.BG_COLOUR))
 
         if self.game.battle.state == model.Battle.END:
             x = pane_rect.centerx
@@ -1330,13 +1824,13 @@ class BattleView(View):
 
             msg = "Team {0} Wins !".format(winning_team.name)
 
-            draw_text(self.surface,
-                      msg=msg,
-                      x=x,
-                      y=y,
-                      size=60,
-                      fg_colour=BattleView.FG_COLOUR,
-                      bg_colour=BattleView.BG_COLOUR)
+            self.add_overlay_rect(draw_text(self.surface,
+                                            msg=msg,
+                                            x=x,
+                                            y=y,
+                                            size=60,
+                                            fg_colour=BattleView.FG_COLOUR,
+                                            bg_colour=BattleView.BG_COLOUR))
 
     def end(self):
         super(BattleView, self).end()
@@ -1531,7 +2025,6 @@ class PlayerView(View):
             image_name = self.player.name
 
         image = View.image_manager.get_skin_image(image_name, tick=self.tick_count, width=width, height=height)
-        image.set_alpha(255)
 
         image = pygame.transform.scale(image, (width, height))
         surface1.blit(image, (0, 0))
@@ -1594,9 +2087,8 @@ class PlayerView(View):
             image = View.image_manager.get_skin_image(effect_name,
                                                       tick=self.tick_count,
                                                       width=width,
-                                                      height=height)
-
-            image.set_alpha(effect_alpha)
+                                                      height=height,
+                                                      alpha=effect_alpha)
 
             surface2.blit(image, (0, 0))
 